@@ -1,9 +1,6 @@
 import streamlit as st
 import json
 import os
-import mermaid as md
-from mermaid.graph import Graph
-import streamlit.components.v1 as components
 
 ###############################################################################
 # Utilities for displaying Mermaid code via `mermaid` Python library
@@ -12,6 +9,11 @@ def render_mermaid_diagram(code: str, diagram_title: str = "MermaidDiagram"):
     """
     Given a Mermaid 'code' string, render it in Streamlit using the `mermaid` library.
     """
+    # mermaid-py の読み込みは重い（IPython まで読み込む）ので、最初に図を描くときまで遅らせる
+    import mermaid as md
+    from mermaid.graph import Graph
+    import streamlit.components.v1 as components
+
     # Create a Graph object from the code
     # The first parameter (e.g. 'Sequence-diagram') is just an internal title;
     # it doesn't necessarily have to match the type of diagram unless the syntax needs it.
@@ -1,9 +1,6 @@
 import streamlit as st
 import json
 import os
-import mermaid as md
-from mermaid.graph import Graph
-import streamlit.components.v1 as components
 import re
 
 ###############################################################################
@@ -43,6 +40,11 @@ def render_mermaid_diagram(code: str, diagram_title: str = "MermaidDiagram"):
     1) インデントを正規化してパーサのエラーを回避
     2) それでも失敗したら、mermaidコードブロックとして直接表示
     """
+    # mermaid-py の読み込みは重い（IPython まで読み込む）ので、最初に図を描くときまで遅らせる
+    import mermaid as md
+    from mermaid.graph import Graph
+    import streamlit.components.v1 as components
+
     # 1) インデントなどを正規化
     normalized_code = normalize_mermaid_code(code)
 
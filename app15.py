@@ -1,9 +1,6 @@
 import streamlit as st
 import json
 import os
-import mermaid as md
-from mermaid.graph import Graph
-import streamlit.components.v1 as components
 import re
 
 ###############################################################################
@@ -45,6 +42,11 @@ def render_mermaid_diagram(code: str, diagram_title: str = "MermaidDiagram"):
     3) MermaidコードをHTMLとして表示 (mermaid ライブラリを使用)
     4) もし解析失敗したら、Mermaidコードをマークダウンブロックとして直接表示
     """
+    # mermaid-py の読み込みは重い（IPython まで読み込む）ので、最初に図を描くときまで遅らせる
+    import mermaid as md
+    from mermaid.graph import Graph
+    import streamlit.components.v1 as components
+
     # 1) インデントなどを正規化
     normalized_code = normalize_mermaid_code(code)
 
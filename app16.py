@@ -1,9 +1,6 @@
 import streamlit as st
 import json
 import os
-import mermaid as md
-from mermaid.graph import Graph
-import streamlit.components.v1 as components
 import re
 
 ###############################################################################
@@ -40,6 +37,11 @@ def render_mermaid_diagram(code: str, diagram_title: str = "MermaidDiagram"):
     """
     与えられた Mermaid 'code' を HTML に変換し、Streamlit 上で表示する。
     """
+    # mermaid-py の読み込みは重い（IPython まで読み込む）ので、最初に図を描くときまで遅らせる
+    import mermaid as md
+    from mermaid.graph import Graph
+    import streamlit.components.v1 as components
+
     normalized_code = normalize_mermaid_code(code)
     st.markdown("#### ▼ Mermaidコード（ベタ書き）")
     st.code(normalized_code, language='mermaid')
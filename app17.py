@@ -1,90 +1,61 @@
 import streamlit as st
 import json
 import os
-import mermaid as md
-from mermaid.graph import Graph
-import streamlit.components.v1 as components
-import re
+import uuid
+
+from dx_model import inherited_edges, split_section_key
+from dx_export import ENCODINGS, build_delta_export, build_full_export, decode_export, encode_export
+from dx_keys import AnnotationKeyIndex, content_hash, distinct_project_ids
+from dx_resume import load_exports, projects_by_id
+from dx_corpus import project_company
+from dx_registry import CorpusRegistry, load_shared_corpus
+from dx_tree_check import TreeCheck
+from dx_dedup import build_index as build_dedup_index, propagate_ratings
+from dx_rapid_rating import batch_to_annotations, qa_rating_items, rapid_rating
+from dx_render_cache import RenderBundle, RenderCache, TreeBundle, build_tree_bundle, mermaid_html
+from dx_status import StatusCounters, build_counters
+from dx_rescore import RATING_WEIGHTS
+from dx_links import PARENT, ProjectLinks, tree_node_labels
+from dx_tree_diff import MATCH, RENAME, DELETE, INSERT, highlighted_code, pair_graphs, rank_pairs, tree_diff, tree_pairs
 
 ###############################################################################
 # Utilities for displaying Mermaid code via `mermaid` library
 ###############################################################################
 
-def normalize_mermaid_code(mermaid_code: str) -> str:
+@st.cache_resource
+def get_corpus_registry() -> CorpusRegistry:
     """
-    Mermaidコード中の行頭インデントを自動調整して、パーサがエラーを起こしにくい形に整える。
+    解析済みコーパスの登録簿（プロセス内で1つ。全セッションで共有する）。
     """
-    lines = mermaid_code.splitlines()
-    # 空行を除いた最小インデントを求める
-    min_indent = None
-    for line in lines:
-        if line.strip() == "":
-            continue
-        leading_spaces = len(line) - len(line.lstrip())
-        if min_indent is None or leading_spaces < min_indent:
-            min_indent = leading_spaces
-
-    # 各行から min_indent 分だけ左に寄せる
-    if min_indent and min_indent > 0:
-        new_lines = []
-        for line in lines:
-            if line.strip() == "":
-                new_lines.append("")
-            else:
-                new_lines.append(line[min_indent:])
-        return "\n".join(new_lines)
-    else:
-        return mermaid_code
+    return CorpusRegistry()
+
+@st.cache_resource
+def get_render_cache() -> RenderCache:
+    """
+    描画バンドルのキャッシュ（プロセス内で1つ。中身は .render_cache/ に永続化される）。
+    """
+    return RenderCache()
 
-def render_mermaid_diagram(code: str, diagram_title: str = "MermaidDiagram"):
+def render_mermaid_diagram(tree_bundle: TreeBundle):
     """
-    与えられた Mermaid 'code' を HTML に変換し、Streamlit 上で表示する。
+    描画バンドルに保存済みの Mermaid 図の HTML を Streamlit 上で表示する。
     """
-    normalized_code = normalize_mermaid_code(code)
+    import streamlit.components.v1 as components
+
+    normalized_code = tree_bundle.normalized_code
     st.markdown("#### ▼ Mermaidコード（ベタ書き）")
     st.code(normalized_code, language='mermaid')
 
-    try:
-        graph = Graph(diagram_title, normalized_code)
-        rendered = md.Mermaid(graph)
-        mermaid_html = rendered._repr_html_()
-
+    if tree_bundle.html is not None:
         components.html(
-            mermaid_html,
+            tree_bundle.html,
             height=800,
             scrolling=True
         )
-
-    except Exception as e:
-        st.warning(f"Mermaid解析に失敗しました (理由: {e}). Mermaidコードを直接表示します。")
+    else:
+        st.warning(f"Mermaid解析に失敗しました (理由: {tree_bundle.html_error}). Mermaidコードを直接表示します。")
         st.markdown(f"```mermaid\n{normalized_code}\n```")
 
-def parse_mermaid_node_labels(mermaid_code: str) -> dict:
-    """
-    Mermaidコードから node -> label の対応を抽出。
-    """
-    pattern = r"([A-Za-z0-9_]+)\[([^\]]+)\]"
-    node_label_map = {}
-    for match in re.finditer(pattern, mermaid_code):
-        node = match.group(1).strip()
-        label = match.group(2).strip()
-        node_label_map[node] = label
-    return node_label_map
-
-def parse_mermaid_edges(mermaid_code: str) -> dict:
-    """
-    Mermaidコードから `nodeA --> nodeB` の形を抽出して隣接リストを返す。
-    """
-    edge_pattern = r"([A-Za-z0-9_]+)\s*-+>\s*([A-Za-z0-9_]+)"
-    adjacency = {}
-    for match in re.finditer(edge_pattern, mermaid_code):
-        parent = match.group(1).strip()
-        child = match.group(2).strip()
-        adjacency.setdefault(parent, []).append(child)
-        if child not in adjacency:
-            adjacency[child] = []
-    return adjacency
-
 ###############################################################################
 # 階層スライダー表示（※変更箇所）
 ###############################################################################
@@ -94,7 +65,8 @@ def render_hierarchical_sliders(
     node_label_map: dict,
     base_key: str,
     parent_factor: float = 1.0,
-    level: int = 0
+    level: int = 0,
+    inherited_base_keys: dict = None
 ):
     """
     指定ノードから下位へ、各子ノードへの重要度（importance_factor）の配分を行います。
@@ -103,7 +75,9 @@ def render_hierarchical_sliders(
       - 従来、親ノードから子ノードへはスライダーで割合を入力していましたが、
         ここでは各子ノードが親ノードに対してどのくらい寄与している（大事だと思うか）を
         「低い／普通／高い」の3段階で評価してもらい、その数値をもとに比率を計算します。
-      - なお、【スライダーUIの対象から除外】するラベル（例：深さ3で既に評価済みの「フォークリフト移動削減」「メンテナンスコスト削減」）はそのまま再帰呼び出ししています。
+      - 浅い深さバリエーション（depth3 など）と共通の辺は、そちらの評価を引き継いで表示だけ行い、
+        新しく増えた子ノードだけを評価してもらいます。
+        inherited_base_keys は (親ID, 子ID) -> 引き継ぎ元ツリーの base_key。
     """
     indent = "    " * level
     label = node_label_map.get(node, node)
@@ -115,83 +89,83 @@ def render_hierarchical_sliders(
     if not children:
         return
 
-    # ---【ここから新規処理】---
-    # スライダーUIの対象から除外するラベル（深さ3で既に評価済みのもの）
-    skip_slider_labels = {"フォークリフト移動削減", "メンテナンスコスト削減"}
-    non_skip_children = []
-    skip_children = []
+    rating_options = ["低い", "普通", "高い"]
+    mapping = RATING_WEIGHTS
+    st.markdown(f"{indent}以下の各子ノードに対して、親ノード **{label}** に対する寄与度を3段階で評価してください。（低い＝1、普通＝2、高い＝3）")
+    rating_values = []
     for child in children:
         child_label = node_label_map.get(child, child)
-        if child_label in skip_slider_labels:
-            skip_children.append(child)
+        child_rating_key = f"{base_key}_{node}_child_{child}_rating"
+        source_base_key = (inherited_base_keys or {}).get((node, child))
+        inherited_rating = None
+        if source_base_key is not None:
+            inherited_rating = st.session_state["annotations"].get(f"{source_base_key}_{node}_child_{child}_rating_text")
+        if inherited_rating in rating_options:
+            # 浅いバリエーションで評価済みの辺は聞き直さない
+            rating_choice = inherited_rating
+            st.caption(f"{indent}子ノード **{child_label}** の寄与度評価: {rating_choice}（浅い深さのツリーの評価を引き継ぎ）")
         else:
-            non_skip_children.append(child)
-    # ---【ここまで新規処理】---
-
-    # 【変更箇所】非スキップ対象の子ノードに対して、3段階評価で寄与度を入力
-    if non_skip_children:
-        st.markdown(f"{indent}以下の各子ノードに対して、親ノード **{label}** に対する寄与度を3段階で評価してください。（低い＝1、普通＝2、高い＝3）")
-        rating_values = []
-        for child in non_skip_children:
-            child_label = node_label_map.get(child, child)
-            child_rating_key = f"{base_key}_{node}_child_{child}_rating"
+            saved_rating = st.session_state["annotations"].get(f"{child_rating_key}_text", "普通")
             rating_choice = st.radio(
                 f"{indent}子ノード **{child_label}** の寄与度評価:",
-                options=["低い", "普通", "高い"],
-                index=1,
+                options=rating_options,
+                index=rating_options.index(saved_rating) if saved_rating in rating_options else 1,
                 key=child_rating_key
             )
-            mapping = {"低い": 1, "普通": 2, "高い": 3}
-            numeric_rating = mapping[rating_choice]
-            rating_values.append(numeric_rating)
-            st.session_state["annotations"][f"{base_key}_{node}_child_{child}_rating_text"] = rating_choice
-            st.session_state["annotations"][f"{base_key}_{node}_child_{child}_rating_numeric"] = numeric_rating
-
-        total_rating = sum(rating_values)
-        for i, child in enumerate(non_skip_children):
-            child_label = node_label_map.get(child, child)
-            if total_rating > 0:
-                ratio = rating_values[i] / total_rating
-            else:
-                ratio = 1.0 / len(non_skip_children)
-            child_factor = parent_factor * ratio
-            ratio_key = f"{base_key}_{node}_child_{child}_ratio"
-            st.session_state["annotations"][ratio_key] = ratio
-            col1, col2 = st.columns([4, 1])
-            with col1:
-                st.markdown(f"{indent}子ノード **{child_label}**: 寄与評価 {rating_values[i]} (比率: {ratio:.2f})  |  重要度: {child_factor:.2f}")
-            with col2:
-                st.progress(int(child_factor * 100))
-            render_hierarchical_sliders(
-                node=child,
-                adjacency=adjacency,
-                node_label_map=node_label_map,
-                base_key=base_key,
-                parent_factor=child_factor,
-                level=level+1
-            )
-    # スキップ対象（既に深さ3で評価済み）の子ノードは、直接再帰呼び出しする
-    for child in skip_children:
+        numeric_rating = mapping[rating_choice]
+        rating_values.append(numeric_rating)
+        st.session_state["annotations"][f"{base_key}_{node}_child_{child}_rating_text"] = rating_choice
+        st.session_state["annotations"][f"{base_key}_{node}_child_{child}_rating_numeric"] = numeric_rating
+
+    total_rating = sum(rating_values)
+    for i, child in enumerate(children):
+        child_label = node_label_map.get(child, child)
+        if total_rating > 0:
+            ratio = rating_values[i] / total_rating
+        else:
+            ratio = 1.0 / len(children)
+        child_factor = parent_factor * ratio
+        ratio_key = f"{base_key}_{node}_child_{child}_ratio"
+        st.session_state["annotations"][ratio_key] = ratio
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            st.markdown(f"{indent}子ノード **{child_label}**: 寄与評価 {rating_values[i]} (比率: {ratio:.2f})  |  重要度: {child_factor:.2f}")
+        with col2:
+            st.progress(int(child_factor * 100))
         render_hierarchical_sliders(
             node=child,
             adjacency=adjacency,
             node_label_map=node_label_map,
             base_key=base_key,
-            parent_factor=parent_factor,
-            level=level+1
+            parent_factor=child_factor,
+            level=level+1,
+            inherited_base_keys=inherited_base_keys
         )
 
 ###############################################################################
 # ユニークキー付きウィジェット
 ###############################################################################
+def update_status_counters(state_key: str, value):
+    """
+    ダッシュボードの集計を1件分だけ更新する（評価キー以外は何もしない）。
+    """
+    counters = st.session_state.get("status_counters")
+    if counters is not None:
+        counters.update(state_key, value)
+
 def get_radio_value(label: str, options: list, state_key: str) -> str:
-    default_value = st.session_state["annotations"].get(state_key, options[-1])
+    annotations = st.session_state["annotations"]
+    # 推定ラベル（未確認）はウィジェットの初期値にだけ使い、アノテーションには入れない（エクスポート・集計の対象外）
+    prelabel = st.session_state.get("prelabeled", {}).get(state_key)
+    default_value = prelabel or annotations.get(state_key, options[-1])
     if default_value in options:
         idx = options.index(default_value)
     else:
         idx = 0
     selected = st.radio(label, options, index=idx, key=state_key)
-    st.session_state["annotations"][state_key] = selected
+    value = annotations.get(state_key, options[-1]) if selected == prelabel else selected
+    annotations[state_key] = value
+    update_status_counters(state_key, value)
     return selected
 
 def get_text_area_value(label: str, state_key: str) -> str:
@@ -200,16 +174,50 @@ def get_text_area_value(label: str, state_key: str) -> str:
     st.session_state["annotations"][state_key] = text
     return text
 
+###############################################################################
+# ほぼ重複するコンテンツ（dx_dedup）
+###############################################################################
+def render_duplicate_note(file_idx: int, proj_idx: int, suffix: str) -> bool:
+    """
+    このアイテムがほぼ重複のクラスタに属していれば注記を出す。
+    「代表だけ評価する」が有効で、かつ代表でない場合は True（評価ウィジェットを出さない）を返す。
+    """
+    index = st.session_state.get("dedup_index")
+    key_index = st.session_state.get("key_index")
+    if index is None or key_index is None:
+        return False
+    pid = key_index.project_id_for(file_idx, proj_idx)
+    cluster = index.cluster_of(pid, suffix)
+    if cluster is None:
+        return False
+    rep_pid, rep_suffix = cluster.representative
+    if (pid, suffix) == (rep_pid, rep_suffix):
+        st.caption(f"ほぼ重複: このアイテムはほか {len(cluster.members) - 1} 件のクラスタの代表です（類似度 {cluster.similarity:.2f} 以上）")
+        return False
+    rep_label = index.labels().get((rep_pid, rep_suffix), rep_pid)
+    st.caption(f"ほぼ重複: 代表は「{rep_label}」です（類似度 {cluster.similarity:.2f} 以上）")
+    return bool(st.session_state.get("dedup_representatives_only"))
+
 ###############################################################################
 # ROI算定
 ###############################################################################
-def annotate_roi(file_idx: int, proj_idx: int, project: dict):
+def render_quantity_issues(issues: list):
+    """
+    数値の整合性チェック（dx_quantity）で見つかった不整合を表示する。
+    """
+    for issue in issues or []:
+        st.warning(f"数値チェック: {issue.message}")
+
+def annotate_roi(file_idx: int, proj_idx: int, bundle: RenderBundle, quantity_checks: dict = None):
     st.subheader("■ ROI算定評価")
-    if "ROI算定" in project["table"]:
+    if bundle.roi_markdown is not None:
         st.markdown("**ROI算定（原文）:**")
-        for item in project["table"]["ROI算定"]:
-            st.write(f"- {item}")
+        st.markdown(bundle.roi_markdown)
+    render_quantity_issues((quantity_checks or {}).get("roi"))
+    render_quantity_issues((quantity_checks or {}).get("factors"))
 
+    if render_duplicate_note(file_idx, proj_idx, "_roi"):
+        return
     base_key = f"file{file_idx}_proj{proj_idx}_roi"
     roi_good_or_bad_key = base_key + "_good_or_bad"
     roi_comment_key = base_key + "_comment"
@@ -220,80 +228,332 @@ def annotate_roi(file_idx: int, proj_idx: int, project: dict):
 ###############################################################################
 # Q&A (Assignment / Suggest)
 ###############################################################################
-def annotate_q_and_a(file_idx: int, proj_idx: int, q_and_a_dict: dict, qa_type: str = "assignment"):
+###############################################################################
+# 長いリストのページ表示（表示中の範囲だけウィジェットを作る）
+###############################################################################
+QA_PAGE_SIZES = (5, 10, 20, 50)
+DEFAULT_QA_PAGE_SIZE = 10
+
+def move_cursor(state_key: str, step: int, n_positions: int):
+    st.session_state[state_key] = min(max(st.session_state.get(state_key, 0) + step, 0), n_positions - 1)
+
+def render_window_controls(n_items: int, state_key: str, describe) -> range:
+    """
+    n_items 件を1ページ st.session_state["qa_page_size"] 件ずつに分け、ページ移動の UI を出して表示範囲を返す。
+    ページ位置は state_key に保持する。describe(start, end) はページ選択肢の表示文字列。
+    """
+    page_size = st.session_state.get("qa_page_size", DEFAULT_QA_PAGE_SIZE)
+    n_pages = max((n_items + page_size - 1) // page_size, 1)
+    if n_pages == 1:
+        return range(n_items)
+    if st.session_state.get(state_key, 0) >= n_pages:
+        st.session_state[state_key] = n_pages - 1
+    prev_col, select_col, next_col = st.columns([1, 6, 1])
+    prev_col.button("←", key=f"{state_key}_prev", on_click=move_cursor, args=(state_key, -1, n_pages),
+                    disabled=st.session_state.get(state_key, 0) == 0)
+    next_col.button("→", key=f"{state_key}_next", on_click=move_cursor, args=(state_key, 1, n_pages),
+                    disabled=st.session_state.get(state_key, 0) == n_pages - 1)
+    select_col.selectbox(
+        "ページ", range(n_pages), key=state_key, label_visibility="collapsed",
+        format_func=lambda page: f"{page + 1}/{n_pages}  " + describe(page * page_size, min((page + 1) * page_size, n_items)),
+    )
+    page = st.session_state[state_key]
+    return range(page * page_size, min((page + 1) * page_size, n_items))
+
+def annotate_q_and_a(file_idx: int, proj_idx: int, qa_entries: list, qa_type: str = "assignment",
+                     section_key: str = None, links: ProjectLinks = None):
+    """
+    qa_entries は描画バンドルの平坦化済み Q&A（QAEntry のリスト）。
+    表示中のページの分だけウィジェットを作る（ページ外の評価は st.session_state["annotations"] に残る）。
+    links があれば、ツリーに存在しないノードを参照している Q&A 項目に印を付ける。
+    """
     st.subheader(f"■ Q&A評価 ({qa_type})")
 
-    for depth_key, qa_list in q_and_a_dict.items():
-        st.markdown(f"### {depth_key}")
+    window = render_window_controls(
+        len(qa_entries), f"qa_window_file{file_idx}_proj{proj_idx}_{qa_type}",
+        lambda start, end: f"{start + 1}〜{end}問目（{qa_entries[start].depth_key} {qa_entries[start].qa_idx}番目〜）",
+    )
+    current_depth = current_item = None
+    for entry in qa_entries[window.start:window.stop]:
+        depth_key, qa_item_idx, q_idx = entry.depth_key, entry.qa_idx, entry.q_idx
+        if depth_key != current_depth:
+            st.markdown(f"### {depth_key}")
+            current_depth, current_item = depth_key, None
+        if qa_item_idx != current_item:
+            current_item = qa_item_idx
+            if entry.parent and entry.child:
+                st.markdown(f"**{entry.parent} → {entry.child}**")
+            elif entry.child:
+                st.markdown(f"**{entry.child}**")
+            link = links.items.get((section_key, depth_key, qa_item_idx)) if links is not None else None
+            if link is not None and link.unresolved:
+                target = f"{link.tree_section}.{link.tree_depth}" if link.tree_depth else "対応するROIツリー"
+                refs = "、".join(f"{'親' if role == PARENT else '子'}ノード「{raw}」" for role, raw in link.unresolved)
+                st.warning(f"{target} に存在しないノードを参照しています: {refs}")
 
-        for qa_item_idx, qa_item in enumerate(qa_list):
-            parent = qa_item.get("parentNode", "")
-            child = qa_item.get("childNode", "")
-            if parent or child:
-                if parent and child:
-                    st.markdown(f"**{parent} → {child}**")
-                elif child:
-                    st.markdown(f"**{child}**")
-
-            questions = qa_item.get("questions", [])
-            for q_idx, q_item in enumerate(questions):
-                question = q_item.get("question", "")
-                answer = q_item.get("answer", "")
-
-                with st.chat_message("user"):
-                    st.write(question)
-                with st.chat_message("assistant"):
-                    st.write(answer)
-
-                base_key = f"file{file_idx}_proj{proj_idx}_{qa_type}_QAndA_{depth_key}_{qa_item_idx}_{q_idx}"
-                qa_good_or_bad_key = base_key + "_good_or_bad"
-                qa_comment_key = base_key + "_comment"
-
-                get_radio_value(
-                    f"このQ&Aは良い？悪い？ ( {depth_key}, {qa_item_idx}番目, 質問{q_idx} )",
-                    ["良い", "悪い", "未評価"],
-                    qa_good_or_bad_key
-                )
-                get_text_area_value(
-                    f"どこが悪い？ ( {depth_key}, {qa_item_idx}番目, 質問{q_idx} )",
-                    qa_comment_key
-                )
+        with st.chat_message("user"):
+            st.write(entry.question)
+        with st.chat_message("assistant"):
+            st.write(entry.answer)
+
+        if render_duplicate_note(file_idx, proj_idx, f"_{qa_type}_QAndA_{depth_key}_{qa_item_idx}_{q_idx}"):
+            continue
+        base_key = f"file{file_idx}_proj{proj_idx}_{qa_type}_QAndA_{depth_key}_{qa_item_idx}_{q_idx}"
+        qa_good_or_bad_key = base_key + "_good_or_bad"
+        qa_comment_key = base_key + "_comment"
+
+        flags = labeling_flags(base_key)
+        if flags is not None:
+            verdict = f"「{flags.label}」寄り" if flags.label else "判定が割れています"
+            reasons = " / ".join([f"✗ {rule}" for rule in flags.bad_rules] + [f"✓ {rule}" for rule in flags.good_rules])
+            st.caption(f"🔎 ルール検査: {verdict}（{reasons}）")
+        prediction = apply_prelabel(base_key)
+        if prediction is not None:
+            unconfirmed = "・初期値に反映（未確認）" if qa_good_or_bad_key in st.session_state.get("prelabeled", {}) else ""
+            st.caption(f"🤖 推定: {prediction.label}（確信度 {prediction.confidence:.0%}）{unconfirmed}")
+        get_radio_value(
+            f"このQ&Aは良い？悪い？ ( {depth_key}, {qa_item_idx}番目, 質問{q_idx} )",
+            ["良い", "悪い", "未評価"],
+            qa_good_or_bad_key
+        )
+        get_text_area_value(
+            f"どこが悪い？ ( {depth_key}, {qa_item_idx}番目, 質問{q_idx} )",
+            qa_comment_key
+        )
+
+###############################################################################
+# ルールによる Q&A の機械的な検査（dx_labeling）
+###############################################################################
+def build_labeling_votes(documents: list) -> tuple:
+    """
+    全 Q&A の (QACorpus, 投票の行列, ウィジェットキーの接頭辞 -> ItemFlags) を作る（ファイル構成が変わったときだけ作り直す）。
+    """
+    from dx_labeling import apply_functions as apply_labeling_functions, flatten as flatten_qa, item_flags
+
+    file_hashes = tuple(document.file_hash for document in documents)
+    if st.session_state.get("labeling_file_hashes") != file_hashes:
+        corpus = flatten_qa(build_qa_examples(documents))
+        votes = apply_labeling_functions(corpus)
+        st.session_state["labeling_votes"] = (corpus, votes, item_flags(corpus, votes))
+        st.session_state["labeling_file_hashes"] = file_hashes
+    return st.session_state["labeling_votes"]
+
+def labeling_flags(base_key: str):
+    """
+    ルール検査が有効なら、その Q&A の ItemFlags（どのルールも投票していなければ None）。
+    """
+    if not st.session_state.get("labeling_enabled") or "labeling_votes" not in st.session_state:
+        return None
+    return st.session_state["labeling_votes"][2].get(base_key)
+
+def render_labeling_sidebar(documents: list):
+    with st.sidebar:
+        st.markdown("### Q&A のルール検査")
+        if not st.checkbox("ルールで機械的に検査する", key="labeling_enabled"):
+            return
+        corpus, votes, flags = build_labeling_votes(documents)
+        n_bad = sum(1 for flag in flags.values() if flag.label == "悪い")
+        st.caption(f"{len(corpus.keys)} 件中 {n_bad} 件がルールの判定で「悪い」寄りです。")
+        with st.expander("ルールごとの集計", expanded=False):
+            from dx_labeling import gold_votes, rule_stats
+
+            gold = gold_votes(corpus, st.session_state["annotations"])
+            for stat in rule_stats(votes, gold=gold):
+                accuracy = f"・人手の評価との一致 {stat.accuracy:.0%}（{stat.n_gold}件）" if stat.accuracy is not None else ""
+                st.write(f"- **{stat.description}**: {stat.votes}件（カバー率 {stat.coverage:.1%}・重なり {stat.overlap:.0%}・衝突 {stat.conflict:.0%}）{accuracy}")
+
+###############################################################################
+# Q&A の事前ラベル（dx_prelabel）
+###############################################################################
+PRELABEL_RETRAIN_STEP = 20      # 前回の学習から評価がこれだけ増減したら学び直す
+
+def build_qa_examples(documents: list) -> list:
+    """
+    全 Q&A を平らにした QAExample のリスト（ファイル構成が変わったときだけ作り直す。事前ラベルとルール検査で共有）。
+    """
+    from dx_prelabel import qa_examples
+
+    file_hashes = tuple(document.file_hash for document in documents)
+    if st.session_state.get("qa_examples_file_hashes") != file_hashes:
+        st.session_state["qa_examples"] = qa_examples(documents)
+        st.session_state["qa_examples_file_hashes"] = file_hashes
+    return st.session_state["qa_examples"]
+
+def build_prelabel_features(documents: list) -> tuple:
+    """
+    全 Q&A の (QAExample のリスト, 特徴量) を作る（ファイル構成が変わったときだけ作り直す）。
+    """
+    from dx_prelabel import featurize as featurize_qa
+
+    file_hashes = tuple(document.file_hash for document in documents)
+    if st.session_state.get("prelabel_file_hashes") != file_hashes:
+        examples = build_qa_examples(documents)
+        st.session_state["prelabel_features"] = (examples, featurize_qa(examples))
+        st.session_state["prelabel_file_hashes"] = file_hashes
+        st.session_state.pop("prelabel_predictions", None)
+        st.session_state.pop("prelabel_report", None)
+    return st.session_state["prelabel_features"]
+
+def apply_prelabel(base_key: str):
+    """
+    推定があればその Prediction を返す。確信度がしきい値以上で未評価なら、推定ラベルをウィジェットの初期値にする。
+    推定ラベルは session_state["prelabeled"] にだけ持ち、アノテーションには書かない（確定したときに書く）。
+    一度アノテータが変えた項目には入れ直さない。
+    """
+    predicted = st.session_state.get("prelabel_predictions")
+    if not predicted or not st.session_state.get("prelabel_enabled"):
+        return None
+    prediction = predicted.get(base_key)
+    if prediction is None:
+        return None
+    key = f"{base_key}_good_or_bad"
+    prelabeled = st.session_state.setdefault("prelabeled", {})
+    dismissed = st.session_state.setdefault("prelabel_dismissed", set())
+    rated = st.session_state["annotations"].get(key, "未評価")
+    # ウィジェットの値はこのあと get_radio_value でアノテーションに反映されるので、こちらを先に見る
+    current = st.session_state.get(key, rated)
+    if key in prelabeled:
+        # アノテータが別の値を選んだか、高速評価などで評価済みになった
+        if current != prelabeled[key] or rated != "未評価":
+            del prelabeled[key]
+            dismissed.add(key)
+    elif key not in dismissed and current == "未評価" and prediction.confidence >= st.session_state.get("prelabel_threshold", 0.9):
+        # ウィジェットを作る前なので、ウィジェットの状態を捨てて推定ラベルから初期化させる
+        st.session_state.pop(key, None)
+        prelabeled[key] = prediction.label
+    return prediction
+
+def render_prelabel_sidebar(documents: list):
+    with st.sidebar:
+        st.markdown("### Q&A の事前ラベル（自動推定）")
+        enabled = st.checkbox("評価済みの Q&A から良い/悪いを推定する", key="prelabel_enabled")
+        if not enabled:
+            return
+        # numpy を読み込むので、事前ラベルを有効にしたときだけ読み込む
+        from dx_prelabel import predictions as predict_qa, train as train_prelabel
+
+        st.slider("推定ラベルを初期値に入れる確信度", 0.5, 1.0, 0.9, 0.01, key="prelabel_threshold")
+        examples, matrix = build_prelabel_features(documents)
+        annotations = st.session_state["annotations"]
+        n_labeled = sum(1 for e in examples if annotations.get(f"{e.key}_good_or_bad") in ("良い", "悪い"))
+        report = st.session_state.get("prelabel_report")
+        retrain = st.button("今すぐ学習し直す", key="prelabel_retrain")
+        if retrain or report is None or abs(n_labeled - report.n_train) >= PRELABEL_RETRAIN_STEP:
+            model, report = train_prelabel(matrix, examples, annotations)
+            st.session_state["prelabel_report"] = report
+            if model is not None:
+                st.session_state["prelabel_predictions"] = predict_qa(model, matrix, examples)
+            else:
+                st.session_state.pop("prelabel_predictions", None)
+        if "prelabel_predictions" not in st.session_state:
+            st.caption(f"学習には 良い / 悪い がそれぞれ 5 件以上必要です（現在 良い {report.n_good} / 悪い {report.n_bad}）。")
+            return
+        accuracy = f"・取り分けた 2 割での正解率 {report.holdout_accuracy:.0%}" if report.holdout_accuracy is not None else ""
+        st.caption(f"{report.n_train} 件で学習（良い {report.n_good} / 悪い {report.n_bad}, {report.seconds:.1f} 秒）{accuracy}")
+
+        prelabeled = st.session_state.get("prelabeled", {})
+        if prelabeled:
+            st.write(f"推定ラベルで埋めた未確認の評価: {len(prelabeled)} 件")
+            col1, col2 = st.columns(2)
+            if col1.button("すべて確定", key="prelabel_confirm"):
+                apply_annotation_values(dict(prelabeled))
+                prelabeled.clear()
+                st.rerun()
+            if col2.button("すべて取り消す", key="prelabel_revert"):
+                st.session_state.setdefault("prelabel_dismissed", set()).update(prelabeled)
+                apply_annotation_values({key: "未評価" for key in prelabeled})
+                prelabeled.clear()
+                st.rerun()
+
+def is_non_representative(file_idx: int, proj_idx: int, suffix: str) -> bool:
+    index = st.session_state.get("dedup_index")
+    key_index = st.session_state.get("key_index")
+    if index is None or key_index is None:
+        return False
+    pid = key_index.project_id_for(file_idx, proj_idx)
+    cluster = index.cluster_of(pid, suffix)
+    return cluster is not None and cluster.representative != (pid, suffix)
+
+def render_rapid_rating(documents: list):
+    """
+    Q&A を1問ずつキーボードで評価するモード。評価はブラウザ側でまとめてから届く。
+    """
+    st.markdown("## Q&A 高速評価モード")
+    st.caption("下の枠を一度クリックしてから、G（良い）/ B（悪い）/ S（スキップ）/ C（コメント）で評価してください。")
+    col1, col2 = st.columns(2)
+    with col1:
+        unrated_only = st.checkbox("未評価の質問だけ", value=True, key="rapid_unrated_only")
+    with col2:
+        batch_size = st.number_input("まとめて送信する件数", min_value=1, max_value=100, value=10, key="rapid_batch_size")
+
+    skip = is_non_representative if st.session_state.get("dedup_representatives_only") else None
+    items = qa_rating_items(documents, st.session_state["annotations"], unrated_only, skip)
+    predicted = st.session_state.get("prelabel_predictions")
+    if predicted and st.checkbox("モデルが迷っている順に並べる", value=True, key="rapid_uncertainty_order"):
+        from dx_prelabel import uncertainty_order
+
+        rank = {key: i for i, key in enumerate(uncertainty_order([item["key"] for item in items], predicted))}
+        items.sort(key=lambda item: rank[item["key"]])
+        for item in items:
+            if item["key"] in predicted:
+                item["context"] += f" / 推定: {predicted[item['key']].label} {predicted[item['key']].confidence:.0%}"
+    batch = rapid_rating(items, batch_size=int(batch_size), key="rapid_rating")
+    if batch and batch.get("batch_id") != st.session_state.get("rapid_rating_last_batch"):
+        st.session_state["rapid_rating_last_batch"] = batch["batch_id"]
+        apply_annotation_values(batch_to_annotations(batch))
+        # 反映後の状態（未評価の一覧など）でコンポーネントを描き直す
+        st.rerun()
 
 ###############################################################################
 # ROIツリー (Assignment / Suggest)
 ###############################################################################
+def render_tree_check(check: TreeCheck):
+    """
+    取り込み時の構造チェック結果を、ツリーの上に事前フラグとして表示する。
+    """
+    errors = [issue for issue in check.issues if issue.level == "error"]
+    others = [issue for issue in check.issues if issue.level != "error"]
+    summary = f"実際の深さ {check.max_depth} / ノード数 {check.n_nodes} / 最大分岐数 {check.max_branching}"
+    if errors:
+        st.error("構造チェックで問題が見つかりました（" + summary + "）\n\n" + "\n".join(f"- {i.message}" for i in errors))
+    else:
+        st.caption(f"構造チェック: 問題なし（{summary}）")
+    for issue in others:
+        st.caption(f"構造チェック [{issue.level}]: {issue.message}")
+
 def annotate_roi_trees(
     file_idx: int,
     proj_idx: int,
     roi_trees_dict: dict,
-    tree_type: str = "assignment"
+    tree_type: str = "assignment",
+    tree_checks: dict = None,
+    quantity_checks: dict = None,
+    tree_bundles: dict = None
 ):
     st.subheader(f"■ ROIツリー評価 ({tree_type})")
 
     for depth_key, tree_data in roi_trees_dict.items():
         st.markdown(f"### {depth_key}")
 
-        mermaid_code = tree_data.get("graph", "")
-        mermaid_code = mermaid_code.replace("(", "（").replace(")", "）")
+        check = (tree_checks or {}).get(depth_key)
+        if check is not None:
+            render_tree_check(check)
+        render_quantity_issues((quantity_checks or {}).get(depth_key))
 
-        if not mermaid_code:
-            st.warning(f"{depth_key} には 'graph' がありません。")
-            continue
-
-        render_mermaid_diagram(mermaid_code, diagram_title=f"{tree_type}_{depth_key}")
-        node_label_map = parse_mermaid_node_labels(mermaid_code)
-        adjacency = parse_mermaid_edges(mermaid_code)
+        tree_bundle = (tree_bundles or {}).get(depth_key) or build_tree_bundle(tree_data.graph, f"{tree_type}_{depth_key}")
+        render_mermaid_diagram(tree_bundle)
+        node_label_map = tree_bundle.node_label_map
+        adjacency = tree_bundle.adjacency
 
-        all_children = set()
-        for parent, children in adjacency.items():
-            for c in children:
-                all_children.add(c)
-        roots = [node for node in adjacency.keys() if node not in all_children]
+        roots = tree_bundle.roots
         if not roots:
             st.info("ルートノードが見つかりませんでした。")
             continue
 
         st.write("#### 階層スライダーで子ノードに配分")
+        inherited = inherited_edges(roi_trees_dict, depth_key)
+        if inherited:
+            st.caption(f"浅い深さのツリーと共通の {len(inherited)} 本の辺は評価を引き継ぎます。新しく増えた子ノードだけを評価してください。")
         for root in roots:
             base_key_for_root = f"file{file_idx}_proj{proj_idx}_{tree_type}_roiTrees_{depth_key}_{root}"
             render_hierarchical_sliders(
@@ -302,9 +562,15 @@ def annotate_roi_trees(
                 node_label_map=node_label_map,
                 base_key=base_key_for_root,
                 parent_factor=1.0,
-                level=0
+                level=0,
+                inherited_base_keys={
+                    edge: f"file{file_idx}_proj{proj_idx}_{tree_type}_roiTrees_{source_depth_key}_{root}"
+                    for edge, source_depth_key in inherited.items()
+                }
             )
 
+        if render_duplicate_note(file_idx, proj_idx, f"_{tree_type}_roiTrees_{depth_key}"):
+            continue
         base_key2 = f"file{file_idx}_proj{proj_idx}_{tree_type}_roiTrees_{depth_key}"
         good_or_bad_key = f"{base_key2}_good_or_bad"
         comment_key = f"{base_key2}_comment"
@@ -319,6 +585,517 @@ def extract_annotations_for_project(file_idx: int, proj_idx: int) -> dict:
             result[k] = v
     return result
 
+###############################################################################
+# ROIツリー同士の比較（木の編集距離, dx_tree_diff）
+###############################################################################
+_DIFF_OPS = {RENAME: "🟧 置き換え", DELETE: "🟥 左だけ", INSERT: "🟩 右だけ"}
+TREE_DIFF_RANKING_TOP = 50
+
+def pair_title(pair) -> str:
+    return f"{pair.left_section}.{pair.left_depth} ↔ {pair.right_section}.{pair.right_depth}"
+
+def highlighted_html(code: str, title: str) -> tuple:
+    """
+    色分けした Mermaid 図の HTML（同じコードはセッション内で使い回す）。
+    """
+    rendered = st.session_state.setdefault("tree_diff_html", {})
+    if code not in rendered:
+        rendered[code] = mermaid_html(code, title)
+    return rendered[code]
+
+def render_tree_diff(project, pair):
+    """
+    2つのツリーを左右に並べ、置き換え・片方だけにあるノードを色分けして表示する。
+    """
+    import streamlit.components.v1 as components
+
+    left_graph, right_graph = pair_graphs(project, pair)
+    diff = tree_diff(left_graph, right_graph)
+    counts = {op: sum(1 for node in diff.alignment if node.op == op) for op in (MATCH, RENAME, DELETE, INSERT)}
+    st.caption(
+        f"編集距離 {diff.distance:.1f}（正規化 {diff.normalized:.0%}）: 一致 {counts[MATCH]} / 置き換え {counts[RENAME]}"
+        f" / 左だけ {counts[DELETE]} / 右だけ {counts[INSERT]}"
+    )
+    columns = st.columns(2)
+    for column, side, section_key, depth_key, graph in (
+        (columns[0], "left", pair.left_section, pair.left_depth, left_graph),
+        (columns[1], "right", pair.right_section, pair.right_depth, right_graph),
+    ):
+        with column:
+            st.markdown(f"**{section_key}.{depth_key}**")
+            code = highlighted_code(graph, diff.alignment, side)
+            html, error = highlighted_html(code, f"{side}_{depth_key}")
+            if html is not None:
+                components.html(html, height=500, scrolling=True)
+            else:
+                st.warning(f"Mermaid解析に失敗しました (理由: {error}). Mermaidコードを直接表示します。")
+                st.code(code, language="mermaid")
+    changes = [node for node in diff.alignment if node.op != MATCH]
+    if changes:
+        st.markdown("\n".join(
+            f"- {_DIFF_OPS[node.op]}: "
+            + (f"`{node.left_id}` {node.left_label}" if node.left_id is not None else "")
+            + (" → " if node.op == RENAME else "")
+            + (f"`{node.right_id}` {node.right_label}" if node.right_id is not None else "")
+            for node in changes
+        ))
+
+def render_project_tree_diff(file_idx: int, proj_idx: int, project):
+    pairs = tree_pairs(project, file_idx, proj_idx)
+    if not pairs or not st.checkbox("ツリーを並べて比較（木の編集距離）", key=f"tree_diff_file{file_idx}_proj{proj_idx}"):
+        return
+    choice = st.selectbox(
+        "比較するツリーの組", range(len(pairs)), format_func=lambda i: pair_title(pairs[i]),
+        key=f"tree_diff_pair_file{file_idx}_proj{proj_idx}"
+    )
+    render_tree_diff(project, pairs[choice])
+
+def build_tree_diff_ranking(documents: list) -> list:
+    """
+    全プロジェクトの木の組を食い違いの大きい順に並べる（ファイル構成が変わったときだけ計算し直す）。
+    """
+    file_hashes = tuple(document.file_hash for document in documents)
+    if st.session_state.get("tree_diff_file_hashes") != file_hashes:
+        st.session_state["tree_diff_ranking"] = rank_pairs(documents)
+        st.session_state["tree_diff_file_hashes"] = file_hashes
+    return st.session_state["tree_diff_ranking"]
+
+def render_tree_diff_ranking(documents: list):
+    st.markdown("## ツリーの食い違いランキング")
+    kinds = {"all": "すべて", "mode": "assignment と suggest", "depth": "深さ違い（depth3 ↔ 4 ↔ 5）"}
+    kind = st.radio("比較する組", list(kinds), format_func=kinds.get, horizontal=True, key="tree_diff_kind")
+    ranked = [r for r in build_tree_diff_ranking(documents) if kind == "all" or r.pair.kind == kind]
+    if not ranked:
+        st.info("比較できるツリーの組がありません。")
+        return
+    st.caption(f"{len(ranked)} 組のうち、正規化した編集距離の大きい上位 {min(len(ranked), TREE_DIFF_RANKING_TOP)} 組")
+    top = ranked[:TREE_DIFF_RANKING_TOP]
+    choice = st.selectbox(
+        "表示する組", range(len(top)),
+        format_func=lambda i: (
+            f"{top[i].normalized:.0%}（距離 {top[i].distance:.1f}）"
+            f" {documents[top[i].pair.file_idx].name} / {top[i].pair.company}: {pair_title(top[i].pair)}"
+        ),
+        key="tree_diff_choice"
+    )
+    pair = top[choice].pair
+    render_tree_diff(documents[pair.file_idx].projects[pair.proj_idx], pair)
+
+###############################################################################
+# ノードごとの Q&A（dx_links の索引）
+###############################################################################
+def render_node_qa_view(file_idx: int, proj_idx: int, project, links: ProjectLinks):
+    """
+    ツリーのノードを選ぶと、そのノードを親・子として参照している Q&A を一覧にする（評価はここでは表示だけ）。
+    """
+    trees = [(section_key, depth_key) for section_key, depths in project.roi_trees.items() for depth_key in depths]
+    if not trees or not st.checkbox("ノードごとに Q&A を見る", key=f"node_view_file{file_idx}_proj{proj_idx}"):
+        return
+    col1, col2 = st.columns(2)
+    tree_choice = col1.selectbox(
+        "ツリー", range(len(trees)), format_func=lambda i: f"{trees[i][0]}.{trees[i][1]}",
+        key=f"node_view_tree_file{file_idx}_proj{proj_idx}"
+    )
+    tree_section, tree_depth = trees[tree_choice]
+    node_labels = tree_node_labels(project.roi_trees[tree_section][tree_depth].graph)
+    if not node_labels:
+        st.info("ノードが見つかりませんでした。")
+        return
+    node_ids = list(node_labels)
+    node_id = col2.selectbox(
+        "ノード", node_ids,
+        format_func=lambda n: f"{n}（{node_labels[n]}） Q&A {len(links.nodes.get((tree_section, tree_depth, n), ()))}件",
+        key=f"node_view_node_file{file_idx}_proj{proj_idx}"
+    )
+    refs = links.nodes.get((tree_section, tree_depth, node_id), ())
+    if not refs:
+        st.caption("このノードを参照している Q&A はありません。")
+        return
+    annotations = st.session_state["annotations"]
+    for section_key, depth_key, qa_idx, role in refs:
+        qa_item = project.qa[section_key][depth_key][qa_idx]
+        mode = split_section_key(section_key)[1]
+        st.markdown(
+            f"**{'親' if role == PARENT else '子'}ノードとして参照** — {section_key} / {depth_key} / {qa_idx}番目: "
+            f"{qa_item.parent or ''} → {qa_item.child or ''}"
+        )
+        for q_idx, question in enumerate(qa_item.questions):
+            rating = annotations.get(f"file{file_idx}_proj{proj_idx}_{mode}_QAndA_{depth_key}_{qa_idx}_{q_idx}_good_or_bad", "未評価")
+            st.markdown(f"- [{question.qtype_raw or '?'}] {question.question} → {question.answer}（評価: {rating}）")
+
+###############################################################################
+# 取り込み（ファイルごとに1回だけ検証・正規化する）
+###############################################################################
+def ingest_uploaded_files(uploaded_files: list) -> list:
+    """
+    アップロードされた各ファイルを検証・正規化し、IngestedFile のリストを返す。
+    解析結果と検査結果はプロセス内の登録簿で内容ハッシュごとに1つだけ持ち、同じファイルを開いている全セッションで共有する。
+    """
+    session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex)
+    content_keys = st.session_state.setdefault("content_keys", {})
+    loaders = {}
+    order = []
+    for uploaded_file in uploaded_files:
+        upload_key = getattr(uploaded_file, "file_id", None) or (uploaded_file.name, uploaded_file.size)
+        key = content_keys.get(upload_key)
+        if key is None:
+            key = content_keys[upload_key] = content_hash(uploaded_file.getvalue())
+        # 登録簿に無いときだけ呼ばれる（他のセッションが同じ内容を読み込み済みなら解析しない）
+        loaders[key] = lambda uploaded_file=uploaded_file, key=key: load_shared_corpus(uploaded_file.getvalue(), uploaded_file.name, key)
+        order.append(key)
+    corpora = get_corpus_registry().retain(session_id, loaders)
+
+    documents = []
+    analyses = []
+    for key in order:
+        corpus = corpora[key]
+        documents.extend(corpus.documents)
+        analyses.extend([corpus.analyses] * len(corpus.documents))
+    # このセッションでのプロジェクトID -> (共有コーパスの ProjectAnalyses, 共有コーパス側のプロジェクトID)
+    # 同じ内容のファイルが2回以上アップロードされたら、コピーごとに別のプロジェクトIDを付ける
+    # （共有コーパスの検査結果はそのまま使い、このセッションの対応表だけ別IDで引けるようにする）
+    project_analyses = st.session_state["project_analyses"] = {}
+    for file_idx, project_ids in enumerate(distinct_project_ids(documents)):
+        document = documents[file_idx]
+        for pid, session_pid in zip(document.project_ids, project_ids):
+            project_analyses[session_pid] = (analyses[file_idx], pid)
+        if project_ids != document.project_ids:
+            documents[file_idx] = document._replace(project_ids=project_ids)
+    return documents
+
+def project_analysis(pid: str):
+    """
+    プロジェクトの検査結果と Q&A とノードの索引（dx_registry.ProjectAnalysis）。初めて引いたときに作られる。
+    """
+    analyses, shared_pid = st.session_state["project_analyses"].get(pid, (None, None))
+    return analyses.get(shared_pid) if analyses is not None else None
+
+def build_key_index(documents: list) -> AnnotationKeyIndex:
+    """
+    現在のアップロード順でのウィジェットキー接頭辞と、安定プロジェクトIDの対応表を作る。
+    """
+    index = AnnotationKeyIndex()
+    for file_idx, document in enumerate(documents):
+        for proj_idx, pid in enumerate(document.project_ids):
+            # .dxc のプロジェクトは企業名だけを表から読む（Project 全体は表示するときに読む）
+            index.register(
+                file_idx, proj_idx, pid,
+                file_name=document.name,
+                file_hash=document.file_hash,
+                company_name=project_company(document.projects, proj_idx) or f"Unknown_{proj_idx}",
+            )
+    st.session_state["key_index"] = index
+    return index
+
+def report_ingest_issues(documents: list):
+    """
+    取り込み時に見つかった問題をまとめて表示する。
+    """
+    errors = [issue for document in documents for issue in document.issues if issue.level == "error"]
+    warnings = [issue for document in documents for issue in document.issues if issue.level != "error"]
+    for issue in errors:
+        st.error(f"{issue.path}: {issue.message}")
+    if warnings:
+        with st.expander(f"取り込み時の正規化・注意事項（{len(warnings)}件）", expanded=False):
+            for issue in warnings:
+                st.write(f"- [{issue.level}] {issue.path}: {issue.message}")
+
+def apply_annotation_values(values: dict):
+    """
+    アノテーションの値を書き込み、対応するウィジェットの状態を捨てる（次の描画でアノテーションの値から初期化させる）。
+    """
+    for key, value in values.items():
+        st.session_state["annotations"][key] = value
+        update_status_counters(key, value)
+        st.session_state.pop(key, None)
+        if key.endswith("_rating_text"):
+            st.session_state.pop(key[:-len("_text")], None)
+
+def build_duplicate_index(documents: list):
+    """
+    アップロード中のファイル全体でほぼ重複のクラスタを作る（ファイル構成が変わったときだけ作り直す）。
+    """
+    file_hashes = tuple(document.file_hash for document in documents)
+    if st.session_state.get("dedup_file_hashes") != file_hashes:
+        st.session_state["dedup_index"] = build_dedup_index(documents)
+        st.session_state["dedup_file_hashes"] = file_hashes
+    return st.session_state["dedup_index"]
+
+def build_status_counters(documents: list) -> StatusCounters:
+    """
+    ダッシュボード用の集計を作る（ファイル構成が変わったときだけ、現在のアノテーションから数え直す）。
+    """
+    file_hashes = tuple(document.file_hash for document in documents)
+    if st.session_state.get("status_file_hashes") != file_hashes:
+        st.session_state["status_counters"] = build_counters(documents, st.session_state["annotations"])
+        st.session_state["status_file_hashes"] = file_hashes
+    return st.session_state["status_counters"]
+
+def render_status_dashboard(counters: StatusCounters):
+    """
+    ファイル × プロジェクト × セクションごとの評価の進み具合と「悪い」の割合をヒートマップで表示する。
+    """
+    import altair as alt
+    import pandas as pd
+
+    st.markdown("## 評価状況ダッシュボード")
+    rows = pd.DataFrame(counters.rows())
+    if rows.empty:
+        st.info("集計対象の評価項目がありません。")
+        return
+
+    total = rows[["total", "good", "bad", "unrated"]].sum()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("評価済み", f"{int(total['good'] + total['bad'])} / {int(total['total'])}")
+    col2.metric("未評価", int(total["unrated"]))
+    col3.metric("「悪い」の割合", f"{total['bad'] / max(1, total['good'] + total['bad']):.0%}")
+
+    grouped = rows.groupby(["file", "company", "section"], as_index=False)[["total", "good", "bad", "unrated"]].sum()
+    grouped["project"] = grouped["file"] + " / " + grouped["company"]
+    grouped["completion"] = (grouped["good"] + grouped["bad"]) / grouped["total"]
+    rated = grouped["good"] + grouped["bad"]
+    grouped["bad_ratio"] = (grouped["bad"] / rated.where(rated > 0)).astype(float)
+
+    metrics = {"completion": "評価済みの割合", "bad_ratio": "「悪い」の割合（評価済みのうち）"}
+    metric = st.radio("表示する指標", list(metrics), format_func=metrics.get, horizontal=True, key="status_metric")
+    scheme = "greens" if metric == "completion" else "reds"
+    section_order = sorted(grouped["section"].unique(), key=lambda s: (s != "ROI算定", s))
+    heatmap = alt.Chart(grouped).mark_rect().encode(
+        x=alt.X("section:N", title="セクション", sort=section_order),
+        y=alt.Y("project:N", title="ファイル / プロジェクト"),
+        color=alt.Color(f"{metric}:Q", title=metrics[metric], scale=alt.Scale(domain=[0, 1], scheme=scheme)),
+        tooltip=["file", "company", "section", "total", "good", "bad", "unrated",
+                 alt.Tooltip("completion:Q", format=".0%"), alt.Tooltip("bad_ratio:Q", format=".0%")],
+    ).properties(height=max(200, 24 * grouped["project"].nunique()))
+    st.altair_chart(heatmap, width="stretch")
+
+    qa_rows = rows[rows["questionType"] != ""]
+    if not qa_rows.empty:
+        st.markdown("### Q&A: questionType 別")
+        by_type = qa_rows.groupby(["questionType", "section"], as_index=False)[["total", "good", "bad", "unrated"]].sum()
+        rated = by_type["good"] + by_type["bad"]
+        by_type["completion"] = rated / by_type["total"]
+        by_type["bad_ratio"] = (by_type["bad"] / rated.where(rated > 0)).astype(float)
+        chart = alt.Chart(by_type).mark_rect().encode(
+            x=alt.X("section:N", title="セクション"),
+            y=alt.Y("questionType:N", title="questionType"),
+            color=alt.Color(f"{metric}:Q", title=metrics[metric], scale=alt.Scale(domain=[0, 1], scheme=scheme)),
+            tooltip=["questionType", "section", "total", "good", "bad", "unrated"],
+        )
+        st.altair_chart(chart, width="stretch")
+
+def render_dedup_sidebar(documents: list, key_index: AnnotationKeyIndex):
+    with st.sidebar:
+        st.markdown("### ほぼ重複するコンテンツ")
+        # 全プロジェクトの本文を読むので、有効にしたときだけ作る
+        if not st.checkbox("ほぼ重複するものを探す", key="dedup_enabled"):
+            st.session_state.pop("dedup_index", None)
+            st.session_state.pop("dedup_file_hashes", None)
+            return
+        dedup_index = build_duplicate_index(documents)
+        counts = {}
+        for cluster in dedup_index.clusters:
+            counts[cluster.kind] = counts.get(cluster.kind, 0) + len(cluster.members) - 1
+        if not dedup_index.clusters:
+            st.caption("ほぼ重複するプロジェクト・ツリー・回答はありません。")
+            return
+        st.write(
+            f"{len(dedup_index.clusters)} クラスタ（代表以外: プロジェクト {counts.get('project', 0)} 件, "
+            f"ツリー {counts.get('tree', 0)} 件, 回答 {counts.get('answer', 0)} 件）"
+        )
+        st.checkbox("クラスタの代表だけを評価する", key="dedup_representatives_only")
+        overwrite = st.checkbox("評価済みのものも上書きする", key="dedup_overwrite")
+        if st.button("代表の評価をクラスタ内に反映", key="dedup_propagate"):
+            updates = propagate_ratings(dedup_index, st.session_state["annotations"], key_index.prefix_for, overwrite)
+            apply_annotation_values(updates)
+            st.success(f"{len([k for k in updates if k.endswith('_good_or_bad')])} 件に代表の評価を反映しました。")
+
+def render_resume_sidebar(documents: list, key_index: AnnotationKeyIndex):
+    """
+    過去にダウンロードしたアノテーション結果（複数可）を読み込み、セッションのアノテーションに反映する。
+    """
+    with st.sidebar:
+        st.markdown("### 前回の作業を再開")
+        resume_files = st.file_uploader(
+            "アノテーション結果の JSON（annotations_all.json / {企業名}_annotations.json / *_annotated.json）",
+            type=["json", "gz"],
+            accept_multiple_files=True,
+            key="resume_uploader"
+        )
+        if resume_files and st.button("読み込んで反映", key="resume_apply"):
+            named_documents = []
+            for resume_file in resume_files:
+                try:
+                    named_documents.append((resume_file.name, decode_export(resume_file.getvalue())))
+                except Exception as e:
+                    st.error(f"{resume_file.name} の読み込み中にエラーが発生しました: {e}")
+            report = load_exports(named_documents, key_index, projects_by_id(documents))
+            apply_annotation_values(report.applied)
+            st.session_state["resume_report"] = report
+            # 読み込んだ状態を「エクスポート済み」とみなし、次の差分エクスポートはこれ以降の変更だけにする
+            st.session_state["export_sequence"] = max(st.session_state.get("export_sequence", -1), report.sequence)
+            st.session_state["export_baseline"] = key_index.stable_annotations(st.session_state["annotations"])
+
+        report = st.session_state.get("resume_report")
+        if report is not None:
+            st.success(f"{len(report.applied)} 件のアノテーションを反映しました。")
+            for source, count in report.sources.items():
+                st.write(f"- {source}: {count} 件")
+            if report.unmapped:
+                with st.expander(f"現在のデータに対応しないキー（{len(report.unmapped)}件）"):
+                    for source, key in report.unmapped:
+                        st.write(f"- {source}: `{key}`")
+
+###############################################################################
+# エクスポート（ボタンを押したときだけ生成する）
+###############################################################################
+def render_export_section(key_index: AnnotationKeyIndex):
+    """
+    全件 / 前回エクスポートからの差分 のどちらかを、選んだ形式で生成してダウンロードさせる。
+    生成は「作成」ボタンを押したときだけ行い、通常の再実行ではアノテーション件数に比例する処理をしない。
+    """
+    st.markdown("## 全ファイル・プロジェクトに対するアノテーション結果のダウンロード")
+    col1, col2 = st.columns(2)
+    with col1:
+        scope = st.radio("範囲", ["すべて", "前回のエクスポートからの差分"], key="export_scope", horizontal=True)
+    with col2:
+        encoding = st.selectbox(
+            "形式",
+            list(ENCODINGS.keys()),
+            format_func=lambda k: ENCODINGS[k][0],
+            key="export_encoding"
+        )
+
+    if st.button("エクスポートを作成", key="export_build"):
+        sequence = st.session_state.get("export_sequence", -1) + 1
+        baseline = st.session_state.get("export_baseline")
+        annotations = st.session_state["annotations"]
+        if scope == "すべて" or baseline is None:
+            payload, baseline = build_full_export(key_index, annotations, sequence)
+            file_stem = "annotations_all"
+        else:
+            payload, baseline = build_delta_export(key_index, annotations, baseline, sequence)
+            file_stem = f"annotations_delta_{sequence:04d}"
+        _, extension, mime = ENCODINGS[encoding]
+        st.session_state["export_sequence"] = sequence
+        st.session_state["export_baseline"] = baseline
+        st.session_state["export_file"] = (encode_export(payload, encoding), f"{file_stem}{extension}", mime)
+        st.success(f"エクスポート #{sequence} を作成しました（{len(payload['annotations'])} 件）。")
+
+    if "export_file" in st.session_state:
+        data, file_name, mime = st.session_state["export_file"]
+        st.download_button(
+            label=f"{file_name} をダウンロード",
+            data=data,
+            file_name=file_name,
+            mime=mime
+        )
+
+###############################################################################
+# プロジェクトの表示と移動（次に表示するプロジェクトの描画バンドルを先読みする）
+###############################################################################
+PREFETCH_AHEAD = 2
+
+def project_heading(document, proj_idx: int) -> str:
+    project = document.projects[proj_idx]
+    company_name = project.company or f"Unknown_{proj_idx}"
+    purpose = project.purpose or "不明な課題"
+    analysis = project_analysis(document.project_ids[proj_idx])
+    n_tree_errors = sum(
+        1 for checks in (analysis.tree_checks if analysis else {}).values() for check in checks.values()
+        if any(issue.level == "error" for issue in check.issues)
+    )
+    structure_flag = f"  ⚠ 構造エラーのあるツリー {n_tree_errors}件" if n_tree_errors else ""
+    n_unresolved = len(analysis.links.unresolved_items()) if analysis is not None else 0
+    if n_unresolved:
+        structure_flag += f"  ⚠ 存在しないノードを参照する Q&A {n_unresolved}件"
+    return f"[{company_name}] / 課題: {purpose}{structure_flag}"
+
+def prefetch_bundles(documents: list, positions: list):
+    """
+    positions（(file_idx, proj_idx) の表示順）の描画バンドルをバックグラウンドで作り始める。
+    """
+    get_render_cache().prefetch(
+        (documents[file_idx].projects[proj_idx], documents[file_idx].project_ids[proj_idx])
+        for file_idx, proj_idx in positions
+    )
+
+def render_project_navigator(documents: list, positions: list) -> int:
+    """
+    1プロジェクトずつ表示するときの移動 UI。表示するプロジェクトの位置（positions の添字）を返す。
+    """
+    if st.session_state.get("project_cursor", 0) >= len(positions):
+        st.session_state["project_cursor"] = 0
+    labels = [
+        f"{documents[file_idx].name} / {project_company(documents[file_idx].projects, proj_idx) or f'Unknown_{proj_idx}'}"
+        for file_idx, proj_idx in positions
+    ]
+    prev_col, select_col, next_col = st.columns([1, 6, 1])
+    prev_col.button("← 前へ", key="project_prev", on_click=move_cursor, args=("project_cursor", -1, len(positions)),
+                    disabled=st.session_state.get("project_cursor", 0) == 0)
+    next_col.button("次へ →", key="project_next", on_click=move_cursor, args=("project_cursor", 1, len(positions)),
+                    disabled=st.session_state.get("project_cursor", 0) == len(positions) - 1)
+    select_col.selectbox(
+        "プロジェクト", range(len(positions)), format_func=lambda i: f"{i + 1}/{len(positions)}  {labels[i]}",
+        key="project_cursor", label_visibility="collapsed",
+    )
+    return st.session_state["project_cursor"]
+
+def render_project(file_idx: int, proj_idx: int, document, bundle: RenderBundle):
+    project = document.projects[proj_idx]
+    company_name = project.company or f"Unknown_{proj_idx}"
+    analysis = project_analysis(document.project_ids[proj_idx])
+    tree_checks = analysis.tree_checks if analysis is not None else {}
+    quantity_checks = analysis.quantity_checks if analysis is not None else {}
+
+    annotate_roi(file_idx, proj_idx, bundle, quantity_checks)
+
+    for mode in ["assignment", "suggest"]:
+        for rkey in project.sections("roiTrees", mode):
+            st.markdown(f"### ROIツリー: {rkey}")
+            annotate_roi_trees(
+                file_idx, proj_idx, project.roi_trees[rkey], mode,
+                tree_checks.get(rkey), quantity_checks.get(rkey), bundle.trees.get(rkey)
+            )
+
+    render_project_tree_diff(file_idx, proj_idx, project)
+    links = analysis.links if analysis is not None else None
+    if links is not None:
+        render_node_qa_view(file_idx, proj_idx, project, links)
+
+    for mode in ["assignment", "suggest"]:
+        for qkey in project.sections("QAndA", mode):
+            st.markdown(f"### Q&A: {qkey}")
+            annotate_q_and_a(file_idx, proj_idx, bundle.qa[qkey], mode, qkey, links)
+
+    save_button_key = f"save_btn_file{file_idx}_proj{proj_idx}"
+    download_state_key = f"download_data_{file_idx}_{proj_idx}"
+    if st.button(f"『{company_name}』の評価を保存", key=save_button_key):
+        proj_annotations = extract_annotations_for_project(file_idx, proj_idx)
+        st.session_state[download_state_key] = json.dumps(
+            {
+                "file_idx": file_idx,
+                "proj_idx": proj_idx,
+                "company_name": company_name,
+                "project_id": document.project_ids[proj_idx],
+                "file_name": document.name,
+                "file_hash": document.file_hash,
+                "annotations": proj_annotations
+            },
+            ensure_ascii=False,
+            indent=2
+        )
+        st.success(f"『{company_name}』の評価結果を保存しました（サンプル）")
+
+    if download_state_key in st.session_state:
+        st.download_button(
+            label=f"『{company_name}』の評価をJSONでダウンロード",
+            data=st.session_state[download_state_key],
+            file_name=f"{company_name}_annotations.json",
+            mime="application/json",
+            key=f"download_btn_file{file_idx}_{proj_idx}"
+        )
+
 ###############################################################################
 # Main
 ###############################################################################
@@ -328,94 +1105,81 @@ def main():
         st.session_state["annotations"] = {}
 
     uploaded_files = st.file_uploader(
-        "アノテーション対象の JSON ファイルをアップロードしてください",
-        type="json",
+        "アノテーション対象の JSON ファイル（またはコンパイル済みコーパス .dxc）をアップロードしてください",
+        type=["json", "dxc"],
         accept_multiple_files=True
     )
 
     if not uploaded_files:
+        if "session_id" in st.session_state:
+            # アップロードを外したら共有コーパスへの参照も外す
+            get_corpus_registry().release_session(st.session_state["session_id"])
         st.info("JSONファイルをアップロードしてください。")
         st.stop()
 
-    for file_idx, uploaded_file in enumerate(uploaded_files):
-        file_name = uploaded_file.name
-        st.markdown("---")
-        st.markdown(f"## ファイル: `{file_name}`")
+    documents = ingest_uploaded_files(uploaded_files)
+    report_ingest_issues(documents)
+    key_index = build_key_index(documents)
+    render_resume_sidebar(documents, key_index)
+    render_dedup_sidebar(documents, key_index)
+    render_labeling_sidebar(documents)
+    render_prelabel_sidebar(documents)
 
-        try:
-            data = json.loads(uploaded_file.read().decode("utf-8"))
-        except Exception as e:
-            st.error(f"JSONの読み込み中にエラーが発生しました: {e}")
-            continue
-
-        if "DXProjects" not in data:
-            st.error(f"ファイル {file_name} に 'DXProjects' キーが見つかりません。スキップします。")
-            continue
+    with st.sidebar:
+        st.markdown("### 評価モード")
+        view_mode = st.radio(
+            "表示",
+            ["通常", "Q&A 高速評価（キーボード操作）", "評価状況ダッシュボード", "ツリーの食い違いランキング"],
+            key="view_mode"
+        )
+        st.checkbox("1プロジェクトずつ表示（次のプロジェクトを先読み）", key="project_paging")
+        st.selectbox(
+            "Q&A の1ページの質問数", QA_PAGE_SIZES, index=QA_PAGE_SIZES.index(DEFAULT_QA_PAGE_SIZE), key="qa_page_size"
+        )
+        stats = get_corpus_registry().stats()
+        st.caption(
+            f"共有コーパス: {stats.corpora} 件（参照中 {stats.referenced} 件・{stats.sessions} セッション）"
+            f" / {stats.size / 2**20:.1f} MB（予算 {stats.budget / 2**20:.0f} MB）"
+        )
+    if view_mode.startswith("Q&A"):
+        # 高速評価モードでは Q&A 以外の描画を省き、バッチごとの再実行を軽くする
+        render_rapid_rating(documents)
+        render_export_section(key_index)
+        return
+    if view_mode == "評価状況ダッシュボード":
+        # 全プロジェクトを読むので、ダッシュボードを開いたときに初めて作る（以後は評価のたびに差分で更新される）
+        render_status_dashboard(build_status_counters(documents))
+        return
+    if view_mode == "ツリーの食い違いランキング":
+        render_tree_diff_ranking(documents)
+        return
 
-        for proj_idx, project in enumerate(data["DXProjects"]):
-            company_name = project["table"].get("企業名", f"Unknown_{proj_idx}")
-            purpose = project["table"].get("課題・目的", "不明な課題")
-
-            with st.expander(f"[{company_name}] / 課題: {purpose}", expanded=False):
-                annotate_roi(file_idx, proj_idx, project)
-
-                for mode in ["assignment", "suggest"]:
-                    roiTree_keys = [k for k in project.keys() if k.startswith(f"roiTrees_{mode}")]
-                    if roiTree_keys:
-                        for rkey in roiTree_keys:
-                            st.markdown(f"### ROIツリー: {rkey}")
-                            if isinstance(project[rkey], dict):
-                                annotate_roi_trees(file_idx, proj_idx, project[rkey], mode)
-                            else:
-                                st.warning(f"'{rkey}' の形式が想定と異なります。（dictを期待）")
-                    else:
-                        st.warning(f"この企業に '{mode}' 系の ROIツリーキーがありません。")
-
-                for mode in ["assignment", "suggest"]:
-                    qa_keys = [k for k in project.keys() if k.startswith(f"QAndA_{mode}")]
-                    if qa_keys:
-                        for qkey in qa_keys:
-                            st.markdown(f"### Q&A: {qkey}")
-                            if isinstance(project[qkey], dict):
-                                annotate_q_and_a(file_idx, proj_idx, project[qkey], mode)
-                            else:
-                                st.warning(f"'{qkey}' の形式が想定と異なります。（dictを期待）")
-                    else:
-                        st.warning(f"この企業に '{mode}' 系の Q&Aキーがありません。")
-
-                save_button_key = f"save_btn_file{file_idx}_proj{proj_idx}"
-                if st.button(f"『{company_name}』の評価を保存", key=save_button_key):
-                    st.success(f"『{company_name}』の評価結果を保存しました（サンプル）")
-                    st.session_state[f"show_download_{file_idx}_{proj_idx}"] = True
-
-                if st.session_state.get(f"show_download_{file_idx}_{proj_idx}", False):
-                    proj_annotations = extract_annotations_for_project(file_idx, proj_idx)
-                    proj_json_str = json.dumps(
-                        {
-                            "file_idx": file_idx,
-                            "proj_idx": proj_idx,
-                            "company_name": company_name,
-                            "annotations": proj_annotations
-                        },
-                        ensure_ascii=False,
-                        indent=2
-                    )
-                    st.download_button(
-                        label=f"『{company_name}』の評価をJSONでダウンロード",
-                        data=proj_json_str,
-                        file_name=f"{company_name}_annotations.json",
-                        mime="application/json",
-                        key=f"download_btn_file{file_idx}_{proj_idx}"
-                    )
+    positions = [(file_idx, proj_idx) for file_idx, document in enumerate(documents) for proj_idx in range(len(document.projects))]
+    if not positions:
+        render_export_section(key_index)
+        return
+    if st.session_state.get("project_paging"):
+        cursor = render_project_navigator(documents, positions)
+        # 次に開きそうな順（後ろ PREFETCH_AHEAD 件 → 1つ前）に先読みしておき、移動したときにすぐ表示できるようにする
+        prefetch_bundles(documents, positions[cursor + 1:cursor + 1 + PREFETCH_AHEAD] + positions[max(cursor - 1, 0):cursor])
+        file_idx, proj_idx = positions[cursor]
+        document = documents[file_idx]
+        st.markdown(f"## ファイル: `{document.name}`")
+        st.markdown(f"### {project_heading(document, proj_idx)}")
+        bundle = get_render_cache().get(document.projects[proj_idx], document.project_ids[proj_idx])
+        render_project(file_idx, proj_idx, document, bundle)
+    else:
+        # すべてのプロジェクトを描画する場合も、表示順に並列で作り始めてから順に受け取る
+        prefetch_bundles(documents, positions)
+        for file_idx, document in enumerate(documents):
+            st.markdown("---")
+            st.markdown(f"## ファイル: `{document.name}`")
+            for proj_idx, project in enumerate(document.projects):
+                bundle = get_render_cache().get(project, document.project_ids[proj_idx])
+                with st.expander(project_heading(document, proj_idx), expanded=False):
+                    render_project(file_idx, proj_idx, document, bundle)
 
-    st.markdown("## 全ファイル・プロジェクトに対するアノテーション結果のダウンロード")
-    download_json = json.dumps(st.session_state["annotations"], ensure_ascii=False, indent=2)
-    st.download_button(
-        label="すべてのアノテーション結果をダウンロード (JSON)",
-        data=download_json,
-        file_name="annotations_all.json",
-        mime="application/json"
-    )
+    render_export_section(key_index)
 
 if __name__ == "__main__":
     main()
@@ -1,8 +1,10 @@
+import copy
 import json
-import glob
 import os
 import streamlit as st
 
+from dx_folder import FolderIndex
+
 # ここを実際のフォルダパスに変えてください
 JSON_FOLDER = "json_data"
 
@@ -110,6 +112,42 @@ def annotate_q_and_a(file_idx: int, proj_idx: int, q_and_a: dict):
                     qa_comment_key
                 )
 
+###############################################################################
+# フォルダの変更監視
+###############################################################################
+FOLDER_POLL_SECONDS = 2
+
+@st.cache_resource
+def get_folder_index(folder: str) -> FolderIndex:
+    """
+    フォルダのインデックス（プロセス内で1つ。解析済みのファイルは全セッションで共有する）。
+    """
+    return FolderIndex(folder)
+
+@st.fragment(run_every=FOLDER_POLL_SECONDS)
+def watch_folder(folder_index: FolderIndex):
+    """
+    一定間隔でフォルダの変更を確認し、変わっていればページ全体を再実行する。
+    """
+    folder_index.refresh()
+    if folder_index.generation != st.session_state.get("folder_generation"):
+        st.rerun(scope="app")
+
+def render_folder_sidebar(folder_index: FolderIndex, entries: list):
+    changes = folder_index.last_changes
+    status = {path: "🆕" for path in changes.added}
+    status.update({path: "✏️" for path in changes.modified})
+    with st.sidebar:
+        st.markdown(f"### フォルダ: `{folder_index.folder}`")
+        st.caption(
+            f"{len(entries)} ファイル（" + ("変更通知で監視中" if folder_index.watching else f"{FOLDER_POLL_SECONDS} 秒ごとに確認") + "）"
+        )
+        for entry in entries:
+            mark = "⚠️" if entry.error else status.get(entry.path, "")
+            st.write(f"{mark} {os.path.basename(entry.path)}")
+        for path in changes.removed:
+            st.write(f"🗑️ ~~{os.path.basename(path)}~~")
+
 ###############################################################################
 # メイン処理
 ###############################################################################
@@ -120,24 +158,30 @@ st.title("フォルダ内のDX Projects 一括アノテーションツール")
 if "annotations" not in st.session_state:
     st.session_state["annotations"] = {}
 
-# 1) フォルダ内の .json ファイルをすべて取得
-json_paths = glob.glob(os.path.join(JSON_FOLDER, "*.json"))
-if not json_paths:
+# 1) フォルダ内の .json ファイルを取得（前回から変わったファイルだけを読み直す）
+folder_index = get_folder_index(JSON_FOLDER)
+folder_index.refresh()
+st.session_state["folder_generation"] = folder_index.generation
+entries = folder_index.entries()
+render_folder_sidebar(folder_index, entries)
+watch_folder(folder_index)
+if not entries:
     st.warning(f"指定フォルダ({JSON_FOLDER})に json ファイルがありません。")
     st.stop()
 
-st.write(f"以下のフォルダから {len(json_paths)} 件のJSONファイルを読み込みます:")
-for path in json_paths:
-    st.write(f"- {path}")
+st.write(f"以下のフォルダから {len(entries)} 件のJSONファイルを読み込みます:")
+for entry in entries:
+    st.write(f"- {entry.path}")
 
-# 2) 全ファイルを読み込んでUI生成
-for file_idx, json_file_path in enumerate(json_paths):
-    # ファイル読み込み
-    with open(json_file_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+# 2) 全ファイルのUI生成（file_idx はファイルを最初に見つけた順の番号。追加・削除があってもずれない）
+for entry in entries:
+    file_idx, json_file_path, data = entry.file_idx, entry.path, entry.data
+    if entry.error:
+        st.error(f"ファイル {json_file_path}: {entry.error}")
+        continue
 
     # DXProjects が無ければスキップ
-    if "DXProjects" not in data:
+    if not isinstance(data, dict) or "DXProjects" not in data:
         st.error(f"ファイル {json_file_path} に 'DXProjects' キーが見つかりません。スキップします。")
         continue
 
@@ -161,7 +205,8 @@ for file_idx, json_file_path in enumerate(json_paths):
                 # アノテーション結果を反映した1社分の JSON を書き出す
                 # (元データを読み直し → 該当プロジェクトだけに annotation を付与 → 別ファイルに出力)
 
-                # まず、プロジェクトに annotation を付ける
+                # まず、プロジェクトに annotation を付ける（読み込み済みのデータは全セッションで共有しているのでコピーに付ける）
+                project = copy.deepcopy(project)
                 # ROI
                 roi_good_or_bad_key = f"file{file_idx}_proj{proj_idx}_roi_good_or_bad"
                 roi_comment_key = f"file{file_idx}_proj{proj_idx}_roi_comment"
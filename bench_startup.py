@@ -0,0 +1,80 @@
+import argparse
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+###############################################################################
+# 起動（アップローダ画面の初回描画）までの時間の計測
+###############################################################################
+# 各アプリをアップロード前の状態で1回実行し（AppTest で st.file_uploader が空のまま st.stop まで）、
+# 所要時間と、その時点で読み込まれている重いモジュールを調べる。
+# 1回ごとに新しいプロセスで計測するので、import のキャッシュは効かない（サーバ再起動直後と同じ条件）。
+#
+#   python bench_startup.py                 # app*.py をすべて計測
+#   python bench_startup.py app17.py -n 10
+
+HEAVY_MODULES = ("mermaid", "mermaid.graph", "IPython")
+
+_CHILD = r"""
+import json, sys, time
+started = time.perf_counter()
+import streamlit
+streamlit_loaded = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(sys.argv[1], default_timeout=60)
+testing_loaded = time.perf_counter()
+at.run()
+finished = time.perf_counter()
+print(json.dumps({
+    "streamlit_import": streamlit_loaded - started,
+    # AppTest 自体の読み込み時間は除き、スクリプトの実行（アプリの import と初回描画）だけを数える
+    "first_paint": finished - testing_loaded,
+    "exceptions": [str(e.value) for e in at.exception],
+    "heavy_modules": [m for m in json.loads(sys.argv[2]) if m in sys.modules],
+}))
+"""
+
+def measure(app_path: str, repeat: int) -> dict:
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", _CHILD, app_path, json.dumps(HEAVY_MODULES)],
+            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(app_path)) or ".",
+        )
+        lines = [line for line in output.stdout.splitlines() if line.startswith("{")]
+        if not lines:
+            raise RuntimeError(f"{app_path}: 計測に失敗しました\n{output.stderr[-2000:]}")
+        runs.append(json.loads(lines[-1]))
+    return {
+        "app": os.path.basename(app_path),
+        "first_paint_ms": statistics.median(r["first_paint"] for r in runs) * 1000,
+        "streamlit_import_ms": statistics.median(r["streamlit_import"] for r in runs) * 1000,
+        "heavy_modules": runs[-1]["heavy_modules"],
+        "exceptions": runs[-1]["exceptions"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="各アプリの初回描画（アップロード前）までの時間を計測する")
+    parser.add_argument("apps", nargs="*", default=None)
+    parser.add_argument("-n", "--repeat", type=int, default=5)
+    parser.add_argument("--json", default="", help="結果を書き出す JSON ファイル")
+    args = parser.parse_args()
+
+    apps = args.apps or sorted(glob.glob("app*.py"), key=lambda p: int("".join(c for c in p if c.isdigit()) or 0))
+    results = []
+    print(f"{'app':<10} {'初回描画(ms)':>12} {'streamlit(ms)':>14}  読み込まれた重いモジュール")
+    for app_path in apps:
+        result = measure(app_path, args.repeat)
+        results.append(result)
+        print(f"{result['app']:<10} {result['first_paint_ms']:>12.1f} {result['streamlit_import_ms']:>14.1f}  "
+              f"{', '.join(result['heavy_modules']) or '-'}"
+              + (f"  （例外: {result['exceptions'][0][:60]}）" if result["exceptions"] else ""))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
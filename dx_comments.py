@@ -0,0 +1,410 @@
+import argparse
+import glob
+import json
+import re
+import time
+import unicodedata
+from typing import NamedTuple
+
+import numpy as np
+
+from dx_corpus import load_path
+from dx_export import decode_export, export_sort_key
+from dx_keys import EXPORT_FORMAT, split_widget_key
+from dx_resume import upgrade_legacy_suffix
+
+###############################################################################
+# 自由記述コメント（「どこが悪いか」）のクラスタリング
+###############################################################################
+# アノテーションの "_comment" を集め、よく出る指摘のまとまり（テーマ）をセクション・深さ・questionType 別に数える。
+#
+#   1) 正規化（NFKC・小文字化・空白の除去）し、同じ文面は1件にまとめて件数を重みにする
+#   2) 文字 n-gram（既定は 2〜3 文字）を特徴ハッシュで 2^bits 次元に落とす（形態素解析・語彙表なし）
+#      n-gram の生成は全コメントを1本のコードポイント配列にして NumPy でまとめて行う
+#   3) TF-IDF（TF は 1 + log(tf)、IDF は平滑化あり）を行ごとに L2 正規化した疎行列（CSR 相当の3配列）
+#   4) 球面ミニバッチ k-means（k-means++ で初期化、中心は密な行列、内積＝コサイン類似度）
+#
+# テーマの語は中心の重みが大きい特徴を、メンバーのコメントから元の n-gram に戻して表示する。
+
+N_FEATURES_BITS = 18
+NGRAM_RANGE = (2, 3)
+SHORT = -1      # n-gram が作れない短いコメントのクラスタ番号
+
+_MASK64 = (1 << 64) - 1
+_SEED = 0x9E3779B97F4A7C15
+_MULTIPLIERS = (0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53)
+
+_COMMENT_KEY = re.compile(r"^(?P<prefix>file\d+_proj\d+|p[0-9a-f]+)(?P<suffix>_.*)_comment$", re.DOTALL)
+_SUFFIX = re.compile(r"^_(?P<mode>[^_]+)_(?P<kind>roiTrees|QAndA)_(?P<depth>[Dd]epth(?P<n>\d+))(?:_(?P<qa>\d+)_(?P<q>\d+))?$")
+
+class Comment(NamedTuple):
+    key: str
+    text: str
+    rating: str         # 同じ項目の _good_or_bad（無ければ ""）
+    section: str        # "ROI算定" / "ツリー assignment" / "Q&A suggest" など
+    depth: int          # ROI算定は 0
+    qtype: str          # Q&A のみ（コーパスが無く分からない場合は ""）
+
+class SparseRows(NamedTuple):
+    indptr: np.ndarray      # int64, 行数+1
+    indices: np.ndarray     # int64, 特徴番号
+    data: np.ndarray        # float32, 行ごとに L2 正規化済み
+    n_features: int
+
+    @property
+    def n_rows(self) -> int:
+        return len(self.indptr) - 1
+
+class ClusterSummary(NamedTuple):
+    cluster: int
+    size: int               # 重複を含むコメント数
+    terms: list             # 代表的な n-gram
+    examples: list          # 中心に近いコメント
+    by_section: dict        # "Q&A suggest D3" のような列 -> 件数
+    by_qtype: dict
+    by_rating: dict
+
+###############################################################################
+# コメントの収集
+###############################################################################
+def _merged_annotations(named_documents: list) -> dict:
+    """
+    エクスポート（安定キー形式・1社分・旧形式のフラットな dict）をまとめて1つの dict にする。
+    安定キー形式は sequence 順に適用し、差分の "removed" も反映する。
+    """
+    merged = {}
+    for _, data in sorted(named_documents, key=export_sort_key):
+        if not isinstance(data, dict):
+            continue
+        if data.get("format") == EXPORT_FORMAT:
+            merged.update(data.get("annotations", {}))
+            for key in data.get("removed", []):
+                merged.pop(key, None)
+        elif isinstance(data.get("annotations"), dict):
+            pid = data.get("project_id")
+            for key, value in data["annotations"].items():
+                parts = split_widget_key(key)
+                # project_id があれば安定キーに直す（位置の違うファイル同士でも同じ項目としてまとめる）
+                merged[f"{pid}{parts[2]}" if pid and parts else key] = value
+        elif not data.get("DXProjects"):
+            merged.update({k: v for k, v in data.items() if isinstance(k, str)})
+    return merged
+
+def _question_type(project, mode: str, depth_key: str, qa_idx: int, q_idx: int) -> str:
+    for section_key in project.sections("QAndA", mode):
+        items = project.qa[section_key].get(depth_key, ())
+        if qa_idx < len(items) and q_idx < len(items[qa_idx].questions):
+            question = items[qa_idx].questions[q_idx]
+            return question.qtype.name if question.qtype else (question.qtype_raw or "UNKNOWN")
+    return ""
+
+def collect_comments(named_documents: list, documents: list = ()) -> list:
+    """
+    空でないコメントを Comment のリストにする。documents（IngestedFile のリスト）を渡すと questionType を補う。
+    旧形式の "file{i}_proj{j}_..." キーは documents の並び順の位置で対応づける。
+    """
+    projects_by_pid = {}
+    pid_by_prefix = {}
+    for file_idx, document in enumerate(documents):
+        for proj_idx, (project, pid) in enumerate(zip(document.projects, document.project_ids)):
+            projects_by_pid[pid] = project
+            pid_by_prefix[f"file{file_idx}_proj{proj_idx}"] = pid
+
+    annotations = _merged_annotations(named_documents)
+    comments = []
+    for key, value in annotations.items():
+        if not isinstance(value, str) or not value.strip():
+            continue
+        match = _COMMENT_KEY.match(key)
+        if not match:
+            continue
+        prefix, suffix = match.group("prefix", "suffix")
+        rating = annotations.get(f"{prefix}{suffix}_good_or_bad", "")
+        if suffix == "_roi":
+            comments.append(Comment(key, value, rating, "ROI算定", 0, ""))
+            continue
+        parts = _SUFFIX.match(upgrade_legacy_suffix(suffix + "_")[:-1])
+        if not parts:
+            continue
+        mode, kind, depth_key = parts.group("mode", "kind", "depth")
+        qtype = ""
+        if kind == "QAndA":
+            project = projects_by_pid.get(pid_by_prefix.get(prefix, prefix))
+            if project is not None:
+                qtype = _question_type(project, mode, depth_key, int(parts.group("qa")), int(parts.group("q")))
+        section = f"{'ツリー' if kind == 'roiTrees' else 'Q&A'} {mode}"
+        comments.append(Comment(key, value, rating if isinstance(rating, str) else "", section, int(parts.group("n")), qtype))
+    return comments
+
+###############################################################################
+# 特徴量（文字 n-gram の特徴ハッシュ + TF-IDF）
+###############################################################################
+def normalize_comment(text: str) -> str:
+    return "".join(unicodedata.normalize("NFKC", text).lower().split())
+
+def ngram_feature(gram: str, bits: int = N_FEATURES_BITS) -> int:
+    """
+    1つの n-gram の特徴番号（hashed_ngrams と同じ計算の Python 版。テーマの語を元に戻すのに使う）。
+    """
+    h = (_SEED * len(gram)) & _MASK64
+    for j, ch in enumerate(gram):
+        h = ((h ^ ord(ch)) * _MULTIPLIERS[j % len(_MULTIPLIERS)]) & _MASK64
+    h ^= h >> 31
+    return h >> (64 - bits)
+
+def hashed_ngrams(texts: list, bits: int = N_FEATURES_BITS, ngram_range: tuple = NGRAM_RANGE) -> tuple:
+    """
+    全テキストの文字 n-gram を (行番号の配列, 特徴番号の配列) で返す。
+    """
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    starts = np.cumsum(lengths) - lengths
+    codes = np.frombuffer("".join(texts).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    row_of = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+    rows, features = [], []
+    with np.errstate(over="ignore"):
+        for n in range(ngram_range[0], ngram_range[1] + 1):
+            m = len(codes) - n + 1
+            if m <= 0:
+                continue
+            h = np.full(m, (_SEED * n) & _MASK64, dtype=np.uint64)
+            for j in range(n):
+                h = (h ^ codes[j:j + m]) * np.uint64(_MULTIPLIERS[j % len(_MULTIPLIERS)])
+            h ^= h >> np.uint64(31)
+            row = row_of[:m]
+            # 次のコメントにまたがる n-gram を除く
+            valid = np.arange(m, dtype=np.int64) - starts[row] + n <= lengths[row]
+            rows.append(row[valid])
+            features.append((h[valid] >> np.uint64(64 - bits)).astype(np.int64))
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(rows), np.concatenate(features)
+
+def unique_counts(keys: np.ndarray) -> tuple:
+    """
+    整数配列の (重複を除いた値（昇順）, 出現回数)。np.unique より速い並べ替えだけの版。
+    """
+    keys = np.sort(keys)
+    if len(keys) == 0:
+        return keys, np.zeros(0, dtype=np.int64)
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    return keys[starts], np.diff(np.append(starts, len(keys)))
+
+def tfidf(texts: list, weights: np.ndarray, bits: int = N_FEATURES_BITS, ngram_range: tuple = NGRAM_RANGE) -> tuple:
+    """
+    TF-IDF の疎行列（SparseRows）と IDF を返す。weights は各テキストの出現回数（IDF の文書頻度に使う）。
+    """
+    n_features = 1 << bits
+    rows, features = hashed_ngrams(texts, bits, ngram_range)
+    pairs, counts = unique_counts(rows * n_features + features)
+    rows, features = pairs // n_features, pairs % n_features
+    document_frequency = np.bincount(features, weights=weights[rows], minlength=n_features)
+    idf = np.log((1.0 + weights.sum()) / (1.0 + document_frequency)) + 1.0
+    data = (1.0 + np.log(counts)) * idf[features]
+    norms = np.sqrt(np.bincount(rows, weights=data * data, minlength=len(texts)))
+    data = (data / np.where(norms > 0, norms, 1.0)[rows]).astype(np.float32)
+    indptr = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(texts)), out=indptr[1:])
+    return SparseRows(indptr, features, data, n_features), idf
+
+###############################################################################
+# 球面ミニバッチ k-means
+###############################################################################
+def gather_rows(matrix: SparseRows, rows: np.ndarray) -> tuple:
+    """
+    指定した行だけを取り出し、(行ごとの非ゼロ数, 特徴番号, 値) を返す。
+    """
+    begins = matrix.indptr[rows]
+    lengths = matrix.indptr[rows + 1] - begins
+    offsets = np.cumsum(lengths) - lengths
+    positions = np.repeat(begins - offsets, lengths) + np.arange(lengths.sum(), dtype=np.int64)
+    return lengths, matrix.indices[positions], matrix.data[positions]
+
+def similarities(matrix: SparseRows, rows: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    """
+    行と各中心のコサイン類似度（中心の数 × 行数）。
+    """
+    lengths, indices, data = gather_rows(matrix, rows)
+    products = centers[:, indices] * data
+    cumulative = np.zeros((centers.shape[0], len(indices) + 1), dtype=np.float64)
+    np.cumsum(products, axis=1, out=cumulative[:, 1:])
+    ends = np.cumsum(lengths)
+    return cumulative[:, ends] - cumulative[:, ends - lengths]
+
+def _init_centers(matrix: SparseRows, candidates: np.ndarray, k: int, rng) -> np.ndarray:
+    """
+    k-means++（候補の標本から、既存の中心に似ていない行ほど選ばれやすくする）。
+    """
+    sample = rng.choice(candidates, size=min(len(candidates), max(50 * k, 2000)), replace=False)
+    centers = np.zeros((k, matrix.n_features), dtype=np.float32)
+    best = np.full(len(sample), -np.inf)
+    chosen = rng.integers(len(sample))
+    for c in range(k):
+        lengths, indices, data = gather_rows(matrix, sample[chosen:chosen + 1])
+        centers[c, indices] = data
+        best = np.maximum(best, similarities(matrix, sample, centers[c:c + 1])[0])
+        distance = np.clip(1.0 - best, 0.0, None)
+        if distance.sum() <= 0:
+            break
+        chosen = rng.choice(len(sample), p=distance / distance.sum())
+    return centers
+
+def minibatch_kmeans(matrix: SparseRows, weights: np.ndarray, k: int, batch_size: int = 2048,
+                     n_batches: int = 100, seed: int = 0) -> tuple:
+    """
+    (各行のクラスタ番号, 中心) を返す。特徴の無い行は SHORT。
+    """
+    rng = np.random.default_rng(seed)
+    candidates = np.flatnonzero(np.diff(matrix.indptr) > 0)
+    labels = np.full(matrix.n_rows, SHORT, dtype=np.int64)
+    if len(candidates) == 0:
+        return labels, np.zeros((0, matrix.n_features), dtype=np.float32)
+    k = min(k, len(candidates))
+    centers = _init_centers(matrix, candidates, k, rng)
+    seen = np.zeros(k)
+    for _ in range(n_batches):
+        rows = np.sort(rng.choice(candidates, size=min(batch_size, len(candidates)), replace=False))
+        assigned = similarities(matrix, rows, centers).argmax(axis=0)
+        row_weights = weights[rows]
+        updated = seen + np.bincount(assigned, weights=row_weights, minlength=k)
+        # 各中心を「これまでの平均」と「今回割り当てられた行」の重み付き平均に更新する（学習率 1/累計件数）
+        centers *= np.where(updated > 0, seen / np.where(updated > 0, updated, 1), 1.0)[:, None].astype(np.float32)
+        lengths, indices, data = gather_rows(matrix, rows)
+        owner = np.repeat(assigned, lengths)
+        np.add.at(centers.reshape(-1), owner * matrix.n_features + indices,
+                  (data * np.repeat(row_weights, lengths) / updated[owner]).astype(np.float32))
+        seen = updated
+        norms = np.linalg.norm(centers, axis=1)
+        centers /= np.where(norms > 0, norms, 1.0)[:, None]
+        # 何も割り当てられていない中心はランダムな行で置き直す
+        for c in np.flatnonzero(seen == 0):
+            lengths, indices, data = gather_rows(matrix, rng.choice(candidates, size=1))
+            centers[c] = 0.0
+            centers[c, indices] = data
+    for begin in range(0, len(candidates), batch_size * 4):
+        rows = candidates[begin:begin + batch_size * 4]
+        labels[rows] = similarities(matrix, rows, centers).argmax(axis=0)
+    return labels, centers
+
+###############################################################################
+# 集計
+###############################################################################
+def _decode_terms(center: np.ndarray, member_texts: list, n_terms: int, bits: int, ngram_range: tuple) -> list:
+    wanted = {int(f): i for i, f in enumerate(np.argsort(center)[::-1][:n_terms * 3]) if center[f] > 0}
+    found = {}
+    for text in member_texts:
+        for n in range(ngram_range[0], ngram_range[1] + 1):
+            for i in range(len(text) - n + 1):
+                gram = text[i:i + n]
+                feature = ngram_feature(gram, bits)
+                if feature in wanted:
+                    counts = found.setdefault(feature, {})
+                    counts[gram] = counts.get(gram, 0) + 1
+    terms = []
+    for feature in sorted(found, key=wanted.get):
+        gram = max(found[feature], key=found[feature].get)
+        if any(gram in t for t in terms):
+            continue
+        # 1文字ずれて重なる n-gram はつなげて1つの語にする（"時間軸" + "間軸が" -> "時間軸が"）
+        for i, t in enumerate(terms):
+            if t.endswith(gram[:-1]):
+                terms[i] = t + gram[-1]
+                break
+            if t.startswith(gram[1:]):
+                terms[i] = gram[0] + t
+                break
+        else:
+            if len(terms) >= n_terms:
+                break
+            terms = [t for t in terms if t not in gram] + [gram]
+    return terms
+
+def cluster_comments(comments: list, k: int = 0, bits: int = N_FEATURES_BITS, ngram_range: tuple = NGRAM_RANGE,
+                     batch_size: int = 2048, n_batches: int = 100, seed: int = 0, n_terms: int = 6, n_examples: int = 3) -> tuple:
+    """
+    コメントをクラスタに分け、(コメントごとのクラスタ番号の配列, ClusterSummary のリスト（大きい順）) を返す。
+    k=0 のときは件数から決める。
+    """
+    normalized = [normalize_comment(c.text) for c in comments]
+    unique_texts, inverse, counts = np.unique(np.array(normalized, dtype=object), return_inverse=True, return_counts=True)
+    unique_texts = list(unique_texts)
+    weights = counts.astype(np.float64)
+    k = k or max(2, min(30, int(np.sqrt(len(unique_texts) / 2))))
+    matrix, _ = tfidf(unique_texts, weights, bits, ngram_range)
+    unique_labels, centers = minibatch_kmeans(matrix, weights, k, batch_size, n_batches, seed)
+    labels = unique_labels[inverse]
+
+    summaries = []
+    for cluster in np.unique(labels):
+        members = np.flatnonzero(labels == cluster)
+        unique_members = np.flatnonzero(unique_labels == cluster)
+        if cluster == SHORT:
+            terms, examples = [], [unique_texts[i] for i in unique_members[np.argsort(-weights[unique_members])][:n_examples]]
+        else:
+            scores = similarities(matrix, unique_members, centers[cluster:cluster + 1])[0]
+            ranked = unique_members[np.argsort(-scores)]
+            examples = [unique_texts[i] for i in ranked[:n_examples]]
+            terms = _decode_terms(centers[cluster], [unique_texts[i] for i in ranked[:300]], n_terms, bits, ngram_range)
+        by_section, by_qtype, by_rating = {}, {}, {}
+        for i in members:
+            comment = comments[i]
+            column = f"{comment.section} D{comment.depth}" if comment.depth else comment.section
+            by_section[column] = by_section.get(column, 0) + 1
+            if comment.qtype:
+                by_qtype[comment.qtype] = by_qtype.get(comment.qtype, 0) + 1
+            by_rating[comment.rating or "-"] = by_rating.get(comment.rating or "-", 0) + 1
+        summaries.append(ClusterSummary(
+            int(cluster), len(members), terms, examples,
+            dict(sorted(by_section.items(), key=lambda kv: -kv[1])),
+            dict(sorted(by_qtype.items(), key=lambda kv: -kv[1])),
+            by_rating,
+        ))
+    summaries.sort(key=lambda s: (s.cluster == SHORT, -s.size))
+    return labels, summaries
+
+###############################################################################
+# CLI
+###############################################################################
+def main():
+    parser = argparse.ArgumentParser(description="「どこが悪いか」のコメントをクラスタに分け、よく出る指摘をセクション別に数える")
+    parser.add_argument("patterns", nargs="+", help="アノテーションのエクスポート（annotations_all*.json / *_annotations.json / .json.gz）")
+    parser.add_argument("--corpus", nargs="*", default=[], help="questionType を補うための元データ（JSON / .dxc。旧形式キーは指定順の位置で対応づける）")
+    parser.add_argument("-k", "--clusters", type=int, default=0, help="クラスタ数（0 なら件数から決める）")
+    parser.add_argument("--bits", type=int, default=N_FEATURES_BITS, help="特徴ハッシュの次元数（2^bits）")
+    parser.add_argument("--batches", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=2048)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default="", help="結果（クラスタの要約とコメントごとの割り当て）を書き出す JSON")
+    args = parser.parse_args()
+
+    named_documents = []
+    for path in sorted({p for pattern in args.patterns for p in glob.glob(pattern)}):
+        with open(path, "rb") as f:
+            named_documents.append((path, decode_export(f.read())))
+    documents = [document for pattern in args.corpus for path in sorted(glob.glob(pattern)) for document in load_path(path)]
+
+    started = time.monotonic()
+    comments = collect_comments(named_documents, documents)
+    if not comments:
+        print("コメントがありません")
+        return
+    labels, summaries = cluster_comments(comments, args.clusters, args.bits, batch_size=args.batch_size,
+                                         n_batches=args.batches, seed=args.seed)
+    print(f"{len(comments)} 件のコメント, {len([s for s in summaries if s.cluster != SHORT])} クラスタ, "
+          f"{time.monotonic() - started:.2f} 秒")
+    for summary in summaries:
+        title = "（短すぎて分類できないもの）" if summary.cluster == SHORT else " / ".join(summary.terms)
+        print(f"\n[{summary.cluster}] {summary.size} 件: {title}")
+        print("  セクション: " + ", ".join(f"{k} {v}" for k, v in list(summary.by_section.items())[:4]))
+        if summary.by_qtype:
+            print("  questionType: " + ", ".join(f"{k} {v}" for k, v in summary.by_qtype.items()))
+        for example in summary.examples:
+            print(f"  - {example[:80]}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "clusters": [s._asdict() for s in summaries],
+                "assignments": [{**c._asdict(), "cluster": int(label)} for c, label in zip(comments, labels)],
+            }, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
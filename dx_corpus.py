@@ -0,0 +1,563 @@
+import argparse
+import glob
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from typing import NamedTuple
+
+from dx_model import Project, QAItem, Question, QuestionType, RoiTree, parse_depth, projects_to_json
+from dx_schema import IngestedFile, SchemaIssue, ingest_file
+
+###############################################################################
+# コンパイル済みコーパス（.dxc）: mmap で開いて必要なプロジェクトだけを読む列指向形式
+###############################################################################
+# JSON は1ファイル全体を json.loads しないと1件目も読めないため、DXProjects を次の形に変換しておく。
+#
+#   ヘッダ   : マジック "DXC1"・形式バージョン・バイト順の目印・セクション数・各セクションの (開始位置, バイト数)
+#   文字列   : 重複を除いた UTF-8 文字列を連結したもの + 開始位置の配列（u64, 件数+1）
+#   表       : 固定幅 u32 の行（文字列は文字列番号、子の表は (先頭行, 行数) で参照）
+#                files     : ファイル名, file_hash, プロジェクトの範囲, 取り込み時の注意事項(JSON)
+#                projects  : file_idx, プロジェクトID, 企業名, 課題・目的, 提案, 定量要素・ROI算定・ツリー・Q&A 群の範囲, meta(JSON)
+#                trees     : セクション, 深さキー, graph, 重要度の範囲, meta
+#                qa_groups : セクション, 深さキー, Q&A 項目の範囲
+#                qa_items  : parentNode, childNode, 質問の範囲, meta
+#                questions : questionType(原文), question, answer, meta
+#   数値列   : 深さ（u16）・questionType（u8, QuestionType の値）・重要度（f64 と 整数だったかの u8）
+#
+# 各セクションは 8 バイト境界に置き、読み込み時は memoryview.cast で配列として見る（コピーしない）。
+# プロジェクト N を読むときは、その行と参照先の行・文字列だけに触れる。
+# 通常と異なる形（既知でないキー・キー順の違い・文字列以外の値）は meta に JSON で持ち、読み込み時に元の形へ戻す。
+# file_hash は元の JSON の内容ハッシュのままなので、プロジェクトIDとアノテーションのキーは JSON から読んだ場合と同じ。
+
+MAGIC = b"DXC1"
+FORMAT_VERSION = 1
+_BYTE_ORDER_MARK = 0x01020304
+NONE = 0xFFFFFFFF           # 文字列番号・先頭行が「無し（None）」
+EXTENSION = ".dxc"
+
+_HEADER = "<4sIII"
+_SECTION_ENTRY = "<QQ"
+
+# (セクション名, array の型コード, 1行の要素数)
+_SECTIONS = (
+    ("string_offsets", "Q", 1),
+    ("string_data", "B", 1),
+    ("files", "I", 5),
+    ("projects", "I", 14),
+    ("lines", "I", 1),
+    ("trees", "I", 6),
+    ("tree_depths", "H", 1),
+    ("tree_flags", "B", 1),
+    ("factor_nodes", "I", 1),
+    ("factor_values", "d", 1),
+    ("factor_is_int", "B", 1),
+    ("qa_groups", "I", 4),
+    ("qa_group_depths", "H", 1),
+    ("qa_items", "I", 5),
+    ("questions", "I", 4),
+    ("question_types", "B", 1),
+)
+_TREE_LEGACY = 1
+
+_DEFAULT_TREE_KEYS = ("graph", "importance_factors")
+_DEFAULT_QA_KEYS = ("parentNode", "childNode", "questions")
+_DEFAULT_QUESTION_KEYS = ("questionType", "question", "answer")
+
+class CorpusFile(NamedTuple):
+    name: str
+    file_hash: str
+    first_project: int
+    n_projects: int
+    issues: list
+
+def _is_text(value) -> bool:
+    return value is None or isinstance(value, str)
+
+###############################################################################
+# 変換（JSON -> .dxc）
+###############################################################################
+class CorpusWriter:
+    def __init__(self):
+        self._string_ids = {}
+        self._strings = []
+        self.columns = {name: array(code) for name, code, _ in _SECTIONS}
+
+    def string(self, value) -> int:
+        if value is None:
+            return NONE
+        sid = self._string_ids.get(value)
+        if sid is None:
+            sid = self._string_ids[value] = len(self._strings)
+            self._strings.append(value)
+        return sid
+
+    def meta(self, fields: dict) -> int:
+        fields = {k: v for k, v in fields.items() if v is not None}
+        return self.string(json.dumps(fields, ensure_ascii=False, sort_keys=True)) if fields else NONE
+
+    def _range(self, name: str, width: int = 1) -> int:
+        return len(self.columns[name]) // width
+
+    def add_file(self, document: IngestedFile):
+        first = self._range("projects", 14)
+        for project, pid in zip(document.projects, document.project_ids):
+            self._add_project(len(self.columns["files"]) // 5, project, pid)
+        issues = [list(issue) for issue in document.issues]
+        self.columns["files"].extend((
+            self.string(document.name), self.string(document.file_hash), first, len(document.projects),
+            self.string(json.dumps(issues, ensure_ascii=False)) if issues else NONE,
+        ))
+
+    def _add_lines(self, values) -> tuple:
+        if not isinstance(values, tuple):
+            return NONE, 0
+        first = self._range("lines")
+        self.columns["lines"].extend(self.string(v) for v in values)
+        return first, len(values)
+
+    def _add_project(self, file_idx: int, project: Project, pid: str):
+        meta = {"keys": list(project._keys), "table_keys": list(project._table_keys)}
+        if project.table_extra:
+            meta["table_extra"] = project.table_extra
+        if project.extra:
+            meta["extra"] = project.extra
+        fields = {}
+        for attr in ("company", "purpose", "proposal"):
+            if not _is_text(getattr(project, attr)):
+                fields[attr] = getattr(project, attr)
+        for attr in ("factors", "roi_lines"):
+            value = getattr(project, attr)
+            if value is not None and not (isinstance(value, tuple) and all(_is_text(v) for v in value)):
+                fields[attr] = list(value) if isinstance(value, tuple) else value
+        if fields:
+            meta["fields"] = fields
+
+        text = {attr: getattr(project, attr) if attr not in fields else None for attr in ("company", "purpose", "proposal")}
+        factors = self._add_lines(project.factors if "factors" not in fields else None)
+        roi_lines = self._add_lines(project.roi_lines if "roi_lines" not in fields else None)
+
+        tree_first = self._range("trees", 6)
+        for section_key, trees in project.roi_trees.items():
+            for depth_key, tree in trees.items():
+                self._add_tree(section_key, depth_key, tree)
+        group_first = self._range("qa_groups", 4)
+        for section_key, depths in project.qa.items():
+            for depth_key, qa_items in depths.items():
+                item_first = self._range("qa_items", 5)
+                for qa_item in qa_items:
+                    self._add_qa_item(qa_item)
+                self.columns["qa_groups"].extend((self.string(section_key), self.string(depth_key), item_first, len(qa_items)))
+                self.columns["qa_group_depths"].append(min(parse_depth(depth_key), 0xFFFF))
+
+        self.columns["projects"].extend((
+            file_idx, self.string(pid),
+            self.string(text["company"]), self.string(text["purpose"]), self.string(text["proposal"]),
+            *factors, *roi_lines,
+            tree_first, self._range("trees", 6) - tree_first,
+            group_first, self._range("qa_groups", 4) - group_first,
+            self.meta(meta),
+        ))
+
+    def _add_tree(self, section_key: str, depth_key: str, tree: RoiTree):
+        factors = tree.importance_factors
+        regular = (
+            _is_text(tree.graph)
+            and (tree.legacy or (tree._keys == _DEFAULT_TREE_KEYS and not tree.extra))
+            and (factors is None or isinstance(factors, tuple) and all(
+                isinstance(node, str) and isinstance(value, (int, float)) and not isinstance(value, bool)
+                for node, value in factors
+            ))
+        )
+        factor_first, n_factors = NONE, 0
+        if regular and factors is not None:
+            factor_first = self._range("factor_nodes")
+            for node, value in factors:
+                self.columns["factor_nodes"].append(self.string(node))
+                self.columns["factor_values"].append(float(value))
+                self.columns["factor_is_int"].append(isinstance(value, int))
+            n_factors = len(factors)
+        self.columns["trees"].extend((
+            self.string(section_key), self.string(depth_key),
+            self.string(tree.graph) if regular else NONE,
+            factor_first, n_factors,
+            # 通常と異なる形のツリーは値ごと meta に持つ
+            NONE if regular else self.meta({"value": tree.to_value()}),
+        ))
+        self.columns["tree_depths"].append(min(tree.depth, 0xFFFF))
+        self.columns["tree_flags"].append(_TREE_LEGACY if tree.legacy else 0)
+
+    def _add_qa_item(self, qa_item: QAItem):
+        regular = _is_text(qa_item.parent) and _is_text(qa_item.child) and qa_item._keys == _DEFAULT_QA_KEYS and not qa_item.extra
+        if not regular:
+            self.columns["qa_items"].extend((NONE, NONE, NONE, 0, self.meta({"value": qa_item.to_dict()})))
+            return
+        q_first = self._range("questions", 4)
+        for question in qa_item.questions:
+            self._add_question(question)
+        self.columns["qa_items"].extend((self.string(qa_item.parent), self.string(qa_item.child), q_first, len(qa_item.questions), NONE))
+
+    def _add_question(self, question: Question):
+        regular = (
+            _is_text(question.qtype_raw) and _is_text(question.question) and _is_text(question.answer)
+            and question._keys == _DEFAULT_QUESTION_KEYS and not question.extra
+        )
+        if regular:
+            row = (self.string(question.qtype_raw), self.string(question.question), self.string(question.answer), NONE)
+        else:
+            row = (NONE, NONE, NONE, self.meta({"value": question.to_dict()}))
+        self.columns["questions"].extend(row)
+        self.columns["question_types"].append(int(question.qtype))
+
+    def to_bytes(self) -> bytes:
+        offsets = array("Q", [0])
+        data = bytearray()
+        for value in self._strings:
+            data += value.encode("utf-8", "surrogatepass")
+            offsets.append(len(data))
+        self.columns["string_offsets"] = offsets
+        self.columns["string_data"] = array("B", data)
+
+        if sys.byteorder != "little":
+            for column in self.columns.values():
+                column.byteswap()
+        header_size = _align(_size(_HEADER) + len(_SECTIONS) * _size(_SECTION_ENTRY))
+        entries = []
+        body = bytearray()
+        for name, _, _ in _SECTIONS:
+            payload = self.columns[name].tobytes()
+            entries.append((header_size + len(body), len(payload)))
+            body += payload
+            body += b"\0" * (_align(len(body)) - len(body))
+        header = struct.pack(_HEADER, MAGIC, FORMAT_VERSION, _BYTE_ORDER_MARK, len(_SECTIONS))
+        header += b"".join(struct.pack(_SECTION_ENTRY, offset, size) for offset, size in entries)
+        return header + b"\0" * (header_size - len(header)) + bytes(body)
+
+def _size(fmt: str) -> int:
+    return struct.calcsize(fmt)
+
+def _align(n: int, boundary: int = 8) -> int:
+    return (n + boundary - 1) // boundary * boundary
+
+def load_path(path: str) -> list:
+    """
+    .dxc ならコーパス内の各ファイルを、JSON なら1ファイルを IngestedFile のリストで返す（バッチ処理用）。
+    """
+    if path.endswith(EXTENSION):
+        return CorpusReader(path).documents()
+    with open(path, "rb") as f:
+        return [ingest_file(f.read(), path)]
+
+def build_corpus(paths: list, out_path: str) -> tuple:
+    """
+    JSON（.dxc も可）をまとめて1つの .dxc に書き出し、(ファイル数, プロジェクト数, 注意事項のリスト) を返す。
+    """
+    writer = CorpusWriter()
+    n_files = n_projects = 0
+    issues = []
+    for path in paths:
+        for document in load_path(path):
+            writer.add_file(document)
+            n_files += 1
+            n_projects += len(document.projects)
+            issues.extend(document.issues)
+    payload = writer.to_bytes()
+    tmp_path = f"{out_path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+    os.replace(tmp_path, out_path)
+    return n_files, n_projects, issues
+
+###############################################################################
+# 読み込み（mmap / バイト列 -> Project）
+###############################################################################
+class CorpusReader:
+    """
+    .dxc を開き、プロジェクトを番号で読む。source はファイルパス（mmap で開く）か bytes 類（アップロードされた内容など）。
+    """
+
+    def __init__(self, source):
+        self._mmap = None
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            buffer = memoryview(self._mmap)
+        else:
+            buffer = memoryview(source)
+        if buffer.nbytes < _size(_HEADER):
+            raise ValueError("コーパスのヘッダがありません")
+        magic, version, byte_order, n_sections = struct.unpack_from(_HEADER, buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("コーパスファイル（.dxc）ではありません")
+        if version != FORMAT_VERSION or n_sections != len(_SECTIONS):
+            raise ValueError(f"対応していない形式バージョンです: {version}")
+        if byte_order != _BYTE_ORDER_MARK or sys.byteorder != "little":
+            raise ValueError("バイト順が異なる環境で作られたコーパスです")
+        self._buffer = buffer
+        self._columns = {}
+        for i, (name, code, _) in enumerate(_SECTIONS):
+            offset, size = struct.unpack_from(_SECTION_ENTRY, buffer, _size(_HEADER) + i * _size(_SECTION_ENTRY))
+            self._columns[name] = buffer[offset:offset + size].cast(code)
+        self._strings = self._columns["string_offsets"]
+        self._string_data = self._columns["string_data"]
+        self._projects = {}
+
+    def close(self):
+        self._projects.clear()
+        columns, self._columns = self._columns, {}
+        for column in columns.values():
+            column.release()
+        self._strings = self._string_data = None
+        self._buffer.release()
+        if self._mmap is not None:
+            self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _row(self, name: str, width: int, index: int) -> list:
+        return self._columns[name][index * width:(index + 1) * width].tolist()
+
+    def string(self, sid: int):
+        if sid == NONE:
+            return None
+        start, end = self._strings[sid], self._strings[sid + 1]
+        return bytes(self._string_data[start:end]).decode("utf-8", "surrogatepass")
+
+    def _meta(self, sid: int) -> dict:
+        return json.loads(self.string(sid)) if sid != NONE else {}
+
+    @property
+    def n_projects(self) -> int:
+        return len(self._columns["projects"]) // 14
+
+    @property
+    def n_files(self) -> int:
+        return len(self._columns["files"]) // 5
+
+    def file(self, index: int) -> CorpusFile:
+        name, file_hash, first, count, issues = self._row("files", 5, index)
+        issues = [SchemaIssue(*issue) for issue in self._meta(issues)] if issues != NONE else []
+        return CorpusFile(self.string(name), self.string(file_hash), first, count, issues)
+
+    def project_id(self, index: int) -> str:
+        return self.string(self._row("projects", 14, index)[1])
+
+    def company(self, index: int):
+        """
+        プロジェクト N の企業名（Project を作らずに表から読む）。
+        """
+        project = self._projects.get(index)
+        if project is not None:
+            return project.company
+        row = self._row("projects", 14, index)
+        fields = self._meta(row[13]).get("fields", {})
+        if "company" in fields:
+            return fields["company"]
+        return self.string(row[2])
+
+    def project(self, index: int) -> Project:
+        """
+        プロジェクト N を Project にする（読んだものはこのリーダーの中で使い回す）。
+        """
+        project = self._projects.get(index)
+        if project is None:
+            project = self._projects[index] = self._read_project(index)
+        return project
+
+    def _lines(self, first: int, count: int):
+        if first == NONE:
+            return None
+        return tuple(self.string(sid) for sid in self._columns["lines"][first:first + count].tolist())
+
+    def _read_project(self, index: int) -> Project:
+        (_, _, company, purpose, proposal, factors_first, n_factors, roi_first, n_roi,
+         tree_first, n_trees, group_first, n_groups, meta_sid) = self._row("projects", 14, index)
+        meta = self._meta(meta_sid)
+        extra = meta.get("extra") or {}
+        table_extra = meta.get("table_extra") or {}
+        # キー順・既知でないキーは、同じ並びの骨組みを Project.from_dict に通して復元する
+        skeleton = {}
+        for key in meta.get("keys", []):
+            if key in extra:
+                skeleton[key] = extra[key]
+            elif key == "table":
+                skeleton[key] = {k: table_extra.get(k) for k in meta.get("table_keys", [])}
+            else:
+                skeleton[key] = {}
+        project = Project.from_dict(skeleton)
+        project.table_extra = table_extra or None
+        project.company = sys.intern(self.string(company)) if company != NONE else None
+        project.purpose = self.string(purpose)
+        project.proposal = self.string(proposal)
+        project.factors = self._lines(factors_first, n_factors)
+        project.roi_lines = self._lines(roi_first, n_roi)
+        for attr, value in meta.get("fields", {}).items():
+            setattr(project, attr, value)
+
+        for row in range(tree_first, tree_first + n_trees):
+            section_key, depth_key, tree = self._read_tree(row)
+            project.roi_trees[section_key][depth_key] = tree
+        for row in range(group_first, group_first + n_groups):
+            section_key, depth_key, item_first, n_items = self._row("qa_groups", 4, row)
+            project.qa[self.string(section_key)][sys.intern(self.string(depth_key))] = tuple(
+                self._read_qa_item(i) for i in range(item_first, item_first + n_items)
+            )
+        return project
+
+    def _read_tree(self, row: int) -> tuple:
+        section_key, depth_key, graph, factor_first, n_factors, meta_sid = self._row("trees", 6, row)
+        section_key, depth_key = self.string(section_key), sys.intern(self.string(depth_key))
+        if meta_sid != NONE:
+            return section_key, depth_key, RoiTree.from_value(depth_key, self._meta(meta_sid)["value"])
+        if self._columns["tree_flags"][row] & _TREE_LEGACY:
+            return section_key, depth_key, RoiTree.from_value(depth_key, self.string(graph))
+        factors = None
+        if factor_first != NONE:
+            nodes = self._columns["factor_nodes"][factor_first:factor_first + n_factors].tolist()
+            values = self._columns["factor_values"][factor_first:factor_first + n_factors].tolist()
+            is_int = self._columns["factor_is_int"][factor_first:factor_first + n_factors].tolist()
+            factors = tuple(
+                (sys.intern(self.string(node)), int(value) if integer else value)
+                for node, value, integer in zip(nodes, values, is_int)
+            )
+        return section_key, depth_key, RoiTree(depth_key, self.string(graph), importance_factors=factors)
+
+    def _read_qa_item(self, row: int) -> QAItem:
+        parent, child, q_first, n_questions, meta_sid = self._row("qa_items", 5, row)
+        if meta_sid != NONE:
+            return QAItem.from_dict(self._meta(meta_sid)["value"])
+        return QAItem(self.string(parent), self.string(child), [self._read_question(i) for i in range(q_first, q_first + n_questions)])
+
+    def _read_question(self, row: int) -> Question:
+        qtype_raw, question, answer, meta_sid = self._row("questions", 4, row)
+        if meta_sid != NONE:
+            return Question.from_dict(self._meta(meta_sid)["value"])
+        return Question(self.string(question), self.string(answer), self.string(qtype_raw))
+
+    def question_types(self) -> dict:
+        """
+        コーパス全体の questionType ごとの質問数（数値列だけを読む）。
+        """
+        counts = {}
+        for value in self._columns["question_types"].tolist():
+            name = QuestionType(value).name
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    def documents(self) -> list:
+        """
+        コーパス内の各ファイルを IngestedFile にする。projects は番号アクセス時に初めて読む遅延リスト。
+        """
+        documents = []
+        for index in range(self.n_files):
+            entry = self.file(index)
+            documents.append(IngestedFile(
+                entry.name, entry.file_hash,
+                LazyProjects(self, entry.first_project, entry.n_projects),
+                [self.project_id(i) for i in range(entry.first_project, entry.first_project + entry.n_projects)],
+                entry.issues,
+            ))
+        return documents
+
+class LazyProjects:
+    """
+    Project のリストの代わりに使う読み取り専用の列（len・添字・反復に対応）。
+    """
+
+    def __init__(self, reader: CorpusReader, first: int, count: int):
+        self._reader = reader
+        self._first = first
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        return self._reader.project(self._first + index)
+
+    def __iter__(self):
+        return (self._reader.project(self._first + i) for i in range(self._count))
+
+    def company(self, index: int):
+        return self._reader.company(self._first + index)
+
+def project_company(projects, index: int):
+    """
+    projects（Project のリストか LazyProjects）の index 番目の企業名。LazyProjects なら Project を読まずに返す。
+    """
+    if isinstance(projects, LazyProjects):
+        return projects.company(index)
+    return projects[index].company
+
+###############################################################################
+# CLI
+###############################################################################
+def _verify(paths: list, corpus_path: str) -> int:
+    """
+    元の JSON と .dxc から読んだ結果が projects_to_json で一致するか確かめ、不一致のファイル数を返す。
+    """
+    mismatches = 0
+    with CorpusReader(corpus_path) as reader:
+        by_hash = {document.file_hash: document for document in reader.documents()}
+        for path in paths:
+            for document in load_path(path):
+                loaded = by_hash.get(document.file_hash)
+                same = loaded is not None and projects_to_json(list(loaded.projects)) == projects_to_json(document.projects)
+                same = same and list(loaded.project_ids) == list(document.project_ids)
+                if not same:
+                    mismatches += 1
+                    print(f"不一致: {path}")
+    return mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description="DXProjects の JSON をコンパイル済みコーパス（.dxc）に変換・確認する")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="JSON から .dxc を作る")
+    build.add_argument("patterns", nargs="+")
+    build.add_argument("-o", "--out", default="corpus.dxc")
+    build.add_argument("--verify", action="store_true", help="作成後に元の JSON と読み比べる")
+    info = subparsers.add_parser("info", help=".dxc の中身の概要を表示する")
+    info.add_argument("corpus")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        paths = sorted({p for pattern in args.patterns for p in glob.glob(pattern)})
+        started = time.monotonic()
+        n_files, n_projects, issues = build_corpus(paths, args.out)
+        errors = sum(1 for issue in issues if issue.level == "error")
+        print(f"{n_files} ファイル, {n_projects} プロジェクト, {os.path.getsize(args.out):,} バイト, "
+              f"{time.monotonic() - started:.2f} 秒 -> {args.out}（取り込み時のエラー {errors} 件）")
+        if args.verify:
+            mismatches = _verify(paths, args.out)
+            print("読み比べ: 一致" if not mismatches else f"読み比べ: {mismatches} ファイルが不一致")
+            if mismatches:
+                sys.exit(1)
+    else:
+        started = time.monotonic()
+        with CorpusReader(args.corpus) as reader:
+            opened = time.monotonic()
+            print(f"{args.corpus}: {reader.n_files} ファイル, {reader.n_projects} プロジェクト（開くのに {(opened - started) * 1000:.2f} ms）")
+            for index in range(reader.n_files):
+                entry = reader.file(index)
+                print(f"  {entry.name}: {entry.n_projects} プロジェクト（{entry.file_hash}）")
+            print(f"  questionType: {reader.question_types()}")
+            if reader.n_projects:
+                started = time.monotonic()
+                project = reader.project(reader.n_projects - 1)
+                print(f"  最後のプロジェクト（{project.company}）の読み込み: {(time.monotonic() - started) * 1000:.2f} ms")
+
+if __name__ == "__main__":
+    main()
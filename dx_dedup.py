@@ -0,0 +1,307 @@
+import argparse
+import glob
+import hashlib
+import re
+import unicodedata
+from typing import NamedTuple
+
+from dx_mermaid import parse_mermaid_structure
+from dx_model import split_section_key
+from dx_corpus import load_path
+
+###############################################################################
+# 生成データの重複・ほぼ重複の検出（MinHash + LSH）
+###############################################################################
+# プロジェクトの表（課題・提案・定量要素・ROI算定）、ROIツリーのラベル集合、Q&A の回答を
+# 文字 n-gram の集合にし、MinHash 署名を LSH のバンドに分けてバケットに入れる。
+# 同じバケットに入った組だけを候補として署名から類似度を推定するので、全組比較（O(n^2)）をしない。
+#
+# 署名は one permutation hashing（1回のハッシュを num_perm 個のビンに振り分け、空のビンは
+# 隣のビンから埋める）で作るため、1件あたりの計算量は n-gram 数に比例する。
+#
+# 各アイテムは (プロジェクトID, ウィジェットキーの接尾辞) で識別する:
+#   project : "_roi"                                     （ROI算定の評価）
+#   tree    : "_{mode}_roiTrees_{depth_key}"             （ツリー全体の評価）
+#   answer  : "_{mode}_QAndA_{depth_key}_{qa_idx}_{q_idx}"（Q&A の評価）
+# 評価のキーは prefix + 接尾辞 + "_good_or_bad" / "_comment"。
+
+KINDS = ("project", "tree", "answer")
+RATING_SUFFIXES = ("_good_or_bad", "_comment")
+UNRATED = "未評価"
+_HASH_BITS = 64
+_PUNCTUATION = re.compile(r"[\s、。，．,.・:：;；!！?？「」『』（）()\[\]【】\-ー→\"'`]+")
+
+class DedupItem(NamedTuple):
+    kind: str
+    pid: str
+    suffix: str
+    text: str
+    label: str   # 画面表示用の短い説明
+
+class Cluster(NamedTuple):
+    kind: str
+    members: tuple          # ((pid, suffix), ...)。先頭が代表
+    similarity: float       # クラスタ内で結合に使った組の推定類似度の最小値
+
+    @property
+    def representative(self) -> tuple:
+        return self.members[0]
+
+def normalize_text(text: str) -> str:
+    """
+    NFKC 正規化・小文字化し、空白と句読点を除く（表記ゆれで別物扱いにしないため）。
+    """
+    return _PUNCTUATION.sub("", unicodedata.normalize("NFKC", text or "").lower())
+
+def shingles(text: str, n: int = 3) -> set:
+    text = normalize_text(text)
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+def _hash64(shingle: str) -> int:
+    return int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+
+def minhash_signature(shingle_set: set, num_perm: int = 64) -> tuple:
+    """
+    one permutation hashing による MinHash 署名（長さ num_perm）。
+    """
+    empty = 1 << _HASH_BITS
+    bins = [empty] * num_perm
+    for shingle in shingle_set:
+        h = _hash64(shingle)
+        b = h % num_perm
+        v = h // num_perm
+        if v < bins[b]:
+            bins[b] = v
+    if all(v == empty for v in bins):
+        return tuple(bins)
+    # 空のビンは右隣（循環）の空でないビンの値で埋める（densification）
+    for b in range(num_perm):
+        if bins[b] == empty:
+            offset = 1
+            while bins[(b + offset) % num_perm] == empty:
+                offset += 1
+            bins[b] = bins[(b + offset) % num_perm] + offset * (empty // num_perm)
+    return tuple(bins)
+
+def estimate_similarity(a: tuple, b: tuple) -> float:
+    return sum(x == y for x, y in zip(a, b)) / len(a) if a else 0.0
+
+class _UnionFind:
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+
+    def find(self, x: int) -> int:
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, a: int, b: int):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            # 先に登録されたもの（アップロード順で先）を根にして代表にする
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+class DedupIndex:
+    """
+    アイテムを add() で登録し、build() でほぼ重複のクラスタを作る。
+    bands * rows = num_perm。類似度 s の組が候補になる確率は 1 - (1 - s^rows)^bands。
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, bands: int = 16, shingle_size: int = 3, min_shingles: int = 8):
+        if num_perm % bands:
+            raise ValueError("num_perm は bands で割り切れる必要があります")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.min_shingles = min_shingles
+        self.items = []
+        self._signatures = []
+        self._item_of = {}             # (pid, suffix) -> DedupItem
+        self.clusters = []
+        self._cluster_of = {}
+        self._labels = {}
+
+    def add(self, item: DedupItem):
+        if (item.pid, item.suffix) in self._item_of:
+            # 同じ内容のファイルを2回読んだ場合など、同じキーは最初の1件だけを使う
+            return
+        shingle_set = shingles(item.text, self.shingle_size)
+        if len(shingle_set) < self.min_shingles:
+            # 短すぎる文字列（「はい」など）は偶然一致しやすいので対象にしない
+            return
+        self._item_of[(item.pid, item.suffix)] = item
+        self.items.append(item)
+        self._signatures.append(minhash_signature(shingle_set, self.num_perm))
+
+    def build(self) -> list:
+        uf = _UnionFind(len(self.items))
+        pair_similarity = {}
+        # 署名がまったく同じもの（同じ文章の使い回しなど）は比較せずにまとめ、最初の1件だけをバケットに入れる
+        first_by_signature = {}
+        buckets = {}
+        for idx, (item, signature) in enumerate(zip(self.items, self._signatures)):
+            first = first_by_signature.setdefault((item.kind, signature), idx)
+            if first != idx:
+                uf.union(first, idx)
+                pair_similarity[(first, idx)] = 1.0
+                continue
+            for band in range(self.bands):
+                band_key = (item.kind, band, signature[band * self.rows:(band + 1) * self.rows])
+                buckets.setdefault(band_key, []).append(idx)
+        # バケット内の全組ではなく、各メンバーをバケット内の既存クラスタの先頭とだけ比べる
+        # （同じバケットに入るものはほとんど同じクラスタになるので、比較回数はほぼメンバー数に比例する）
+        for members in buckets.values():
+            heads = []
+            for other in members:
+                for first in heads:
+                    if uf.find(first) == uf.find(other):
+                        break
+                    pair = (first, other)
+                    similarity = pair_similarity.get(pair)
+                    if similarity is None:
+                        similarity = pair_similarity[pair] = estimate_similarity(self._signatures[first], self._signatures[other])
+                    if similarity >= self.threshold:
+                        uf.union(first, other)
+                        break
+                else:
+                    heads.append(other)
+
+        linked = {}
+        for (a, _), similarity in pair_similarity.items():
+            if similarity >= self.threshold:
+                root = uf.find(a)
+                linked[root] = min(similarity, linked.get(root, 1.0))
+        groups = {}
+        for idx in range(len(self.items)):
+            groups.setdefault(uf.find(idx), []).append(idx)
+        self.clusters = []
+        self._cluster_of = {}
+        self._labels = {(item.pid, item.suffix): item.label for item in self.items}
+        for root, members in sorted(groups.items()):
+            if len(members) < 2:
+                continue
+            cluster = Cluster(
+                self.items[root].kind,
+                tuple((self.items[i].pid, self.items[i].suffix) for i in members),
+                linked.get(root, 1.0),
+            )
+            self.clusters.append(cluster)
+            for i in members:
+                self._cluster_of[(self.items[i].pid, self.items[i].suffix)] = cluster
+        return self.clusters
+
+    def cluster_of(self, pid: str, suffix: str):
+        return self._cluster_of.get((pid, suffix))
+
+    def item(self, pid: str, suffix: str):
+        return self._item_of.get((pid, suffix))
+
+    def labels(self) -> dict:
+        """
+        (pid, suffix) -> 表示用のラベル（build() で作ったものを返す。呼び出し側で書き換えないこと）。
+        """
+        return self._labels
+
+def project_items(project, pid: str) -> list:
+    """
+    1プロジェクトから重複検出の対象アイテムを作る。企業名は比較に含めない。
+    """
+    company = project.company or pid
+    table_text = "\n".join(
+        str(x) for x in (project.purpose, project.proposal, *(project.factors or ()), *(project.roi_lines or ()))
+        if x
+    )
+    items = [DedupItem("project", pid, "_roi", table_text, f"{company} / ROI算定")]
+    for section_key, trees in project.roi_trees.items():
+        mode = split_section_key(section_key)[1]
+        for depth_key, tree in trees.items():
+            definitions, _ = parse_mermaid_structure(tree.graph or "")
+            labels = sorted({label for _, label in definitions})
+            items.append(DedupItem(
+                "tree", pid, f"_{mode}_roiTrees_{depth_key}", "\n".join(labels),
+                f"{company} / {section_key} / {depth_key}",
+            ))
+    for section_key, depths in project.qa.items():
+        mode = split_section_key(section_key)[1]
+        for depth_key, qa_items in depths.items():
+            for qa_idx, qa_item in enumerate(qa_items):
+                for q_idx, question in enumerate(qa_item.questions):
+                    items.append(DedupItem(
+                        "answer", pid, f"_{mode}_QAndA_{depth_key}_{qa_idx}_{q_idx}", question.answer or "",
+                        f"{company} / {section_key} / {depth_key} / {qa_idx}番目 質問{q_idx}",
+                    ))
+    return items
+
+def build_index(documents: list, threshold: float = 0.8, **options) -> DedupIndex:
+    """
+    IngestedFile のリストからインデックスを作り、クラスタリングまで行う。
+    """
+    index = DedupIndex(threshold, **options)
+    for document in documents:
+        for project, pid in zip(document.projects, document.project_ids):
+            for item in project_items(project, pid):
+                index.add(item)
+    index.build()
+    return index
+
+def propagate_ratings(index: DedupIndex, annotations: dict, prefix_for, overwrite: bool = False) -> dict:
+    """
+    各クラスタの代表の評価（良い/悪い・コメント）を他のメンバーに写す。
+    prefix_for(pid) は現在のウィジェットキーの接頭辞を返す関数。更新するキーと値の dict を返す。
+    未評価の代表は写さず、評価済みのメンバーは overwrite=True のときだけ上書きする。
+    """
+    updates = {}
+    for cluster in index.clusters:
+        rep_pid, rep_suffix = cluster.representative
+        rep_prefix = prefix_for(rep_pid)
+        if rep_prefix is None:
+            continue
+        rating = annotations.get(f"{rep_prefix}{rep_suffix}_good_or_bad", UNRATED)
+        if rating == UNRATED:
+            continue
+        comment = annotations.get(f"{rep_prefix}{rep_suffix}_comment", "")
+        for pid, suffix in cluster.members[1:]:
+            prefix = prefix_for(pid)
+            if prefix is None:
+                continue
+            rating_key = f"{prefix}{suffix}_good_or_bad"
+            comment_key = f"{prefix}{suffix}_comment"
+            if not overwrite and annotations.get(rating_key, UNRATED) != UNRATED:
+                continue
+            updates[rating_key] = rating
+            if overwrite or not annotations.get(comment_key):
+                updates[comment_key] = comment
+    return updates
+
+def main():
+    parser = argparse.ArgumentParser(description="コーパス中のほぼ重複するプロジェクト・ツリー・回答を列挙する")
+    parser.add_argument("patterns", nargs="*", default=["json_data/*.json"])
+    parser.add_argument("--threshold", type=float, default=0.8)
+    parser.add_argument("--kind", choices=KINDS, default=None)
+    args = parser.parse_args()
+
+    paths = sorted({p for pattern in args.patterns for p in glob.glob(pattern)})
+    documents = []
+    for path in paths:
+        documents.extend(load_path(path))
+    index = build_index(documents, args.threshold)
+    labels = index.labels()
+    file_of = {pid: document.name for document in documents for pid in document.project_ids}
+    counts = {kind: 0 for kind in KINDS}
+    for cluster in index.clusters:
+        counts[cluster.kind] += len(cluster.members) - 1
+        if args.kind and cluster.kind != args.kind:
+            continue
+        print(f"[{cluster.kind}] {len(cluster.members)} 件（類似度 >= {cluster.similarity:.2f}）")
+        for pid, suffix in cluster.members:
+            print(f"    {file_of[pid]}: {labels[(pid, suffix)]}")
+    print(f"{len(index.items)} アイテム, {len(index.clusters)} クラスタ, 代表以外 " +
+          ", ".join(f"{kind} {count}件" for kind, count in counts.items()))
+
+if __name__ == "__main__":
+    main()
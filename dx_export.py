@@ -0,0 +1,75 @@
+import gzip
+import json
+
+from dx_keys import EXPORT_FORMAT
+
+###############################################################################
+# アノテーションのエクスポート（全件 / 差分）
+###############################################################################
+# どちらも dx-annotations/2 形式（安定キー）で、差分エクスポートには
+#   "delta": true, "base_sequence": 直前のエクスポート番号, "removed": [消えたキー]
+# が付く。sequence の順に適用すれば全件エクスポートと同じ状態に戻せる。
+
+ENCODINGS = {
+    "pretty": ("JSON（整形）", ".json", "application/json"),
+    "compact": ("JSON（コンパクト）", ".json", "application/json"),
+    "gzip": ("gzip圧縮JSON", ".json.gz", "application/gzip"),
+}
+
+def build_full_export(index, annotations: dict, sequence: int = 0) -> tuple:
+    """
+    全アノテーションのエクスポートを作る。(payload, 次回の差分用ベースライン) を返す。
+    """
+    stable = index.stable_annotations(annotations)
+    payload = {
+        "format": EXPORT_FORMAT,
+        "sequence": sequence,
+        "projects": index.meta,
+        "annotations": stable,
+    }
+    return payload, stable
+
+def build_delta_export(index, annotations: dict, baseline: dict, sequence: int) -> tuple:
+    """
+    baseline（前回エクスポート時点の安定キー -> 値）から変わった項目だけのエクスポートを作る。
+    (payload, 次回の差分用ベースライン) を返す。
+    """
+    stable = index.stable_annotations(annotations)
+    changed = {k: v for k, v in stable.items() if k not in baseline or baseline[k] != v}
+    removed = [k for k in baseline if k not in stable]
+    touched = {k.partition("_")[0] for k in changed}
+    payload = {
+        "format": EXPORT_FORMAT,
+        "delta": True,
+        "base_sequence": sequence - 1,
+        "sequence": sequence,
+        "projects": {pid: meta for pid, meta in index.meta.items() if pid in touched},
+        "annotations": changed,
+        "removed": removed,
+    }
+    return payload, stable
+
+def encode_export(payload: dict, encoding: str = "pretty") -> bytes:
+    if encoding == "pretty":
+        return json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8")
+    compact = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if encoding == "gzip":
+        return gzip.compress(compact, mtime=0)
+    return compact
+
+def decode_export(raw: bytes):
+    """
+    encode_export の出力（gzip 圧縮も含む）を JSON として読み込む。
+    """
+    if raw[:2] == b"\x1f\x8b":
+        raw = gzip.decompress(raw)
+    return json.loads(raw.decode("utf-8"))
+
+def export_sort_key(named_document: tuple):
+    """
+    読み込み順を決めるキー。安定キー形式のエクスポートは sequence 順（全件 -> 差分）に並べる。
+    """
+    _, data = named_document
+    if isinstance(data, dict) and data.get("format") == EXPORT_FORMAT:
+        return (1, data.get("sequence", 0), bool(data.get("delta")))
+    return (0, 0, False)
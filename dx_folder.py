@@ -0,0 +1,185 @@
+import fnmatch
+import json
+import os
+import threading
+import time
+from typing import NamedTuple
+
+from dx_keys import content_hash
+
+###############################################################################
+# フォルダ内の JSON の差分読み込み（フォルダモード用のインデックスと変更監視）
+###############################################################################
+# パス -> (mtime, サイズ, 内容ハッシュ, 解析済みの dict) を覚えておき、refresh() では
+# 新しいファイル・mtime かサイズが変わったファイルだけを読み直す（内容ハッシュが同じなら解析もしない）。
+#
+# - watchdog が入っていればフォルダの変更通知を受け、refresh() は通知のあったパスだけを調べる
+#   （通知の取りこぼしに備えて full_scan_interval 秒ごとに一覧全体の stat も行う）
+# - watchdog が無い環境では refresh() のたびに一覧の stat だけを行う（中身は変わったものしか読まない）
+# - ファイルの番号（file_idx）は最初に見つけた順に振り、削除・追加があっても既存ファイルの番号は変えない
+#   （ウィジェットのキー "file{i}_proj{j}_..." がずれないようにするため）
+
+DEFAULT_FULL_SCAN_INTERVAL = 60.0
+DEFAULT_EXCLUDE = "*_annotated.json"   # app8 が同じフォルダに書き出す注釈付きファイル（入力として読まない）
+
+class FolderEntry(NamedTuple):
+    path: str
+    file_idx: int
+    mtime_ns: int
+    size: int
+    file_hash: str
+    data: object            # json.loads の結果（読めなかった場合は None）
+    error: str
+
+class FolderChanges(NamedTuple):
+    added: list
+    modified: list
+    removed: list
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.modified or self.removed)
+
+class FolderIndex:
+    """
+    1つのフォルダの *.json のインデックス。複数スレッド（セッション）から使ってよい。
+    exclude に一致するファイル名は pattern に一致しても対象にしない。
+    """
+
+    def __init__(self, folder: str, pattern: str = "*.json", watch: bool = True,
+                 full_scan_interval: float = DEFAULT_FULL_SCAN_INTERVAL, exclude: str = DEFAULT_EXCLUDE):
+        self.folder = folder
+        self.pattern = pattern
+        self.exclude = exclude
+        self.full_scan_interval = full_scan_interval
+        self.generation = 0             # 変更があるたびに増える（画面側の再描画の判定用）
+        self.last_changes = FolderChanges([], [], [])
+        self._entries = {}
+        self._next_file_idx = 0
+        self._dirty = set()
+        self._last_full_scan = None
+        self._lock = threading.Lock()
+        self._observer = self._start_watcher() if watch else None
+
+    @property
+    def watching(self) -> bool:
+        return self._observer is not None
+
+    def _name_matches(self, name: str) -> bool:
+        return fnmatch.fnmatch(name, self.pattern) and not (self.exclude and fnmatch.fnmatch(name, self.exclude))
+
+    def _matches(self, path: str) -> bool:
+        return os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.folder) and self._name_matches(os.path.basename(path))
+
+    def _start_watcher(self):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return None
+        index = self
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory:
+                    return
+                paths = [event.src_path, getattr(event, "dest_path", "")]
+                with index._lock:
+                    for path in paths:
+                        if path and index._matches(path):
+                            index._dirty.add(os.path.join(index.folder, os.path.basename(path)))
+
+        if not os.path.isdir(self.folder):
+            return None
+        observer = Observer()
+        observer.daemon = True
+        observer.schedule(_Handler(), self.folder, recursive=False)
+        try:
+            observer.start()
+        except OSError:
+            return None
+        return observer
+
+    def close(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+
+    def _listing(self) -> set:
+        try:
+            with os.scandir(self.folder) as it:
+                return {
+                    os.path.join(self.folder, entry.name) for entry in it
+                    if entry.is_file() and self._name_matches(entry.name)
+                }
+        except FileNotFoundError:
+            return set()
+
+    def _update(self, path: str, changes: FolderChanges):
+        previous = self._entries.get(path)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            if previous is not None:
+                del self._entries[path]
+                changes.removed.append(path)
+            return
+        if previous is not None and (previous.mtime_ns, previous.size) == (stat.st_mtime_ns, stat.st_size):
+            return
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+        except OSError as e:
+            raw, read_error = b"", str(e)
+        else:
+            read_error = ""
+        file_hash = content_hash(raw)
+        if previous is not None and previous.file_hash == file_hash and not read_error:
+            # 保存し直しただけで中身が同じなら解析しない
+            self._entries[path] = previous._replace(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+            return
+        data, error = None, read_error
+        if not error:
+            try:
+                data = json.loads(raw.decode("utf-8"))
+            except Exception as e:
+                error = f"JSONの読み込み中にエラーが発生しました: {e}"
+        if previous is None:
+            file_idx = self._next_file_idx
+            self._next_file_idx += 1
+            changes.added.append(path)
+        else:
+            file_idx = previous.file_idx
+            changes.modified.append(path)
+        self._entries[path] = FolderEntry(path, file_idx, stat.st_mtime_ns, stat.st_size, file_hash, data, error)
+
+    def refresh(self) -> FolderChanges:
+        """
+        変更のあったファイルだけを読み直し、今回の変更（追加・更新・削除されたパス）を返す。
+        """
+        changes = FolderChanges([], [], [])
+        now = time.monotonic()
+        with self._lock:
+            full_scan = (
+                self._observer is None or self._last_full_scan is None
+                or now - self._last_full_scan >= self.full_scan_interval
+            )
+            if full_scan:
+                candidates = self._listing() | set(self._entries)
+                self._last_full_scan = now
+                self._dirty.clear()
+            else:
+                candidates, self._dirty = self._dirty, set()
+            # 初回は名前順に番号を振る（以降に見つかったものは後ろに付く）
+            for path in sorted(candidates):
+                self._update(path, changes)
+            if changes:
+                self.generation += 1
+                self.last_changes = changes
+        return changes
+
+    def entries(self) -> list:
+        """
+        現在のファイルを file_idx の順に返す。
+        """
+        with self._lock:
+            return sorted(self._entries.values(), key=lambda entry: entry.file_idx)
@@ -0,0 +1,302 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from dx_schema import normalize_document
+
+###############################################################################
+# prompt.txt からの DXProjects 一括生成
+###############################################################################
+# - prompt.txt をテンプレートとして、1リクエストあたりの件数と追加条件（業種など）を差し込む
+# - OpenAI 互換の /chat/completions に asyncio で並列にリクエストする
+#   （同時実行数・毎秒リクエスト数の上限、指数バックオフでの再試行、応答のディスクキャッシュ付き）
+# - 応答の JSON を dx_schema で検証し、正常なものだけを取り込みフォルダに書き出す
+#
+# オフラインでの動作確認は dx_mock_llm のサーバを使う:
+#   python dx_mock_llm.py --port 8765 &
+#   python dx_generate.py --endpoint http://127.0.0.1:8765/v1 --requests 200 --out json_data
+
+DEFAULT_INDUSTRIES = [
+    "物流・倉庫", "製造", "小売", "金融", "医療", "不動産", "建設", "飲食",
+    "教育", "通信", "エネルギー", "自治体", "保険", "人材", "旅行・観光",
+]
+_RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+_RETRY_SEED_STEP = 1_000_003     # 検証エラーで送り直すときに seed をずらす幅
+
+class GenerationResult(NamedTuple):
+    job_id: int
+    path: str       # 書き出したファイル（失敗時は ""）
+    n_projects: int
+    attempts: int
+    cached: bool
+    error: str
+
+def build_prompt(template: str, n_projects: int = 5, variation: str = "") -> str:
+    """
+    prompt.txt の指示文に件数と追加条件を差し込む。
+    """
+    prompt = template.replace("5件", f"{n_projects}件", 1)
+    if variation:
+        prompt += f"\n\n### 追加条件\n\n- {variation}\n"
+    return prompt
+
+def extract_json(content: str):
+    """
+    応答本文から JSON を取り出す（```json ブロックや前後の説明文を許容する）。
+    """
+    fenced = re.search(r"```(?:json)?\s*(.*?)```", content, re.DOTALL)
+    text = fenced.group(1) if fenced else content
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        raise ValueError("応答にJSONが見つかりません")
+    return json.loads(text[start:end + 1])
+
+class RateLimiter:
+    """
+    毎秒 rate 回までに抑えるトークンバケット（rate <= 0 なら無制限）。
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class ResponseCache:
+    """
+    リクエスト内容のハッシュをキーに、応答本文をディスクに保存する。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)["content"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key: str, content: str):
+        if self.directory:
+            _atomic_write(self._path(key), json.dumps({"content": content}, ensure_ascii=False))
+
+def _atomic_write(path: str, text: str):
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def _post_json(url: str, payload: dict, api_key: str, timeout: float) -> tuple:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    request = urllib.request.Request(url, data=body, method="POST", headers={"Content-Type": "application/json"})
+    if api_key:
+        request.add_header("Authorization", f"Bearer {api_key}")
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+class Generator:
+    def __init__(
+        self,
+        endpoint: str,
+        model: str = "gpt-4o",
+        api_key: str = "",
+        out_dir: str = "json_data",
+        cache_dir: str = ".llm_cache",
+        concurrency: int = 16,
+        rate: float = 0.0,
+        max_retries: int = 5,
+        timeout: float = 300.0,
+        temperature: float = 0.7,
+    ):
+        self.url = endpoint.rstrip("/") + "/chat/completions"
+        self.model = model
+        self.api_key = api_key
+        self.out_dir = out_dir
+        self.cache = ResponseCache(cache_dir)
+        self.concurrency = concurrency
+        self.rate = rate
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.temperature = temperature
+        os.makedirs(out_dir, exist_ok=True)
+
+    def _payload(self, prompt: str, seed: int) -> dict:
+        return {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": self.temperature,
+            "seed": seed,
+        }
+
+    async def _request(self, loop, executor, limiter, payload: dict) -> str:
+        await limiter.acquire()
+        status, body = await loop.run_in_executor(executor, _post_json, self.url, payload, self.api_key, self.timeout)
+        if status != 200:
+            raise _RequestError(status, body[:200].decode("utf-8", "replace"))
+        return json.loads(body)["choices"][0]["message"]["content"]
+
+    async def _run_job(self, job_id: int, prompt: str, loop, executor, limiter, semaphore) -> GenerationResult:
+        payload = self._payload(prompt, job_id)
+        key = hashlib.sha256(json.dumps([self.url, payload], ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+        content = self.cache.get(key)
+        cached = content is not None
+        attempts = 0
+        last_error = ""
+
+        async with semaphore:
+            while True:
+                if content is None:
+                    attempts += 1
+                    try:
+                        content = await self._request(loop, executor, limiter, payload)
+                    except Exception as e:
+                        last_error = str(e)
+                        retryable = not isinstance(e, _RequestError) or e.status in _RETRYABLE_STATUS
+                        if not retryable or attempts > self.max_retries:
+                            return GenerationResult(job_id, "", 0, attempts, False, last_error)
+                        await asyncio.sleep(_backoff(attempts))
+                        continue
+
+                try:
+                    path, n_projects = await loop.run_in_executor(executor, self._validate_and_write, job_id, key, content)
+                except ValueError as e:
+                    # 壊れた応答はキャッシュせず、再試行の対象にする
+                    last_error = f"検証エラー: {e}"
+                    content, cached = None, False
+                    if attempts > self.max_retries:
+                        return GenerationResult(job_id, "", 0, attempts, False, last_error)
+                    # 同じ seed では同じ壊れた応答が返りやすいので変えて送り直す（キャッシュのキーは元の seed のまま）
+                    payload = self._payload(prompt, job_id + _RETRY_SEED_STEP * attempts)
+                    await asyncio.sleep(_backoff(attempts))
+                    continue
+                return GenerationResult(job_id, path, n_projects, attempts, cached, "")
+
+    def _validate_and_write(self, job_id: int, key: str, content: str) -> tuple:
+        """
+        応答を検証し、正常なら取り込みフォルダに書き出す。問題があれば ValueError。
+        """
+        data = extract_json(content)
+        normalized, issues = normalize_document(data, f"job{job_id}")
+        errors = [f"{i.path}: {i.message}" for i in issues if i.level == "error"]
+        if errors or not normalized["DXProjects"]:
+            raise ValueError("; ".join(errors) or "DXProjects が空です")
+        self.cache.put(key, content)
+        path = os.path.join(self.out_dir, f"gen_{key[:16]}.json")
+        _atomic_write(path, json.dumps(normalized, ensure_ascii=False, indent=2))
+        return path, len(normalized["DXProjects"])
+
+    async def run(self, prompts: list, progress=None) -> list:
+        """
+        prompts を並列に処理し、GenerationResult のリストを入力順で返す。
+        """
+        loop = asyncio.get_running_loop()
+        limiter = RateLimiter(self.rate, burst=self.concurrency)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = [None] * len(prompts)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            tasks = [
+                asyncio.ensure_future(self._run_job(job_id, prompt, loop, executor, limiter, semaphore))
+                for job_id, prompt in enumerate(prompts)
+            ]
+            for future in asyncio.as_completed(tasks):
+                result = await future
+                results[result.job_id] = result
+                if progress is not None:
+                    progress(result)
+        return results
+
+def _backoff(attempts: int) -> float:
+    """
+    再試行までの待ち時間（指数バックオフ + ゆらぎ。最大 60 秒）。
+    """
+    return min(60.0, 0.5 * 2 ** (attempts - 1)) * (0.5 + random.random())
+
+class _RequestError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+
+def build_prompts(template: str, n_requests: int, n_projects: int = 5, industries: list = None) -> list:
+    """
+    リクエストごとに業種を変えたプロンプトを作る。
+    """
+    industries = industries or DEFAULT_INDUSTRIES
+    return [
+        build_prompt(template, n_projects, f"対象業種は「{industries[i % len(industries)]}」とし、バリエーション番号 {i} として他と重複しない事例にしてください。")
+        for i in range(n_requests)
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description="prompt.txt から DXProjects JSON を並列生成する")
+    parser.add_argument("--endpoint", required=True, help="OpenAI 互換 API のベースURL（例: http://127.0.0.1:8765/v1）")
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--template", default="prompt.txt")
+    parser.add_argument("--requests", type=int, default=10, help="リクエスト数")
+    parser.add_argument("--projects-per-request", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rate", type=float, default=0.0, help="毎秒リクエスト数の上限（0で無制限）")
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--out", default="json_data", help="書き出し先（取り込みフォルダ）")
+    parser.add_argument("--cache-dir", default=".llm_cache")
+    args = parser.parse_args()
+
+    with open(args.template, "r", encoding="utf-8") as f:
+        template = f.read()
+    prompts = build_prompts(template, args.requests, args.projects_per_request)
+    generator = Generator(
+        args.endpoint,
+        model=args.model,
+        api_key=os.environ.get("DX_LLM_API_KEY", ""),
+        out_dir=args.out,
+        cache_dir=args.cache_dir,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        max_retries=args.retries,
+    )
+
+    started = time.monotonic()
+    results = asyncio.run(generator.run(prompts))
+    elapsed = time.monotonic() - started
+    ok = [r for r in results if r.path]
+    failed = [r for r in results if not r.path]
+    print(f"{len(ok)}/{len(results)} 件成功（{sum(r.n_projects for r in ok)} プロジェクト, "
+          f"キャッシュ {sum(r.cached for r in ok)} 件）, {elapsed:.1f} 秒, {len(results) / max(elapsed, 1e-9):.1f} req/s")
+    for r in failed:
+        print(f"  job{r.job_id}: {r.error}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import hashlib
+import re
+
+###############################################################################
+# アップロード順に依存しない安定ID
+###############################################################################
+# ウィジェットのキーは従来どおり "file{file_idx}_proj{proj_idx}_..." だが、
+# 保存・再読み込みでは先頭を内容由来のプロジェクトID "p{hash}" に置き換えた安定キーを使う。
+#
+#   file0_proj2_assignment_roiTrees_depth3_good_or_bad
+#   -> p1a2b3c4d5e6f_assignment_roiTrees_depth3_good_or_bad
+#
+# 後半部分（セクション名・深さキー・Mermaid のノードID・Q&Aの位置）はファイル内容だけで決まるため、
+# 先頭を置き換えるだけでアップロード順に依存しないキーになる。
+
+EXPORT_FORMAT = "dx-annotations/2"
+_WIDGET_KEY_PATTERN = re.compile(r"^file(\d+)_proj(\d+)(.*)$", re.DOTALL)
+
+def content_hash(raw: bytes) -> str:
+    """
+    ファイル内容の SHA-256（先頭16桁）。
+    """
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+def project_id(file_hash: str, company_name: str, proj_idx: int) -> str:
+    """
+    ファイルの内容ハッシュ・企業名・ファイル内の位置から決まるプロジェクトID。
+    """
+    digest = hashlib.sha256(f"{file_hash}\0{company_name}\0{proj_idx}".encode("utf-8")).hexdigest()
+    return f"p{digest[:12]}"
+
+def repeat_project_id(pid: str, repeat: int) -> str:
+    """
+    同じ内容のファイルを複数回読み込んだとき、2つ目以降のコピーに付けるプロジェクトID（repeat は 1 から）。
+    内容だけから決まる ID はコピー同士で同じになり、注釈が1つにまとめられてしまうため。
+    """
+    return f"{pid}r{repeat}"
+
+def distinct_project_ids(documents: list) -> list:
+    """
+    IngestedFile のリストについて、ファイルごとのプロジェクトIDのリストを返す。
+    同じ内容（file_hash）のファイルの2つ目以降は repeat_project_id で別のIDにする。
+    """
+    repeats = {}
+    result = []
+    for document in documents:
+        repeat = repeats[document.file_hash] = repeats.get(document.file_hash, -1) + 1
+        result.append([repeat_project_id(pid, repeat) for pid in document.project_ids] if repeat else list(document.project_ids))
+    return result
+
+def widget_prefix(file_idx: int, proj_idx: int) -> str:
+    return f"file{file_idx}_proj{proj_idx}"
+
+def split_widget_key(widget_key: str):
+    """
+    "file{i}_proj{j}{suffix}" を (i, j, suffix) に分解する。形式が違えば None。
+    """
+    match = _WIDGET_KEY_PATTERN.match(widget_key)
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2)), match.group(3)
+
+def split_stable_key(stable_key: str) -> tuple:
+    """
+    "p{hash}{suffix}" を (project_id, suffix) に分解する。
+    """
+    pid, sep, rest = stable_key.partition("_")
+    return pid, sep + rest
+
+class AnnotationKeyIndex:
+    """
+    安定キー <-> 現在のウィジェットキー の対応表。
+    プロジェクト単位で登録し、キー単位の変換は接頭辞の置き換えだけで行う。
+    """
+
+    def __init__(self):
+        self._pid_by_prefix = {}
+        self._prefix_by_pid = {}
+        self.meta = {}
+
+    def register(self, file_idx: int, proj_idx: int, pid: str, **meta):
+        prefix = widget_prefix(file_idx, proj_idx)
+        if self._prefix_by_pid.get(pid, prefix) != prefix:
+            # 上書きすると2つのプロジェクトの注釈が同じ安定キーに混ざる
+            raise ValueError(f"プロジェクトID {pid} は {self._prefix_by_pid[pid]} に登録済みです（{prefix}）")
+        self._pid_by_prefix[prefix] = pid
+        self._prefix_by_pid[pid] = prefix
+        self.meta[pid] = {"file_idx": file_idx, "proj_idx": proj_idx, **meta}
+
+    def __contains__(self, pid: str) -> bool:
+        return pid in self._prefix_by_pid
+
+    def project_id_for(self, file_idx: int, proj_idx: int):
+        return self._pid_by_prefix.get(widget_prefix(file_idx, proj_idx))
+
+    def prefix_for(self, pid: str):
+        return self._prefix_by_pid.get(pid)
+
+    def to_stable(self, widget_key: str):
+        parts = split_widget_key(widget_key)
+        if parts is None:
+            return None
+        pid = self._pid_by_prefix.get(widget_prefix(parts[0], parts[1]))
+        return None if pid is None else pid + parts[2]
+
+    def to_widget(self, stable_key: str):
+        pid, suffix = split_stable_key(stable_key)
+        prefix = self._prefix_by_pid.get(pid)
+        return None if prefix is None else prefix + suffix
+
+    def stable_annotations(self, annotations: dict) -> dict:
+        """
+        ウィジェットキーの dict を安定キーの dict に変換する（対応の無いキーは落とす）。
+        """
+        result = {}
+        for key, value in annotations.items():
+            stable_key = self.to_stable(key)
+            if stable_key is not None:
+                result[stable_key] = value
+        return result
+
+    def join(self, stable_annotations: dict) -> tuple:
+        """
+        安定キーの dict を現在のウィジェットキーに対応づける。
+        (ウィジェットキーの dict, 対応先が無かった安定キーのリスト) を返す。
+        """
+        mapped = {}
+        unmapped = []
+        for stable_key, value in stable_annotations.items():
+            widget_key = self.to_widget(stable_key)
+            if widget_key is None:
+                unmapped.append(stable_key)
+            else:
+                mapped[widget_key] = value
+        return mapped, unmapped
@@ -0,0 +1,284 @@
+import argparse
+import glob
+import re
+import time
+import unicodedata
+from typing import NamedTuple
+
+import numpy as np
+
+from dx_comments import hashed_ngrams, unique_counts
+from dx_corpus import load_path
+from dx_prelabel import BAD, GOOD, load_annotations, qa_examples
+
+###############################################################################
+# ルールによる Q&A の機械的な検査（ラベリング関数）
+###############################################################################
+# 生成された Q&A の不備には、読まなくても機械的に見つかるものが多い
+# （who の答えに人・部署が出てこない、答えが子ノードに触れていない、prompt.txt の「口語調」になっていない、
+#   同じ親ノードの中で同じ質問が繰り返されている、など）。
+#
+# 1つのルール（ラベリング関数）は Q&A 全体を平らにした QACorpus を受け取り、全件分の投票
+# （GOOD_VOTE / BAD_VOTE / ABSTAIN）を1本の配列で返す。文字列の判定は numpy.strings の配列演算で行い、
+# 1件ずつの Python のループは書かない。
+# 投票は Q&A ごとに足し合わせて事前アノテーション（ItemFlags）にし、ルールごとに
+#   カバー率（投票した割合）・重なり（他のルールも投票した割合）・衝突（他のルールと逆の投票をした割合）・
+#   人手の評価との一致率
+# を集計する。
+#
+# ルールを足すときは @labeling_function を付けた関数を書くだけでよい（LABELING_FUNCTIONS に登録される）。
+
+GOOD_VOTE, BAD_VOTE, ABSTAIN = 1, -1, 0
+
+_STRING = np.dtypes.StringDType()
+
+class QACorpus(NamedTuple):
+    keys: list              # ウィジェットキーの接頭辞（QAExample.key）
+    qtype: np.ndarray       # "HOW" / "WHAT" / ...（StringDType）
+    question: np.ndarray    # 以下の文字列は NFKC 正規化・空白除去済み（StringDType）
+    answer: np.ndarray
+    child_label: np.ndarray # 子ノードの表示名（"CR_A1 (作業時間短縮)" の括弧の中。無ければ空）
+    group: np.ndarray       # 同じ親ノードの Q&A（1つの QAndA 項目）の通し番号
+
+class LabelingFunction(NamedTuple):
+    name: str
+    description: str
+    apply: object           # QACorpus -> 投票の配列（int8, 長さ = Q&A の件数）
+
+class RuleStats(NamedTuple):
+    name: str
+    description: str
+    votes: int
+    coverage: float         # 投票した Q&A の割合
+    overlap: float          # 投票した Q&A のうち、他のルールも投票した割合
+    conflict: float         # 投票した Q&A のうち、他のルールが逆の投票をした割合
+    accuracy: float         # 人手で評価済みの Q&A での一致率（評価済みの項目に投票が無ければ None）
+    n_gold: int
+
+class ItemFlags(NamedTuple):
+    label: str              # 投票の合計が正なら GOOD, 負なら BAD, 割れていれば None
+    bad_rules: tuple        # BAD に投票したルールの説明
+    good_rules: tuple       # GOOD に投票したルールの説明
+
+LABELING_FUNCTIONS = []
+
+def labeling_function(name: str, description: str):
+    """
+    ルールを LABELING_FUNCTIONS に登録するデコレータ。
+    """
+    def register(apply):
+        LABELING_FUNCTIONS.append(LabelingFunction(name, description, apply))
+        return apply
+    return register
+
+def _normalize(text: str) -> str:
+    return "".join(unicodedata.normalize("NFKC", text).split())
+
+_NODE_LABEL = re.compile(r"\((.+)\)\s*$")
+
+def node_label(node: str) -> str:
+    """
+    "CR_A1 (作業時間短縮)" / "SRI_B2_1_1（パーソナライズド・オファー）" の表示名の部分。括弧が無ければ空文字。
+    """
+    match = _NODE_LABEL.search(unicodedata.normalize("NFKC", node or ""))
+    return _normalize(match.group(1)) if match else ""
+
+def flatten(examples: list) -> QACorpus:
+    """
+    QAExample のリスト（dx_prelabel.qa_examples）をルールから使う配列にする。
+    """
+    groups = {}
+    group = np.fromiter(
+        (groups.setdefault(e.key.rsplit("_", 1)[0], len(groups)) for e in examples),
+        dtype=np.int64, count=len(examples),
+    )
+    return QACorpus(
+        keys=[e.key for e in examples],
+        qtype=np.array([e.qtype for e in examples], dtype=_STRING),
+        question=np.array([_normalize(e.question) for e in examples], dtype=_STRING),
+        answer=np.array([_normalize(e.answer) for e in examples], dtype=_STRING),
+        child_label=np.array([node_label(e.child) for e in examples], dtype=_STRING),
+        group=group,
+    )
+
+def contains_any(texts: np.ndarray, words) -> np.ndarray:
+    """
+    各テキストが words のどれかを含むか（bool の配列）。
+    """
+    found = np.zeros(len(texts), dtype=bool)
+    for word in words:
+        found |= np.strings.find(texts, word) >= 0
+    return found
+
+def votes_where(condition: np.ndarray, vote: int) -> np.ndarray:
+    return np.where(condition, vote, ABSTAIN).astype(np.int8)
+
+def bigram_coverage(labels: np.ndarray, texts: np.ndarray) -> tuple:
+    """
+    labels の各文字 bigram のうち texts（同じ行）に出てくるものの数と、labels の bigram の数（重複を除く）。
+    """
+    n = len(labels)
+    label_rows, label_grams = hashed_ngrams(labels.tolist(), 32, (2, 2))
+    text_rows, text_grams = hashed_ngrams(texts.tolist(), 32, (2, 2))
+    label_keys, _ = unique_counts((label_rows << 32) | label_grams)
+    present = np.isin(label_keys, (text_rows << 32) | text_grams)
+    rows = label_keys >> 32
+    return np.bincount(rows[present], minlength=n), np.bincount(rows, minlength=n)
+
+###############################################################################
+# ルール
+###############################################################################
+_PERSON_WORDS = (
+    "誰", "担当", "チーム", "部", "課", "室", "班", "本部", "センター", "グループ", "委員会",
+    "者", "員", "長", "役員", "経営", "スタッフ", "メンバー", "リーダー", "マネージャー", "オペレーター",
+    "ベンダー", "パートナー", "業者", "外部", "専門家", "社", "人", "さん", "様", "顧客", "ユーザー", "現場",
+)
+
+@labeling_function("who_without_person", "who の答えに人・チーム・部署が出てこない")
+def who_without_person(corpus: QACorpus) -> np.ndarray:
+    return votes_where((corpus.qtype == "WHO") & ~contains_any(corpus.answer, _PERSON_WORDS), BAD_VOTE)
+
+@labeling_function("answer_ignores_child", "質問と答えのどちらも子ノードの内容に触れていない")
+def answer_ignores_child(corpus: QACorpus) -> np.ndarray:
+    # 答えは子ノードを言い換えることが多いので、質問と合わせて1文字も重ならないものだけを拾う
+    matched, total = bigram_coverage(corpus.child_label, np.strings.add(np.strings.add(corpus.question, "\n"), corpus.answer))
+    return votes_where((total > 0) & (matched == 0), BAD_VOTE)
+
+@labeling_function("answer_mentions_child", "答えが子ノードの内容に触れている")
+def answer_mentions_child(corpus: QACorpus) -> np.ndarray:
+    matched, total = bigram_coverage(corpus.child_label, corpus.answer)
+    return votes_where((total > 0) & (2 * matched >= total), GOOD_VOTE)
+
+_WRITTEN_STYLE = ("である", "であろう", "であるか", "せよ", "述べよ", "答えよ", "のか。", "とは何か", "べきか。")
+_QUESTION_ENDINGS = ("?", "の", "か", "かな", "よね", "ね", "って", "っけ")
+
+@labeling_function("not_colloquial", "口語調になっていない（書き言葉・質問の形になっていない）")
+def not_colloquial(corpus: QACorpus) -> np.ndarray:
+    written = contains_any(corpus.question, _WRITTEN_STYLE) | contains_any(corpus.answer, _WRITTEN_STYLE)
+    asking = np.zeros(len(corpus.question), dtype=bool)
+    for ending in _QUESTION_ENDINGS:
+        asking |= np.strings.endswith(corpus.question, ending)
+    return votes_where(written | ~asking, BAD_VOTE)
+
+_QTYPE_CUES = {
+    "HOW": ("どう", "どのよう", "どんな方法", "どんな手", "方法", "やり方", "手順", "いかに", "どれくらい", "どのくらい", "どの程度"),
+    # 「どの費用」「どのくらい」「いくら」「どうなる」のように量や対象・結果を尋ねる言い方と、「必要な施策は?」のような省略形も WHAT として扱う
+    "WHAT": ("何", "なに", "なん", "どんな", "どういう", "どのような", "どの", "どのくらい", "いくら", "どうな", "は?"),
+    "WHICH": ("どれ", "どの", "どちら", "いずれ", "どんな"),
+    "WHO": ("誰", "だれ", "どなた", "どの部", "どのチーム", "どの担当", "担当", "主体"),
+    "WHERE": ("どこ", "どの場所", "どの拠点", "どの部", "どの工程", "どの現場", "どの段階", "どの範囲", "どの部分", "どの"),
+}
+
+@labeling_function("qtype_cue_missing", "質問文に questionType らしい疑問詞が無い")
+def qtype_cue_missing(corpus: QACorpus) -> np.ndarray:
+    missing = np.zeros(len(corpus.question), dtype=bool)
+    for qtype, cues in _QTYPE_CUES.items():
+        missing |= (corpus.qtype == qtype) & ~contains_any(corpus.question, cues)
+    return votes_where(missing, BAD_VOTE)
+
+@labeling_function("duplicate_in_parent", "同じ親ノードの中に同じ質問がある")
+def duplicate_in_parent(corpus: QACorpus) -> np.ndarray:
+    questions = np.strings.rstrip(np.strings.lower(corpus.question), "?。!")
+    _, inverse, counts = np.unique(questions, return_inverse=True, return_counts=True)
+    # 質問文の番号と親ノードの番号の組で数え直す（同じ質問でも親ノードが違えば重複にしない）
+    pairs = corpus.group * len(counts) + inverse.reshape(-1)
+    keys, pair_counts = unique_counts(pairs)
+    duplicated = pair_counts[np.searchsorted(keys, pairs)] > 1
+    return votes_where(duplicated & (np.strings.str_len(questions) > 0), BAD_VOTE)
+
+###############################################################################
+# 投票の集計
+###############################################################################
+def apply_functions(corpus: QACorpus, functions: list = None) -> np.ndarray:
+    """
+    投票の行列（Q&A の件数 × ルール数, int8）。
+    """
+    functions = LABELING_FUNCTIONS if functions is None else functions
+    votes = np.zeros((len(corpus.keys), len(functions)), dtype=np.int8)
+    for j, function in enumerate(functions):
+        votes[:, j] = function.apply(corpus)
+    return votes
+
+def gold_votes(corpus: QACorpus, annotations: dict) -> np.ndarray:
+    """
+    人手の評価を投票と同じ値にした配列（未評価は ABSTAIN）。
+    """
+    to_vote = {GOOD: GOOD_VOTE, BAD: BAD_VOTE}
+    return np.fromiter(
+        (to_vote.get(annotations.get(f"{key}_good_or_bad"), ABSTAIN) for key in corpus.keys),
+        dtype=np.int8, count=len(corpus.keys),
+    )
+
+def rule_stats(votes: np.ndarray, functions: list = None, gold: np.ndarray = None) -> list:
+    functions = LABELING_FUNCTIONS if functions is None else functions
+    n = max(len(votes), 1)
+    voted = votes != ABSTAIN
+    n_voted = voted.sum(axis=0)
+    n_positive = (votes == GOOD_VOTE).sum(axis=1)
+    n_negative = (votes == BAD_VOTE).sum(axis=1)
+    stats = []
+    for j, function in enumerate(functions):
+        mine = voted[:, j]
+        others = voted.sum(axis=1) - mine
+        opposite = np.where(votes[:, j] == GOOD_VOTE, n_negative, np.where(votes[:, j] == BAD_VOTE, n_positive, 0))
+        denominator = max(int(n_voted[j]), 1)
+        accuracy, n_gold = None, 0
+        if gold is not None:
+            judged = mine & (gold != ABSTAIN)
+            n_gold = int(judged.sum())
+            if n_gold:
+                accuracy = float((votes[judged, j] == gold[judged]).mean())
+        stats.append(RuleStats(
+            function.name, function.description, int(n_voted[j]), float(n_voted[j]) / n,
+            float((mine & (others > 0)).sum()) / denominator,
+            float((mine & (opposite > 0)).sum()) / denominator,
+            accuracy, n_gold,
+        ))
+    return stats
+
+def item_flags(corpus: QACorpus, votes: np.ndarray, functions: list = None) -> dict:
+    """
+    ウィジェットキーの接頭辞 -> ItemFlags（どのルールも投票しなかった Q&A は含めない）。
+    """
+    functions = LABELING_FUNCTIONS if functions is None else functions
+    total = votes.sum(axis=1, dtype=np.int64)
+    flags = {}
+    for i in np.flatnonzero((votes != ABSTAIN).any(axis=1)):
+        row = votes[i]
+        flags[corpus.keys[i]] = ItemFlags(
+            GOOD if total[i] > 0 else BAD if total[i] < 0 else None,
+            tuple(functions[j].description for j in np.flatnonzero(row == BAD_VOTE)),
+            tuple(functions[j].description for j in np.flatnonzero(row == GOOD_VOTE)),
+        )
+    return flags
+
+###############################################################################
+# CLI
+###############################################################################
+def main():
+    parser = argparse.ArgumentParser(description="ルール（ラベリング関数）で Q&A を一括検査し、ルールごとの集計を表示する")
+    parser.add_argument("corpus", nargs="+", help="元データ（JSON / .dxc。アップロード時と同じ順に指定する）")
+    parser.add_argument("--annotations", help="アノテーション（エクスポートまたはウィジェットキー形式。一致率の計算に使う）")
+    parser.add_argument("--show", type=int, default=0, help="悪いと判定された Q&A をこの件数だけ表示する")
+    args = parser.parse_args()
+
+    documents = [document for pattern in args.corpus for path in sorted(glob.glob(pattern)) for document in load_path(path)]
+    annotations = load_annotations(args.annotations, documents) if args.annotations else {}
+
+    examples = qa_examples(documents)
+    started = time.monotonic()
+    corpus = flatten(examples)
+    votes = apply_functions(corpus)
+    print(f"{len(examples)} 件の Q&A に {len(LABELING_FUNCTIONS)} 個のルールを適用（{time.monotonic() - started:.2f} 秒）")
+    for stat in rule_stats(votes, gold=gold_votes(corpus, annotations) if annotations else None):
+        accuracy = f", 一致率 {stat.accuracy:.1%}（{stat.n_gold} 件）" if stat.accuracy is not None else ""
+        print(f"{stat.name:22s} {stat.votes:6d} 件  カバー率 {stat.coverage:6.1%}  重なり {stat.overlap:6.1%}  衝突 {stat.conflict:6.1%}{accuracy}")
+    if args.show:
+        by_key = {e.key: e for e in examples}
+        flagged = [(key, flags) for key, flags in item_flags(corpus, votes).items() if flags.label == BAD]
+        for key, flags in flagged[:args.show]:
+            e = by_key[key]
+            print(f"- {key}: {' / '.join(flags.bad_rules)}\n    [{e.qtype}] {e.child} Q: {e.question} A: {e.answer}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import argparse
+import glob
+import re
+import unicodedata
+from typing import NamedTuple
+
+from dx_corpus import load_path
+from dx_mermaid import parse_mermaid_structure
+from dx_model import parse_depth
+
+###############################################################################
+# Q&A の parentNode / childNode と ROI ツリーのノードの対応付け（双方向の索引）
+###############################################################################
+# parentNode / childNode は自由記述で、次のような形が混在している。
+#   "CR_A1 (作業時間短縮)" / "SRI_B2_1_1（パーソナライズド・オファー）" / "CostReduction"
+#   "CR_A1（人件費削減）, CR_A2（在庫コスト削減）"（複数のノード）
+# これを同じモード・同じ深さの ROI ツリー（QAndA_xxx の Depth3 なら roiTrees_xxx の depth3）のノードIDに解決し、
+#   - Q&A 項目 -> 親ノード・子ノードのID（解決できなかった参照は unresolved に残す）
+#   - ノード -> そのノードを親・子として参照している Q&A 項目
+# の両方向の索引を取り込み時に1回だけ作る（SharedCorpus に入れてセッション間で共有する）。
+#
+# 解決の順序: ノードIDの完全一致 → 大文字小文字を無視した一致 → 表示名（括弧の中）の一致・包含（候補が1つのときだけ）
+
+PARENT, CHILD = "parent", "child"
+
+class NodeRef(NamedTuple):
+    raw: str            # 元の文字列の該当部分
+    node_id: str        # 先頭のID部分（無ければ空）
+    label: str          # 括弧の中の表示名（無ければ空）
+
+class ItemLink(NamedTuple):
+    section_key: str    # "QAndA_assignment_cost_only" など
+    depth_key: str
+    qa_idx: int
+    tree_section: str   # 対応する roiTrees のセクション（無ければ None）
+    tree_depth: str     # 対応する深さのキー（無ければ None）
+    parents: tuple      # 解決できた親ノードのID
+    children: tuple     # 解決できた子ノードのID
+    unresolved: tuple   # ((PARENT / CHILD, 元の文字列), ...)
+
+class ProjectLinks(NamedTuple):
+    items: dict         # (section_key, depth_key, qa_idx) -> ItemLink
+    nodes: dict         # (tree_section, tree_depth, node_id) -> ((section_key, depth_key, qa_idx, PARENT / CHILD), ...)
+
+    def unresolved_items(self) -> list:
+        return [link for link in self.items.values() if link.unresolved]
+
+_REF_SEPARATORS = ",、;；/／"
+_REF_PATTERN = re.compile(r"^([^\s(（]*)\s*(?:[(（](.*?)[)）])?$")
+
+def _normalize(text: str) -> str:
+    return "".join(unicodedata.normalize("NFKC", text or "").lower().split())
+
+def parse_node_refs(text: str) -> list:
+    """
+    parentNode / childNode の文字列を NodeRef のリストに分解する（括弧の中の区切り文字では分けない）。
+    """
+    parts, current, depth = [], [], 0
+    for ch in text or "":
+        if ch in "(（":
+            depth += 1
+        elif ch in ")）":
+            depth = max(depth - 1, 0)
+        elif depth == 0 and ch in _REF_SEPARATORS:
+            parts.append("".join(current))
+            current = []
+            continue
+        current.append(ch)
+    parts.append("".join(current))
+    refs = []
+    for part in (part.strip() for part in parts):
+        if not part:
+            continue
+        match = _REF_PATTERN.match(part)
+        if match:
+            refs.append(NodeRef(part, match.group(1), (match.group(2) or "").strip()))
+        else:
+            # "作業時間短縮" のように ID が無く表示名だけのもの
+            refs.append(NodeRef(part, "", part))
+    return refs
+
+def tree_node_labels(graph: str) -> dict:
+    """
+    node_id -> ラベル（辺にだけ出てきてラベルの定義が無いノードはIDをラベルにする）。
+    """
+    definitions, edges = parse_mermaid_structure(graph or "")
+    labels = {}
+    for node_id, label in definitions:
+        labels.setdefault(node_id, label)
+    for parent, child in edges:
+        labels.setdefault(parent, parent)
+        labels.setdefault(child, child)
+    return labels
+
+def resolve_ref(ref: NodeRef, node_labels: dict, normalized: dict = None) -> str:
+    """
+    NodeRef をノードIDに解決する。解決できなければ None。
+    normalized: 正規化したラベル -> ノードIDのリスト（同じツリーで何度も呼ぶときは作っておいて渡す）
+    """
+    if ref.node_id in node_labels:
+        return ref.node_id
+    folded = ref.node_id.lower()
+    matches = [node_id for node_id in node_labels if node_id.lower() == folded] if folded else []
+    if len(matches) == 1:
+        return matches[0]
+    label = _normalize(ref.label or ref.raw)
+    if not label:
+        return None
+    if normalized is None:
+        normalized = _normalized_labels(node_labels)
+    exact = normalized.get(label, [])
+    if len(exact) == 1:
+        return exact[0]
+    # "作業時間短縮" と "作業時間短縮(約150時間/月)" のような言い回しの差は包含で拾う
+    if len(label) < 2:
+        return None
+    partial = {node_id for text, ids in normalized.items() if len(text) >= 2 and (label in text or text in label) for node_id in ids}
+    return partial.pop() if len(partial) == 1 else None
+
+def _normalized_labels(node_labels: dict) -> dict:
+    normalized = {}
+    for node_id, label in node_labels.items():
+        normalized.setdefault(_normalize(label), []).append(node_id)
+        # 括弧の前の部分（"作業時間短縮(約150時間/月)" の "作業時間短縮"）でも引けるようにする
+        head = _normalize(re.split(r"[(（]", label, maxsplit=1)[0])
+        if head and head != _normalize(label):
+            normalized.setdefault(head, []).append(node_id)
+    return normalized
+
+def tree_section_for(qa_section_key: str, roi_trees: dict) -> str:
+    """
+    "QAndA_assignment_cost_only" -> "roiTrees_assignment_cost_only"（旧形式の "QAndA" -> "roiTrees"）。無ければ None。
+    """
+    candidate = "roiTrees" + qa_section_key[len("QAndA"):]
+    return candidate if candidate in roi_trees else None
+
+def tree_depth_for(depth_key: str, trees: dict) -> str:
+    """
+    "Depth3" -> "depth3" のように、同じ深さの数値を持つツリーのキー。無ければ None。
+    """
+    if depth_key in trees:
+        return depth_key
+    depth = parse_depth(depth_key)
+    return next((key for key, tree in trees.items() if tree.depth == depth and depth > 0), None)
+
+def link_project(project) -> ProjectLinks:
+    items = {}
+    nodes = {}
+    labels_cache = {}
+    for section_key, depths in project.qa.items():
+        tree_section = tree_section_for(section_key, project.roi_trees)
+        trees = project.roi_trees.get(tree_section, {}) if tree_section else {}
+        for depth_key, qa_items in depths.items():
+            tree_depth = tree_depth_for(depth_key, trees)
+            if tree_depth is not None and (tree_section, tree_depth) not in labels_cache:
+                node_labels = tree_node_labels(trees[tree_depth].graph)
+                labels_cache[(tree_section, tree_depth)] = (node_labels, _normalized_labels(node_labels))
+            node_labels, normalized = labels_cache.get((tree_section, tree_depth), ({}, {}))
+            for qa_idx, qa_item in enumerate(qa_items):
+                resolved = {PARENT: [], CHILD: []}
+                unresolved = []
+                for role, text in ((PARENT, qa_item.parent), (CHILD, qa_item.child)):
+                    for ref in parse_node_refs(text):
+                        node_id = resolve_ref(ref, node_labels, normalized)
+                        if node_id is None:
+                            unresolved.append((role, ref.raw))
+                        elif node_id not in resolved[role]:
+                            resolved[role].append(node_id)
+                            nodes.setdefault((tree_section, tree_depth, node_id), []).append((section_key, depth_key, qa_idx, role))
+                items[(section_key, depth_key, qa_idx)] = ItemLink(
+                    section_key, depth_key, qa_idx, tree_section, tree_depth,
+                    tuple(resolved[PARENT]), tuple(resolved[CHILD]), tuple(unresolved),
+                )
+    return ProjectLinks(items, {key: tuple(refs) for key, refs in nodes.items()})
+
+###############################################################################
+# CLI
+###############################################################################
+def main():
+    parser = argparse.ArgumentParser(description="Q&A の parentNode / childNode を ROI ツリーのノードに対応付け、解決できない参照を一覧にする")
+    parser.add_argument("patterns", nargs="*", default=["json_data/*.json"])
+    args = parser.parse_args()
+
+    paths = sorted({p for pattern in args.patterns for p in glob.glob(pattern)})
+    n_items = n_unresolved = 0
+    for path in paths:
+        for document in load_path(path):
+            for project, pid in zip(document.projects, document.project_ids):
+                links = link_project(project)
+                n_items += len(links.items)
+                for link in links.unresolved_items():
+                    n_unresolved += 1
+                    refs = ", ".join(f"{role}={raw!r}" for role, raw in link.unresolved)
+                    target = f"{link.tree_section}.{link.tree_depth}" if link.tree_depth else "対応するツリー無し"
+                    print(f"{path} [{project.company}] {link.section_key}.{link.depth_key}[{link.qa_idx}] -> {target}: {refs}")
+    print(f"{len(paths)} ファイル, Q&A 項目 {n_items} 件中 {n_unresolved} 件に解決できない参照があります")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import re
+
+###############################################################################
+# Mermaid コードの正規化・解析ユーティリティ（Streamlit 非依存）
+###############################################################################
+
+def normalize_mermaid_code(mermaid_code: str) -> str:
+    """
+    Mermaidコード中の行頭インデントを自動調整して、パーサがエラーを起こしにくい形に整える。
+    """
+    lines = mermaid_code.splitlines()
+    # 空行を除いた最小インデントを求める
+    min_indent = None
+    for line in lines:
+        if line.strip() == "":
+            continue
+        leading_spaces = len(line) - len(line.lstrip())
+        if min_indent is None or leading_spaces < min_indent:
+            min_indent = leading_spaces
+
+    # 各行から min_indent 分だけ左に寄せる
+    if min_indent and min_indent > 0:
+        new_lines = []
+        for line in lines:
+            if line.strip() == "":
+                new_lines.append("")
+            else:
+                new_lines.append(line[min_indent:])
+        return "\n".join(new_lines)
+    else:
+        return mermaid_code
+
+def sanitize_mermaid_labels(mermaid_code: str) -> str:
+    """
+    ラベル中の半角括弧を全角に置き換える（Mermaid が `(` をノード形状と解釈するのを防ぐ）。
+    """
+    return mermaid_code.replace("(", "（").replace(")", "）")
+
+def parse_mermaid_node_labels(mermaid_code: str) -> dict:
+    """
+    Mermaidコードから node -> label の対応を抽出。
+    """
+    pattern = r"([A-Za-z0-9_]+)\[([^\]]+)\]"
+    node_label_map = {}
+    for match in re.finditer(pattern, mermaid_code):
+        node = match.group(1).strip()
+        label = match.group(2).strip()
+        node_label_map[node] = label
+    return node_label_map
+
+def parse_mermaid_edges(mermaid_code: str) -> dict:
+    """
+    Mermaidコードから `nodeA --> nodeB` の形を抽出して隣接リストを返す。
+    """
+    edge_pattern = r"([A-Za-z0-9_]+)\s*-+>\s*([A-Za-z0-9_]+)"
+    adjacency = {}
+    for match in re.finditer(edge_pattern, mermaid_code):
+        parent = match.group(1).strip()
+        child = match.group(2).strip()
+        adjacency.setdefault(parent, []).append(child)
+        if child not in adjacency:
+            adjacency[child] = []
+    return adjacency
+
+def find_roots(adjacency: dict) -> list:
+    """
+    隣接リストから、どのノードの子にもなっていないノード（ルート）を出現順で返す。
+    """
+    all_children = set()
+    for children in adjacency.values():
+        all_children.update(children)
+    return [node for node in adjacency.keys() if node not in all_children]
+
+###############################################################################
+# 構造チェック用の解析（日本語のノードIDも扱う）
+###############################################################################
+_NODE_DEF_PATTERN = re.compile(r"(\w+)\s*\[([^\]]*)\]")
+_LABEL_PATTERN = re.compile(r"\[[^\]]*\]")
+# 子は先読みで取り、`A --> B --> C` の B を次の辺の親としても使えるようにする
+_EDGE_PATTERN = re.compile(r"(\w+)\s*-+>\s*(?=(\w+))")
+
+def parse_mermaid_structure(mermaid_code: str) -> tuple:
+    """
+    Mermaidコードを (ノード定義のリスト [(id, label)], 辺のリスト [(parent, child)]) に分解する。
+    `利益 --> ...` のように英数字以外のIDも拾い、重複定義・重複辺もそのまま返す（検査用）。
+    """
+    definitions = []
+    edges = []
+    for line in mermaid_code.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith("%%") or stripped.lower().startswith(("graph", "flowchart")):
+            continue
+        # ラベルの中の "-->" を辺と取り違えないよう、ラベルを除いてから辺を探す
+        for edge in _EDGE_PATTERN.finditer(_LABEL_PATTERN.sub("", stripped)):
+            edges.append((edge.group(1), edge.group(2)))
+        for match in _NODE_DEF_PATTERN.finditer(stripped):
+            definitions.append((match.group(1), match.group(2).strip()))
+    return definitions, edges
@@ -0,0 +1,107 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+###############################################################################
+# ローカル用の LLM スタンドイン（OpenAI 互換 /v1/chat/completions）
+###############################################################################
+# オフラインで dx_generate を動かすためのサーバ。既存コーパス（json_data/ など）から
+# プロジェクトを選び、企業名を差し替えた DXProjects JSON を ```json ブロックで返す。
+# latency / failure_rate を指定すると、遅延や 429/500 エラーも再現できる。
+
+_COMPANY_NAMES = [f"{chr(ord('A') + i)}社" for i in range(26)]
+
+def load_sample_projects(patterns: list) -> list:
+    projects = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if isinstance(data, dict):
+                projects.extend(p for p in data.get("DXProjects", []) if isinstance(p, dict) and "table" in p)
+    return projects
+
+def _make_handler(projects: list, latency: float, failure_rate: float, n_projects: int):
+    class MockLLMHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, payload: dict):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            raw = self.rfile.read(length)
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send(404, {"error": {"message": "not found"}})
+                return
+            if latency:
+                time.sleep(latency)
+            if failure_rate and random.random() < failure_rate:
+                self._send(random.choice([429, 500, 503]), {"error": {"message": "mock failure"}})
+                return
+
+            # 同じリクエストには同じ応答を返す（キャッシュ・再試行の確認用）
+            rng = random.Random(hashlib.sha256(raw).digest())
+            chosen = []
+            for i in range(n_projects):
+                project = json.loads(json.dumps(rng.choice(projects), ensure_ascii=False))
+                project["table"]["企業名"] = rng.choice(_COMPANY_NAMES)
+                chosen.append(project)
+            content = "```json\n" + json.dumps({"DXProjects": chosen}, ensure_ascii=False, indent=2) + "\n```"
+            self._send(200, {
+                "id": "mock-" + hashlib.sha256(raw).hexdigest()[:12],
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            })
+
+    return MockLLMHandler
+
+def serve(host: str = "127.0.0.1", port: int = 0, corpus: list = None, latency: float = 0.0,
+          failure_rate: float = 0.0, n_projects: int = 5) -> ThreadingHTTPServer:
+    """
+    モックサーバをバックグラウンドスレッドで起動して返す。URL は f"http://{host}:{server.server_port}/v1"。
+    停止は server.shutdown()。
+    """
+    projects = load_sample_projects(corpus or [os.path.join(os.path.dirname(os.path.abspath(__file__)), "json_data", "*.json")])
+    if not projects:
+        raise ValueError("サンプルとなるプロジェクトが見つかりません")
+    server = ThreadingHTTPServer((host, port), _make_handler(projects, latency, failure_rate, n_projects))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="DXProjects 生成用のローカル LLM スタンドイン")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--corpus", nargs="*", default=["json_data/*.json"])
+    parser.add_argument("--latency", type=float, default=0.0, help="1リクエストあたりの遅延（秒）")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="429/5xx を返す確率")
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.corpus, args.latency, args.failure_rate)
+    print(f"mock LLM endpoint: http://{args.host}:{server.server_port}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+import re
+import sys
+from enum import IntEnum
+
+from dx_mermaid import parse_mermaid_edges, parse_mermaid_node_labels, find_roots
+
+###############################################################################
+# DXProjects のメモリ内モデル（__slots__ で軽量化、JSON と可逆変換）
+###############################################################################
+# - 企業名・ノードID・ラベル・キー名などの繰り返し出現する文字列は sys.intern で共有する
+# - questionType は QuestionType、深さは int で保持する
+# - 既知でないキーは extra に退避し、to_dict() で元のキー順どおりに復元する
+
+_intern = sys.intern
+_KEY_ORDERS = {}
+
+def _key_order(keys) -> tuple:
+    """
+    キー順のタプルを共有化する（同じ並びのオブジェクト同士で1つのタプルを使い回す）。
+    """
+    keys = tuple(_intern(k) for k in keys)
+    return _KEY_ORDERS.setdefault(keys, keys)
+
+def _intern_or_none(value):
+    return _intern(value) if isinstance(value, str) else value
+
+class QuestionType(IntEnum):
+    UNKNOWN = 0
+    HOW = 1
+    WHAT = 2
+    WHICH = 3
+    WHO = 4
+    WHERE = 5
+
+    @classmethod
+    def from_str(cls, value) -> "QuestionType":
+        if not isinstance(value, str):
+            return cls.UNKNOWN
+        return cls.__members__.get(value.strip().upper(), cls.UNKNOWN)
+
+_DEPTH_PATTERN = re.compile(r"(\d+)$")
+
+def parse_depth(depth_key: str) -> int:
+    """
+    "depth3" / "Depth3" のようなキーから深さの数値を取り出す。取れない場合は 0。
+    """
+    match = _DEPTH_PATTERN.search(depth_key or "")
+    return int(match.group(1)) if match else 0
+
+def split_section_key(section_key: str) -> tuple:
+    """
+    "roiTrees_assignment_cost_only" -> ("roiTrees", "assignment", "cost_only") のように分解する。
+    モード無しの旧形式 "roiTrees" は ("roiTrees", "", "")。
+    """
+    kind, _, rest = section_key.partition("_")
+    mode, _, suffix = rest.partition("_")
+    return kind, mode, suffix
+
+###############################################################################
+# Question / QAItem
+###############################################################################
+class Question:
+    __slots__ = ("qtype", "qtype_raw", "question", "answer", "_keys", "extra")
+
+    def __init__(self, question: str = "", answer: str = "", qtype_raw=None, keys=None, extra=None):
+        self.qtype_raw = _intern_or_none(qtype_raw)
+        self.qtype = QuestionType.from_str(qtype_raw)
+        self.question = question
+        self.answer = answer
+        self._keys = _key_order(keys if keys is not None else ("questionType", "question", "answer"))
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Question":
+        extra = {k: v for k, v in d.items() if k not in ("questionType", "question", "answer")}
+        return cls(
+            question=d.get("question"),
+            answer=d.get("answer"),
+            qtype_raw=d.get("questionType"),
+            keys=d.keys(),
+            extra=extra or None,
+        )
+
+    def to_dict(self) -> dict:
+        fields = {"questionType": self.qtype_raw, "question": self.question, "answer": self.answer}
+        return {k: fields[k] if k in fields else self.extra[k] for k in self._keys}
+
+class QAItem:
+    __slots__ = ("parent", "child", "questions", "_keys", "extra")
+
+    def __init__(self, parent=None, child=None, questions=(), keys=None, extra=None):
+        self.parent = _intern_or_none(parent)
+        self.child = _intern_or_none(child)
+        self.questions = tuple(questions)
+        self._keys = _key_order(keys if keys is not None else ("parentNode", "childNode", "questions"))
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "QAItem":
+        extra = {k: v for k, v in d.items() if k not in ("parentNode", "childNode", "questions")}
+        return cls(
+            parent=d.get("parentNode"),
+            child=d.get("childNode"),
+            questions=[Question.from_dict(q) for q in d.get("questions", [])],
+            keys=d.keys(),
+            extra=extra or None,
+        )
+
+    def to_dict(self) -> dict:
+        fields = {
+            "parentNode": self.parent,
+            "childNode": self.child,
+            "questions": [q.to_dict() for q in self.questions],
+        }
+        return {k: fields[k] if k in fields else self.extra[k] for k in self._keys}
+
+###############################################################################
+# TreeNode / RoiTree
+###############################################################################
+class TreeNode:
+    __slots__ = ("id", "label", "depth", "children")
+
+    def __init__(self, node_id: str, label: str, depth: int, children: tuple):
+        self.id = _intern(node_id)
+        self.label = _intern(label)
+        self.depth = depth
+        self.children = children
+
+    def __repr__(self) -> str:
+        return f"TreeNode({self.id!r}, {self.label!r}, depth={self.depth}, children={self.children!r})"
+
+class RoiTree:
+    """
+    1つの深さバリエーション（depth3 など）の ROI ツリー。
+    旧形式（値が Mermaid 文字列そのもの）は legacy=True で保持し、同じ形で書き戻す。
+    """
+    __slots__ = ("depth_key", "depth", "graph", "importance_factors", "legacy", "_keys", "extra", "_nodes")
+
+    def __init__(self, depth_key: str, graph: str, importance_factors=None, legacy: bool = False, keys=None, extra=None):
+        self.depth_key = _intern(depth_key)
+        self.depth = parse_depth(depth_key)
+        self.graph = graph
+        self.importance_factors = importance_factors
+        self.legacy = legacy
+        self._keys = _key_order(keys if keys is not None else ("graph", "importance_factors"))
+        self.extra = extra
+        self._nodes = None
+
+    @classmethod
+    def from_value(cls, depth_key: str, value) -> "RoiTree":
+        if isinstance(value, str):
+            return cls(depth_key, value, legacy=True, keys=())
+        extra = {k: v for k, v in value.items() if k not in ("graph", "importance_factors")}
+        factors = value.get("importance_factors")
+        if isinstance(factors, list) and all(
+            isinstance(f, dict) and tuple(f.keys()) == ("node", "importance_factor") for f in factors
+        ):
+            factors = tuple((_intern(f["node"]), f["importance_factor"]) for f in factors)
+        return cls(
+            depth_key,
+            value.get("graph"),
+            importance_factors=factors,
+            keys=value.keys(),
+            extra=extra or None,
+        )
+
+    def to_value(self):
+        if self.legacy:
+            return self.graph
+        factors = self.importance_factors
+        if isinstance(factors, tuple):
+            factors = [{"node": node, "importance_factor": value} for node, value in factors]
+        fields = {"graph": self.graph, "importance_factors": factors}
+        return {k: fields[k] if k in fields else self.extra[k] for k in self._keys}
+
+    @property
+    def nodes(self) -> dict:
+        """
+        node_id -> TreeNode（初回アクセス時に Mermaid コードを解析してキャッシュする）。
+        """
+        if self._nodes is None:
+            code = self.graph or ""
+            labels = parse_mermaid_node_labels(code)
+            adjacency = parse_mermaid_edges(code)
+            nodes = {}
+            stack = [(root, 1) for root in reversed(find_roots(adjacency))]
+            while stack:
+                node_id, depth = stack.pop()
+                if node_id in nodes:
+                    continue
+                children = tuple(_intern(c) for c in adjacency.get(node_id, []))
+                nodes[node_id] = TreeNode(node_id, labels.get(node_id, node_id), depth, children)
+                stack.extend((c, depth + 1) for c in reversed(children))
+            self._nodes = nodes
+        return self._nodes
+
+    @property
+    def roots(self) -> list:
+        return [node for node in self.nodes.values() if node.depth == 1]
+
+    def edges(self) -> dict:
+        """
+        (親ID, 子ID) -> (親ラベル, 子ラベル)。
+        """
+        nodes = self.nodes
+        return {
+            (node.id, child): (node.label, nodes[child].label)
+            for node in nodes.values() for child in node.children
+        }
+
+def shared_edges(tree: RoiTree, other: RoiTree) -> set:
+    """
+    2つの深さバリエーションに共通する辺（ノードIDとラベルがどちらも一致するもの）。
+    depth4 / depth5 は depth3 を延長して書かれるため、共通部分の評価はそのまま引き継げる。
+    """
+    other_edges = other.edges()
+    return {edge for edge, labels in tree.edges().items() if other_edges.get(edge) == labels}
+
+def inherited_edges(trees: dict, depth_key: str) -> dict:
+    """
+    trees（depth_key -> RoiTree）のうち depth_key より浅いバリエーションと共通する辺について、
+    (親ID, 子ID) -> 引き継ぎ元の depth_key を返す（いちばん近い浅いバリエーションを優先）。
+    """
+    tree = trees[depth_key]
+    shallower = sorted(
+        (t for t in trees.values() if 0 < t.depth < tree.depth),
+        key=lambda t: t.depth,
+        reverse=True
+    )
+    inherited = {}
+    for source in shallower:
+        for edge in shared_edges(tree, source):
+            inherited.setdefault(edge, source.depth_key)
+    return inherited
+
+###############################################################################
+# Project
+###############################################################################
+_TABLE_FIELDS = {
+    "企業名": "company",
+    "課題・目的": "purpose",
+    "提案": "proposal",
+    "目的を達成するための重要な定量要素（目的の分解）": "factors",
+    "目的を達成するための定量要素（目的の分解）": "factors",
+    "ROI算定": "roi_lines",
+}
+
+class Project:
+    __slots__ = (
+        "company", "purpose", "proposal", "factors", "roi_lines",
+        "_table_keys", "table_extra",
+        "roi_trees", "qa", "_keys", "extra",
+    )
+
+    def __init__(self):
+        self.company = None
+        self.purpose = None
+        self.proposal = None
+        self.factors = None
+        self.roi_lines = None
+        self._table_keys = ()
+        self.table_extra = None
+        self.roi_trees = {}
+        self.qa = {}
+        self._keys = ()
+        self.extra = None
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Project":
+        project = cls()
+        extra = {}
+
+        table = d.get("table")
+        if isinstance(table, dict):
+            table_extra = {}
+            for key, value in table.items():
+                attr = _TABLE_FIELDS.get(key)
+                if attr is None or getattr(project, attr) is not None:
+                    table_extra[key] = value
+                elif attr in ("factors", "roi_lines") and isinstance(value, list):
+                    setattr(project, attr, tuple(value))
+                else:
+                    setattr(project, attr, _intern_or_none(value) if attr == "company" else value)
+            project._table_keys = _key_order(table.keys())
+            project.table_extra = table_extra or None
+
+        for key, value in d.items():
+            if key == "table" and isinstance(value, dict):
+                continue
+            if key.startswith("roiTrees") and isinstance(value, dict):
+                project.roi_trees[_intern(key)] = {
+                    _intern(depth_key): RoiTree.from_value(depth_key, tree)
+                    for depth_key, tree in value.items()
+                }
+            elif key.startswith("QAndA") and isinstance(value, dict):
+                project.qa[_intern(key)] = {
+                    _intern(depth_key): tuple(QAItem.from_dict(item) for item in items)
+                    for depth_key, items in value.items()
+                }
+            else:
+                extra[key] = value
+        project._keys = _key_order(d.keys())
+        project.extra = extra or None
+        return project
+
+    def table_dict(self) -> dict:
+        table = {}
+        for key in self._table_keys:
+            attr = _TABLE_FIELDS.get(key)
+            if self.table_extra and key in self.table_extra:
+                table[key] = self.table_extra[key]
+            else:
+                value = getattr(self, attr)
+                table[key] = list(value) if isinstance(value, tuple) else value
+        return table
+
+    def to_dict(self) -> dict:
+        result = {}
+        for key in self._keys:
+            if key in self.roi_trees:
+                result[key] = {dk: tree.to_value() for dk, tree in self.roi_trees[key].items()}
+            elif key in self.qa:
+                result[key] = {dk: [item.to_dict() for item in items] for dk, items in self.qa[key].items()}
+            elif self.extra and key in self.extra:
+                result[key] = self.extra[key]
+            else:
+                result[key] = self.table_dict()
+        return result
+
+    def sections(self, kind: str, mode: str) -> list:
+        """
+        kind ("roiTrees" / "QAndA") と mode ("assignment" / "suggest") に一致するセクションキーを返す。
+        """
+        source = self.roi_trees if kind == "roiTrees" else self.qa
+        return [key for key in source if split_section_key(key)[:2] == (kind, mode)]
+
+def projects_from_json(data: dict) -> list:
+    """
+    {"DXProjects": [...]} 形式の dict から Project のリストを作る。
+    """
+    return [Project.from_dict(p) for p in data.get("DXProjects", [])]
+
+def projects_to_json(projects: list) -> dict:
+    """
+    Project のリストを元の {"DXProjects": [...]} 形式に戻す。
+    """
+    return {"DXProjects": [p.to_dict() for p in projects]}
@@ -0,0 +1,262 @@
+import argparse
+import glob
+import time
+from typing import NamedTuple
+
+import numpy as np
+
+from dx_comments import SparseRows, gather_rows, hashed_ngrams, ngram_feature, normalize_comment, unique_counts
+from dx_corpus import load_path
+from dx_export import decode_export
+from dx_keys import AnnotationKeyIndex, distinct_project_ids
+from dx_model import split_section_key
+from dx_resume import load_exports, projects_by_id
+
+###############################################################################
+# Q&A の品質の事前ラベル（軽量なロジスティック回帰による推定と、不確かな順の作業キュー）
+###############################################################################
+# 評価済みの Q&A（良い / 悪い）から「良い」の確率を推定し、
+#   - 確信度の高い未評価の項目には推定ラベルを初期値として入れる（アノテータが確認・修正する）
+#   - 評価の作業キューを確率が 0.5 に近い順（モデルが迷っている順）に並べる
+# に使う。CPU だけで、数万件の学習・推定が数秒で終わる大きさにしてある。
+#
+# 特徴量（すべて特徴ハッシュで 2^bits 次元に落とし、行ごとに L2 正規化）
+#   - question / answer / parentNode / childNode の文字 n-gram（フィールドごとに別のハッシュ空間）
+#   - questionType・深さ・モードのカテゴリ
+# 学習は Adagrad のミニバッチ勾配法（L2 正則化、良い/悪いの件数の偏りはクラス重みで補正）。
+
+GOOD, BAD = "良い", "悪い"
+N_FEATURES_BITS = 18
+MIN_EXAMPLES_PER_CLASS = 5
+
+_TEXT_FIELDS = ("question", "answer", "parent", "child")
+# フィールドごとにハッシュをずらすための値（同じ n-gram でも question と answer で別の特徴になる）
+_FIELD_SALTS = {field: ngram_feature(f"#{field}", 32) for field in _TEXT_FIELDS}
+
+class QAExample(NamedTuple):
+    key: str            # ウィジェットキーの接頭辞 "file{i}_proj{j}_{mode}_QAndA_{depth_key}_{qa_idx}_{q_idx}"
+    mode: str
+    depth_key: str
+    qtype: str
+    question: str
+    answer: str
+    parent: str
+    child: str
+
+class Prediction(NamedTuple):
+    label: str
+    probability: float      # 「良い」の確率
+    confidence: float       # 推定ラベルの確率（max(p, 1 - p)）
+
+class TrainingReport(NamedTuple):
+    n_train: int
+    n_good: int
+    n_bad: int
+    holdout_accuracy: float     # 学習に使わなかった 2 割での正解率（件数が少ない場合は None）
+    seconds: float
+
+def qa_examples(documents: list) -> list:
+    """
+    アップロード中の全プロジェクトの Q&A を QAExample のリストにする（並びは qa_rating_items と同じ）。
+    """
+    examples = []
+    for file_idx, document in enumerate(documents):
+        for proj_idx, project in enumerate(document.projects):
+            for section_key, depths in project.qa.items():
+                mode = split_section_key(section_key)[1]
+                for depth_key, qa_items in depths.items():
+                    for qa_idx, qa_item in enumerate(qa_items):
+                        for q_idx, question in enumerate(qa_item.questions):
+                            examples.append(QAExample(
+                                f"file{file_idx}_proj{proj_idx}_{mode}_QAndA_{depth_key}_{qa_idx}_{q_idx}",
+                                mode, depth_key,
+                                question.qtype.name if question.qtype else (question.qtype_raw or "UNKNOWN"),
+                                question.question or "", question.answer or "",
+                                qa_item.parent or "", qa_item.child or "",
+                            ))
+    return examples
+
+def featurize(examples: list, bits: int = N_FEATURES_BITS) -> SparseRows:
+    n_features = 1 << bits
+    n = len(examples)
+    rows, features = [], []
+    for field in _TEXT_FIELDS:
+        field_rows, field_features = hashed_ngrams([normalize_comment(getattr(e, field)) for e in examples], bits)
+        rows.append(field_rows)
+        features.append((field_features ^ _FIELD_SALTS[field]) & (n_features - 1))
+    categorical = {}
+    tokens = [
+        token for e in examples
+        for token in (f"qtype={e.qtype}", f"depth={e.depth_key.lower()}", f"mode={e.mode}", f"qtype={e.qtype}&mode={e.mode}")
+    ]
+    for token in set(tokens):
+        categorical[token] = ngram_feature(token, bits)
+    rows.append(np.repeat(np.arange(n, dtype=np.int64), 4))
+    features.append(np.fromiter((categorical[token] for token in tokens), dtype=np.int64, count=len(tokens)))
+    rows, features = np.concatenate(rows), np.concatenate(features)
+    # 出現の有無（二値）を特徴にする
+    pairs, _ = unique_counts(rows * n_features + features)
+    rows, features = pairs // n_features, pairs % n_features
+    counts = np.bincount(rows, minlength=n).astype(np.float64)
+    data = (1.0 / np.sqrt(np.where(counts > 0, counts, 1.0)))[rows].astype(np.float32)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    return SparseRows(indptr, features, data, n_features)
+
+def _scores(matrix: SparseRows, rows: np.ndarray, weights: np.ndarray, bias: float) -> np.ndarray:
+    lengths, indices, data = gather_rows(matrix, rows)
+    cumulative = np.zeros(len(indices) + 1, dtype=np.float64)
+    np.cumsum(weights[indices] * data, out=cumulative[1:])
+    ends = np.cumsum(lengths)
+    return cumulative[ends] - cumulative[ends - lengths] + bias
+
+class PrelabelModel:
+    """
+    「良い」を 1、「悪い」を 0 とする二値のロジスティック回帰。
+    """
+
+    def __init__(self, bits: int = N_FEATURES_BITS, l2: float = 1e-4, learning_rate: float = 0.5,
+                 epochs: int = 8, batch_size: int = 256, seed: int = 0):
+        self.bits = bits
+        self.l2 = l2
+        self.learning_rate = learning_rate
+        self.epochs = epochs
+        self.batch_size = batch_size
+        self.seed = seed
+        self.weights = np.zeros(1 << bits, dtype=np.float64)
+        self.bias = 0.0
+
+    def fit(self, matrix: SparseRows, rows: np.ndarray, labels: np.ndarray) -> "PrelabelModel":
+        """
+        matrix の rows 行を labels（1 / 0）で学習する。
+        """
+        rng = np.random.default_rng(self.seed)
+        n_good = labels.sum()
+        n_bad = len(labels) - n_good
+        # 少ない側のクラスの誤りを重く数える（ほとんどが「良い」でも「悪い」を見落とさないように）
+        class_weight = np.where(labels == 1, len(labels) / (2.0 * max(n_good, 1)), len(labels) / (2.0 * max(n_bad, 1)))
+        self.weights[:] = 0.0
+        positive_rate = (n_good + 1.0) / (len(labels) + 2.0)
+        self.bias = float(np.log(positive_rate / (1.0 - positive_rate)))
+        squared = np.zeros_like(self.weights)
+        bias_squared = 0.0
+        for _ in range(self.epochs):
+            order = rng.permutation(len(rows))
+            for begin in range(0, len(order), self.batch_size):
+                batch = order[begin:begin + self.batch_size]
+                batch_rows = rows[batch]
+                residual = (1.0 / (1.0 + np.exp(-_scores(matrix, batch_rows, self.weights, self.bias))) - labels[batch]) * class_weight[batch]
+                lengths, indices, data = gather_rows(matrix, batch_rows)
+                gradient = np.bincount(indices, weights=np.repeat(residual, lengths) * data, minlength=len(self.weights)) / len(batch)
+                touched = np.unique(indices)
+                gradient[touched] += self.l2 * self.weights[touched]
+                squared[touched] += gradient[touched] ** 2
+                self.weights[touched] -= self.learning_rate * gradient[touched] / (np.sqrt(squared[touched]) + 1e-8)
+                bias_gradient = residual.mean()
+                bias_squared += bias_gradient ** 2
+                self.bias -= self.learning_rate * bias_gradient / (np.sqrt(bias_squared) + 1e-8)
+        return self
+
+    def predict_proba(self, matrix: SparseRows, rows: np.ndarray = None) -> np.ndarray:
+        rows = np.arange(matrix.n_rows) if rows is None else rows
+        return 1.0 / (1.0 + np.exp(-_scores(matrix, rows, self.weights, self.bias)))
+
+def labeled_rows(examples: list, annotations: dict) -> tuple:
+    """
+    評価済み（良い / 悪い）の行番号とラベル（1 / 0）を返す。
+    """
+    rows, labels = [], []
+    for i, example in enumerate(examples):
+        value = annotations.get(f"{example.key}_good_or_bad")
+        if value in (GOOD, BAD):
+            rows.append(i)
+            labels.append(1 if value == GOOD else 0)
+    return np.array(rows, dtype=np.int64), np.array(labels, dtype=np.float64)
+
+def train(matrix: SparseRows, examples: list, annotations: dict, seed: int = 0) -> tuple:
+    """
+    評価済みの項目で学習し、(モデル, TrainingReport) を返す。どちらかのクラスが少なすぎる場合のモデルは None。
+    件数が十分あれば 2 割を取り分けて正解率を測ってから、全件で学習し直す。
+    """
+    started = time.monotonic()
+    rows, labels = labeled_rows(examples, annotations)
+    n_good = int(labels.sum())
+    n_bad = len(labels) - n_good
+    if min(n_good, n_bad) < MIN_EXAMPLES_PER_CLASS:
+        return None, TrainingReport(len(rows), n_good, n_bad, None, time.monotonic() - started)
+    accuracy = None
+    if min(n_good, n_bad) >= 2 * MIN_EXAMPLES_PER_CLASS:
+        rng = np.random.default_rng(seed)
+        holdout = rng.random(len(rows)) < 0.2
+        model = PrelabelModel(seed=seed).fit(matrix, rows[~holdout], labels[~holdout])
+        if holdout.any():
+            predicted = model.predict_proba(matrix, rows[holdout]) >= 0.5
+            accuracy = float((predicted == (labels[holdout] == 1)).mean())
+    model = PrelabelModel(seed=seed).fit(matrix, rows, labels)
+    return model, TrainingReport(len(rows), n_good, n_bad, accuracy, time.monotonic() - started)
+
+def predictions(model: PrelabelModel, matrix: SparseRows, examples: list) -> dict:
+    """
+    ウィジェットキーの接頭辞 -> Prediction。
+    """
+    probabilities = model.predict_proba(matrix)
+    return {
+        example.key: Prediction(GOOD if p >= 0.5 else BAD, float(p), float(max(p, 1.0 - p)))
+        for example, p in zip(examples, probabilities)
+    }
+
+def uncertainty_order(keys: list, predicted: dict) -> list:
+    """
+    keys をモデルが迷っている順（確信度の低い順）に並べる。推定の無いものは最後。
+    """
+    return sorted(keys, key=lambda key: predicted[key].confidence if key in predicted else 2.0)
+
+###############################################################################
+# CLI
+###############################################################################
+def load_annotations(path: str, documents: list) -> dict:
+    """
+    保存済みのアノテーション（dx-annotations/2 のエクスポート・ウィジェットキー形式・旧形式）を読み込み、
+    documents をこの順でアップロードしたときのウィジェットキーの dict にする。
+    """
+    documents = [document._replace(project_ids=project_ids) for document, project_ids in zip(documents, distinct_project_ids(documents))]
+    index = AnnotationKeyIndex()
+    for file_idx, document in enumerate(documents):
+        for proj_idx, pid in enumerate(document.project_ids):
+            index.register(file_idx, proj_idx, pid, file_name=document.name)
+    with open(path, "rb") as f:
+        data = decode_export(f.read())
+    report = load_exports([(path, data)], index, projects_by_id(documents))
+    if report.unmapped:
+        print(f"{path}: {len(report.unmapped)} 件のキーは元データに対応が無いため使いません")
+    return report.applied
+
+def main():
+    parser = argparse.ArgumentParser(description="評価済みの Q&A から良い/悪いを推定し、迷っている順に未評価の項目を並べる")
+    parser.add_argument("corpus", nargs="+", help="元データ（JSON / .dxc。アップロード時と同じ順に指定する）")
+    parser.add_argument("--annotations", required=True, help="アノテーション（annotations_all.json などのエクスポート、またはウィジェットキー形式）")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    documents = [document for pattern in args.corpus for path in sorted(glob.glob(pattern)) for document in load_path(path)]
+    annotations = load_annotations(args.annotations, documents)
+
+    started = time.monotonic()
+    examples = qa_examples(documents)
+    matrix = featurize(examples)
+    featurized = time.monotonic()
+    model, report = train(matrix, examples, annotations)
+    print(f"{len(examples)} 件の Q&A（特徴量 {featurized - started:.2f} 秒）, 学習 {report.n_train} 件"
+          f"（良い {report.n_good} / 悪い {report.n_bad}）, {report.seconds:.2f} 秒"
+          + (f", 取り分けた 2 割での正解率 {report.holdout_accuracy:.1%}" if report.holdout_accuracy is not None else ""))
+    if model is None:
+        print(f"学習には 良い / 悪い がそれぞれ {MIN_EXAMPLES_PER_CLASS} 件以上必要です")
+        return
+    predicted = predictions(model, matrix, examples)
+    unrated = [e.key for e in examples if annotations.get(f"{e.key}_good_or_bad") not in (GOOD, BAD)]
+    for key in uncertainty_order(unrated, predicted)[:args.top]:
+        p = predicted[key]
+        print(f"{p.label} {p.probability:.2f}  {key}")
+
+if __name__ == "__main__":
+    main()
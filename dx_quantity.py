@@ -0,0 +1,348 @@
+import argparse
+import glob
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+from dx_mermaid import parse_mermaid_structure
+from dx_schema import SchemaIssue, load_document
+
+###############################################################################
+# 日本語の数量表現の抽出
+###############################################################################
+# 「約150時間/月」「月45万円」「年間約1,860万円」「時給3,000円」「2.99%」「1社あたり年+50万円」
+# のような表現を Quantity に変換する。
+#   value  : 基本単位に換算した値（円・時間・件・% など。万/億/千 は掛け算済み）
+#   period : 期間（"月" / "年" / "週" / "日" / None）
+#   per    : 「1社あたり」「/人」「時給」などの分母（None なら総量）
+
+_MULTIPLIERS = {"千": 1e3, "万": 1e4, "億": 1e8}
+_UNIT_ALIASES = {"％": "%", "名": "人", "か月": "ヶ月", "カ月": "ヶ月", "ヵ月": "ヶ月", "h": "時間", "営業日": "日"}
+_QUANTITY_PATTERN = re.compile(
+    r"(?P<num>\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)\s*"
+    r"(?P<mult>千|万|億)?"
+    r"(?P<unit>円|時間|件|%|％|社|人|名|営業日|日|ヶ月|か月|カ月|ヵ月|年|回|台|分|倍|h)?"
+    r"(?P<suffix>\s*[/／]\s*(?P<denom>月|年|週|日|人|件|社|時間|台|回))?"
+)
+_PERIOD_PREFIX = re.compile(r"(毎月|月間|月平均|月|毎年|年間|年平均|年|週|1日|日)(?:あたり|当たり)?[\s約＋+\-−・:：]*$")
+_PER_PREFIX = re.compile(r"(?:\d+|一)?([^\d\s(（]{1,3}?)(?:あたり|当たり)[\s約＋+\-−]*(?:月|年|年間|月間)?[\s約＋+\-−]*$")
+_RATE_PREFIX = re.compile(r"(時給|日給|月給|単価)[\s約]*$")
+_APPROX_PREFIX = re.compile(r"(約|およそ|≈|≒|〜|~)\s*$")
+_PERIOD_WORDS = {"毎月": "月", "月間": "月", "月平均": "月", "月": "月", "毎年": "年", "年間": "年", "年平均": "年", "年": "年", "週": "週", "1日": "日", "日": "日"}
+_ANNUAL_FACTOR = {"月": 12, "年": 1, "週": 52}
+_RATE_UNITS = {"時給": "時間", "日給": "日", "月給": "月", "単価": "件"}
+
+class Quantity(NamedTuple):
+    value: float
+    unit: str
+    period: str
+    per: str
+    approx: bool
+    raw: str
+    start: int
+    end: int
+
+    def annual(self):
+        """
+        年あたりの値（期間が 月/年/週 の場合のみ。それ以外は None）。
+        """
+        factor = _ANNUAL_FACTOR.get(self.period)
+        return None if factor is None else self.value * factor
+
+    def comparable(self, other: "Quantity") -> bool:
+        return self.unit == other.unit and self.per == other.per and (self.period is None) == (other.period is None)
+
+    def normalized(self) -> float:
+        """
+        比較用の値（期間付きなら年換算、期間なしならそのまま）。
+        """
+        annual = self.annual()
+        return self.value if annual is None else annual
+
+def extract_quantities(text: str) -> list:
+    """
+    文字列中の数量表現を Quantity のリストにする（単位の無い裸の数値も unit="" で返す）。
+    """
+    quantities = []
+    for match in _QUANTITY_PATTERN.finditer(text or ""):
+        number = float(match.group("num").replace(",", ""))
+        value = number * _MULTIPLIERS.get(match.group("mult") or "", 1)
+        unit = _UNIT_ALIASES.get(match.group("unit") or "", match.group("unit") or "")
+        if unit == "" and match.group("mult"):
+            unit = "円" if text[match.end():match.end() + 1] == "円" else ""
+        before = text[max(0, match.start() - 8):match.start()]
+
+        period = None
+        per = None
+        denom = match.group("denom")
+        if denom in ("月", "年", "週", "日"):
+            period = denom
+        elif denom:
+            per = denom
+        rate = _RATE_PREFIX.search(before)
+        if rate:
+            per = _RATE_UNITS[rate.group(1)]
+        elif per is None:
+            per_match = _PER_PREFIX.search(before)
+            if per_match and per_match.group(1) not in _PERIOD_WORDS:
+                per = per_match.group(1)
+        if period is None:
+            period_match = _PERIOD_PREFIX.search(before)
+            if period_match:
+                period = _PERIOD_WORDS[period_match.group(1)]
+        if unit == "日" and period == "日":
+            period = None
+
+        approx = bool(_APPROX_PREFIX.search(before))
+        quantities.append(Quantity(value, unit, period, per, approx, match.group(0), match.start(), match.end()))
+    return quantities
+
+def money(quantities: list) -> list:
+    return [q for q in quantities if q.unit == "円" and q.per is None]
+
+###############################################################################
+# 整合性チェック
+###############################################################################
+_TOLERANCE = 0.1
+_NON_ADDITIVE = {"%", "倍"}
+_ARITHMETIC_SPLIT = re.compile(r"[=＝≈≒]")
+_CONVERSION_LINK = re.compile(r"→|->|⇒|換算|相当|=|＝|≈|≒")
+
+def _close(actual: float, expected: float, tolerance: float) -> bool:
+    if expected == 0:
+        return abs(actual) < 1e-9
+    return abs(actual - expected) <= abs(expected) * tolerance
+
+def _fmt(value: float) -> str:
+    if abs(value) >= 1e4 and value % 1e4 == 0:
+        return f"{value / 1e4:,.0f}万"
+    if abs(value) >= 1e4:
+        return f"{value / 1e4:,.1f}万"
+    return f"{value:,.2f}".rstrip("0").rstrip(".")
+
+def check_arithmetic(text: str, path: str, tolerance: float = _TOLERANCE) -> list:
+    """
+    「10,000件 × 2.99% ≈ 299件」「49件 × 10万円 = 490万円」のような掛け算・引き算の式を検算する。
+    """
+    issues = []
+    parts = _ARITHMETIC_SPLIT.split(text)
+    for left, right in zip(parts, parts[1:]):
+        operands = re.split(r"[×xX＊*]", left)
+        if len(operands) < 2 and "-" not in left and "－" not in left:
+            continue
+        rhs = extract_quantities(right)
+        if not rhs:
+            continue
+        if len(operands) >= 2:
+            # 先頭の項は直前の数量、それ以降の項は数量を1つだけ含むものに限る（「5名分 = 800時間」のような文を式と誤認しない）
+            expected = None
+            for pos, operand in enumerate(operands):
+                for step, piece in enumerate(re.split(r"[÷]", operand)):
+                    qs = extract_quantities(piece)
+                    if not qs or (pos > 0 or step > 0) and len(qs) != 1:
+                        expected = None
+                        break
+                    q = qs[-1]
+                    value = q.value / 100 if q.unit == "%" else q.value
+                    if expected is None:
+                        expected = value
+                    elif step > 0:
+                        expected = expected / value if value else None
+                    else:
+                        expected *= value
+                    if expected is None:
+                        break
+                if expected is None:
+                    break
+            if expected is None:
+                continue
+        else:
+            qs = extract_quantities(re.split(r"[(（]", left)[-1])
+            if len(qs) != 2:
+                continue
+            expected = qs[0].value - qs[1].value
+        actual = rhs[0].value
+        if not _close(actual, expected, tolerance):
+            issues.append(SchemaIssue("warning", path, f"計算が合いません: 「{left.strip()}」= {_fmt(expected)} ですが、記載は {rhs[0].raw}"))
+    return issues
+
+def check_period_conversions(text: str, path: str, tolerance: float = _TOLERANCE) -> list:
+    """
+    「月1,551,000円削減 → 年間約1,860万円」のような月額・年額の換算を検算する。
+    """
+    issues = []
+    quantities = [q for q in extract_quantities(text) if q.unit and q.period in _ANNUAL_FACTOR]
+    for a, b in zip(quantities, quantities[1:]):
+        if a.unit != b.unit or a.per != b.per or a.period == b.period:
+            continue
+        if not _CONVERSION_LINK.search(text[a.end:b.start]):
+            continue
+        if not _close(b.annual(), a.annual(), tolerance):
+            issues.append(SchemaIssue(
+                "warning", path,
+                f"期間換算が合いません: {a.raw}（年換算 {_fmt(a.annual())}{a.unit}）→ {b.raw}（年換算 {_fmt(b.annual())}{b.unit}）",
+            ))
+    return issues
+
+def check_rate_products(text: str, path: str, tolerance: float = _TOLERANCE) -> list:
+    """
+    「300時間 → 150時間に削減（時給3,000円換算で月45万円削減）」のような 時間 × 時給 = 金額 を検算する。
+    """
+    quantities = extract_quantities(text)
+    rates = [q for q in quantities if q.unit == "円" and q.per == "時間"]
+    amounts = [q for q in money(quantities) if q.period]
+    hours = [q for q in quantities if q.unit == "時間" and q.per is None]
+    if not rates or not amounts or not hours:
+        return []
+    candidates = [h.value for h in hours]
+    for a, b in zip(hours, hours[1:]):
+        if re.search(r"→|->|⇒", text[a.end:b.start]):
+            candidates.append(abs(a.value - b.value))
+    issues = []
+    for amount in amounts:
+        if not any(_close(amount.value, h * r.value, tolerance) for h in candidates for r in rates):
+            issues.append(SchemaIssue(
+                "warning", path,
+                f"時間×時給が金額と合いません: {amount.raw}（時間候補 {', '.join(_fmt(h) for h in candidates)} × 時給 {', '.join(r.raw for r in rates)}）",
+            ))
+    return issues
+
+def check_text(text: str, path: str, tolerance: float = _TOLERANCE) -> list:
+    return (
+        check_arithmetic(text, path, tolerance)
+        + check_period_conversions(text, path, tolerance)
+        + check_rate_products(text, path, tolerance)
+    )
+
+def _tree_quantities(graph: str) -> tuple:
+    definitions, edges = parse_mermaid_structure(graph or "")
+    labels = dict(definitions)
+    children = {}
+    for parent, child in dict.fromkeys(edges):
+        children.setdefault(parent, []).append(child)
+    # 割合・倍率は親子で別の指標を指すことが多く、足し算で比べられないので除く
+    quantities = {node: [q for q in extract_quantities(label) if q.unit and q.unit not in _NON_ADDITIVE] for node, label in labels.items()}
+    return labels, children, quantities
+
+def check_tree_sums(graph: str, path: str, tolerance: float = 0.15) -> list:
+    """
+    親ノードと子ノードのラベル中の数量を比べる（同じ単位・期間のものだけ年換算して比較）。
+    子の合計が親を超える場合、または子が2つ以上あるのに合計が親に届かない場合に指摘する。
+    """
+    labels, children, quantities = _tree_quantities(graph)
+    issues = []
+    for parent, kids in children.items():
+        for pq in quantities.get(parent, []):
+            matched = []
+            for kid in kids:
+                comparable = [q for q in quantities.get(kid, []) if q.comparable(pq)]
+                if not comparable:
+                    break
+                matched.append(comparable[0])
+            else:
+                if not matched:
+                    continue
+                total = sum(q.normalized() for q in matched)
+                expected = pq.normalized()
+                over = total > expected * (1 + tolerance)
+                under = len(matched) >= 2 and total < expected * (1 - tolerance)
+                if over or under:
+                    detail = " + ".join(f"{labels.get(k, k)}" for k in kids)
+                    issues.append(SchemaIssue(
+                        "warning", f"{path}.{parent}",
+                        f"子ノードの合計（{_fmt(total)}{pq.unit}{'/年' if pq.period else ''}）が親ノード "
+                        f"{labels.get(parent, parent)}（{_fmt(expected)}{pq.unit}{'/年' if pq.period else ''}）と合いません: {detail}",
+                    ))
+    return issues
+
+def _roi_totals(roi_lines) -> dict:
+    """
+    ROI算定の各行から、コスト削減・売上増加それぞれの年換算金額（行の最後の期間付き金額）を取り出す。
+    """
+    totals = {}
+    for line in roi_lines or []:
+        if not isinstance(line, str):
+            continue
+        amounts = [q for q in money(extract_quantities(line)) if q.period in _ANNUAL_FACTOR]
+        if not amounts:
+            continue
+        if not _CONVERSION_LINK.search(line):
+            # 「月100万円の売上増加、さらに…月+50万円」のように複数の効果を並べた行は合計する
+            total = sum(q.annual() for q in amounts)
+            amounts = [amounts[-1]._replace(value=total, period="年", raw=" + ".join(q.raw for q in amounts))]
+        head = line[:12]
+        if "コスト" in head or "人件費" in head:
+            totals.setdefault("CostReduction", (amounts[-1], line))
+        elif "売上" in head or "利益" in head or "受注" in head:
+            totals.setdefault("RevenueIncrease", (amounts[-1], line))
+    return totals
+
+def check_tree_against_roi(graph: str, roi_lines, path: str, tolerance: float = 0.2) -> list:
+    """
+    ツリーの CostReduction / RevenueIncrease 直下の金額合計と、ROI算定の金額を比べる。
+    """
+    labels, children, quantities = _tree_quantities(graph)
+    issues = []
+    for node_id, (roi_amount, line) in _roi_totals(roi_lines).items():
+        kid_amounts = []
+        for kid in children.get(node_id, []):
+            amounts = [q for q in money(quantities.get(kid, [])) if q.period in _ANNUAL_FACTOR]
+            if amounts:
+                kid_amounts.append(amounts[0].annual())
+        if not kid_amounts:
+            continue
+        total = sum(kid_amounts)
+        if not _close(total, roi_amount.annual(), tolerance):
+            issues.append(SchemaIssue(
+                "warning", f"{path}.{node_id}",
+                f"{labels.get(node_id, node_id)} 直下の金額合計（年 {_fmt(total)}円）が ROI算定（{roi_amount.raw}、年 {_fmt(roi_amount.annual())}円）と合いません",
+            ))
+    return issues
+
+def check_project_quantities(project, path: str = "") -> dict:
+    """
+    1プロジェクト分の整合性チェック。{"roi": [...], "factors": [...], (section, depth_key): [...]} を返す。
+    """
+    results = {"roi": [], "factors": []}
+    for idx, line in enumerate(project.roi_lines or ()):
+        if isinstance(line, str):
+            results["roi"].extend(check_text(line, f"{path}ROI算定[{idx}]"))
+    for idx, line in enumerate(project.factors or ()):
+        if isinstance(line, str):
+            results["factors"].extend(check_text(line, f"{path}定量要素[{idx}]"))
+    for section_key, trees in project.roi_trees.items():
+        for depth_key, tree in trees.items():
+            tree_path = f"{path}{section_key}.{depth_key}"
+            results[(section_key, depth_key)] = (
+                check_tree_sums(tree.graph, tree_path)
+                + check_tree_against_roi(tree.graph, project.roi_lines, tree_path)
+            )
+    return results
+
+def check_file(file_path: str) -> list:
+    with open(file_path, "rb") as f:
+        projects, _ = load_document(f.read(), file_path)
+    issues = []
+    for proj_idx, project in enumerate(projects):
+        for found in check_project_quantities(project, f"{file_path}[{proj_idx}:{project.company}] ").values():
+            issues.extend(found)
+    return issues
+
+def main():
+    parser = argparse.ArgumentParser(description="ROI算定・定量要素・ツリーのラベルに含まれる数値の整合性をチェックする")
+    parser.add_argument("patterns", nargs="*", default=["json_data/*.json"])
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    paths = sorted({p for pattern in args.patterns for p in glob.glob(pattern)})
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        reports = list(executor.map(check_file, paths))
+    total = 0
+    for issues in reports:
+        for issue in issues:
+            total += 1
+            print(f"{issue.path}: {issue.message}")
+    print(f"{len(paths)} ファイル, {total} 件の不整合")
+
+if __name__ == "__main__":
+    main()
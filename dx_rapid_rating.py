@@ -0,0 +1,75 @@
+import functools
+import os
+
+from dx_model import split_section_key
+
+###############################################################################
+# Q&A の高速評価モード（キーボード操作のカスタムコンポーネント）
+###############################################################################
+# 1問ずつ表示し、G/B/S/C のキー操作で 良い/悪い/スキップ/コメント を付ける。
+# 評価はブラウザ側に貯めて batch_size 件ごとにまとめて返すため、
+# Streamlit の再実行は 1 評価ごとではなく 1 バッチごとに 1 回になる。
+#
+# 返り値: {"batch_id": str, "ratings": {ウィジェットキーの接頭辞: {"rating": "良い", "comment": "..."}}}
+#   接頭辞は "file{i}_proj{j}_{mode}_QAndA_{depth_key}_{qa_idx}_{q_idx}"（+ "_good_or_bad" / "_comment" が評価キー）
+
+_COMPONENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "components", "rapid_rating")
+
+@functools.lru_cache(maxsize=None)
+def _component():
+    # コンポーネントの登録は高速評価モードを初めて開いたときに行う
+    import streamlit.components.v1 as components
+    return components.declare_component("rapid_rating", path=_COMPONENT_DIR)
+
+UNRATED = "未評価"
+
+def qa_rating_items(documents: list, annotations: dict, unrated_only: bool = True, skip=None) -> list:
+    """
+    アップロード中の全プロジェクトの Q&A を、コンポーネントに渡す項目のリストにする。
+    skip(file_idx, proj_idx, suffix) が True を返す項目は除く（ほぼ重複の代表以外など）。
+    """
+    items = []
+    for file_idx, document in enumerate(documents):
+        for proj_idx, project in enumerate(document.projects):
+            company_name = project.company or f"Unknown_{proj_idx}"
+            for section_key, depths in project.qa.items():
+                mode = split_section_key(section_key)[1]
+                for depth_key, qa_items in depths.items():
+                    for qa_idx, qa_item in enumerate(qa_items):
+                        edge = " → ".join(x for x in (qa_item.parent, qa_item.child) if x)
+                        for q_idx, question in enumerate(qa_item.questions):
+                            suffix = f"_{mode}_QAndA_{depth_key}_{qa_idx}_{q_idx}"
+                            key = f"file{file_idx}_proj{proj_idx}{suffix}"
+                            rating = annotations.get(f"{key}_good_or_bad", UNRATED)
+                            if unrated_only and rating != UNRATED:
+                                continue
+                            if skip is not None and skip(file_idx, proj_idx, suffix):
+                                continue
+                            items.append({
+                                "key": key,
+                                "context": f"{company_name} / {section_key} / {depth_key} / {edge}",
+                                "qtype": question.qtype_raw or "",
+                                "question": question.question or "",
+                                "answer": question.answer or "",
+                                "rating": rating,
+                                "comment": annotations.get(f"{key}_comment", ""),
+                            })
+    return items
+
+def rapid_rating(items: list, batch_size: int = 10, idle_flush_seconds: float = 15.0, key: str = None):
+    """
+    コンポーネントを表示し、新しく届いたバッチ（無ければ None）を返す。
+    """
+    return _component()(items=items, batch_size=batch_size, idle_flush_seconds=idle_flush_seconds, key=key, default=None)
+
+def batch_to_annotations(batch: dict) -> dict:
+    """
+    コンポーネントから届いたバッチを、アノテーションのキーと値の dict にする。
+    """
+    values = {}
+    for key, entry in (batch or {}).get("ratings", {}).items():
+        if entry.get("rating"):
+            values[f"{key}_good_or_bad"] = entry["rating"]
+        if "comment" in entry:
+            values[f"{key}_comment"] = entry["comment"]
+    return values
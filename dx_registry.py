@@ -0,0 +1,244 @@
+import os
+import sys
+import threading
+import time
+from typing import NamedTuple
+
+from dx_corpus import EXTENSION as CORPUS_EXTENSION, CorpusReader
+from dx_keys import content_hash
+from dx_links import link_project
+from dx_quantity import check_project_quantities
+from dx_schema import IngestedFile, SchemaIssue, ingest_file
+from dx_tree_check import check_project
+
+###############################################################################
+# プロセス内で共有するコーパスの登録簿（参照カウント付き）
+###############################################################################
+# 同じファイルを複数のアノテータが開くと、これまではセッションごとに解析結果（Project の木・検査結果）を持っていた。
+# アップロード内容のハッシュをキーに解析結果を1つだけ持ち、各セッションはその参照とアノテーションだけを持つ。
+#
+# - 共有するもの: IngestedFile（Project は読み取り専用として扱う）、ツリー構造・数量の検査結果、Q&A とノードの索引
+#   検査結果と索引はプロジェクトを初めて表示するときに作る（.dxc のプロジェクトを取り込み時に全部読まないため）
+# - 参照: セッションが今表示しているアップロードの集合。retain() のたびに入れ替え、外れたものは参照を外す
+# - 終了の通知が無いセッションに備え、session_ttl 秒アクセスの無いセッションの参照は期限切れとして外す
+# - 参照の無いコーパスは、合計サイズがメモリ予算を超えたときに参照が外れた順に捨てる（参照中のものは捨てない）
+
+DEFAULT_BUDGET_MB = float(os.environ.get("DX_CORPUS_BUDGET_MB", "512"))
+DEFAULT_SESSION_TTL = float(os.environ.get("DX_CORPUS_SESSION_TTL", "3600"))
+
+class ProjectAnalysis(NamedTuple):
+    tree_checks: dict       # section_key -> depth_key -> TreeCheck
+    quantity_checks: dict   # {"roi": [...], "factors": [...], section_key: {depth_key: [...]}}
+    links: object           # ProjectLinks（Q&A の parentNode / childNode とツリーのノードの双方向の索引）
+
+class SharedCorpus(NamedTuple):
+    key: str
+    documents: tuple        # IngestedFile のタプル（JSON なら1件、.dxc なら中のファイル数）
+    analyses: object        # ProjectAnalyses（pid -> ProjectAnalysis。初めて引いたときに作る）
+    size: int               # 見積もりのバイト数（読み込み時点。あとから作った検査結果は含まない）
+
+class RegistryStats(NamedTuple):
+    corpora: int
+    referenced: int
+    sessions: int
+    size: int
+    budget: int
+    evicted: int
+
+def analyze_project(project) -> ProjectAnalysis:
+    """
+    1プロジェクトのツリー構造・数量の検査と、Q&A とノードの索引を作る。
+    """
+    tree_checks = {}
+    for check in check_project(project):
+        tree_checks.setdefault(check.section, {})[check.depth_key] = check
+    quantity_checks = {}
+    for key, issues in check_project_quantities(project).items():
+        if isinstance(key, tuple):
+            quantity_checks.setdefault(key[0], {})[key[1]] = issues
+        else:
+            quantity_checks[key] = issues
+    return ProjectAnalysis(tree_checks, quantity_checks, link_project(project))
+
+class ProjectAnalyses:
+    """
+    pid -> ProjectAnalysis。初めて引かれたときにそのプロジェクトだけを読んで作り、以後は使い回す。
+    複数セッション（スレッド）から使ってよい（同時に引かれたら2回作ることはあるが、結果は同じ）。
+    """
+
+    def __init__(self, documents):
+        self._positions = {
+            pid: (document, proj_idx)
+            for document in documents for proj_idx, pid in enumerate(document.project_ids)
+        }
+        self._analyses = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, pid: str) -> bool:
+        return pid in self._positions
+
+    def get(self, pid: str):
+        analysis = self._analyses.get(pid)
+        if analysis is None and pid in self._positions:
+            document, proj_idx = self._positions[pid]
+            analysis = analyze_project(document.projects[proj_idx])
+            with self._lock:
+                analysis = self._analyses.setdefault(pid, analysis)
+        return analysis
+
+def estimate_size(value) -> int:
+    """
+    オブジェクトが参照しているものを辿ったおおよそのバイト数（同じオブジェクトは1回だけ数える）。
+    """
+    seen = set()
+    total = 0
+    stack = [value]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or obj is None or isinstance(obj, (bool, type)):
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, memoryview):
+            # .dxc の列は同じバッファの切り出しなので、元のバッファ（bytes など）を1回だけ数える
+            total += sys.getsizeof(obj)
+            stack.append(obj.obj)
+            continue
+        total += sys.getsizeof(obj)
+        if isinstance(obj, (str, bytes, bytearray, int, float)):
+            continue
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        else:
+            for cls in type(obj).__mro__:
+                for name in getattr(cls, "__slots__", ()):
+                    stack.append(getattr(obj, name, None))
+            if hasattr(obj, "__dict__"):
+                stack.append(obj.__dict__)
+    return total
+
+def load_shared_corpus(raw: bytes, name: str, key: str = None) -> SharedCorpus:
+    """
+    アップロード内容（JSON / .dxc）を解析し、共有用の SharedCorpus にする（検査結果と索引はプロジェクトごとにあとで作る）。
+    """
+    key = key or content_hash(raw)
+    if name.endswith(CORPUS_EXTENSION):
+        try:
+            documents = tuple(CorpusReader(raw).documents())
+        except ValueError as e:
+            documents = (IngestedFile(name, key, [], [], [SchemaIssue("error", name, str(e))]),)
+    else:
+        documents = (ingest_file(raw, name),)
+    corpus = SharedCorpus(key, documents, ProjectAnalyses(documents), 0)
+    return corpus._replace(size=estimate_size(corpus))
+
+class _Entry:
+    __slots__ = ("corpus", "sessions", "released_at")
+
+    def __init__(self, corpus: SharedCorpus):
+        self.corpus = corpus
+        self.sessions = set()
+        self.released_at = time.monotonic()
+
+class CorpusRegistry:
+    """
+    キー（内容ハッシュ）-> SharedCorpus。複数セッション（スレッド）から使ってよい。
+    """
+
+    def __init__(self, budget_mb: float = DEFAULT_BUDGET_MB, session_ttl: float = DEFAULT_SESSION_TTL):
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.session_ttl = session_ttl
+        self._entries = {}
+        self._sessions = {}         # session_id -> (参照中のキーの集合, 最終アクセス時刻)
+        self._loading = {}          # key -> 読み込み中のロック（同じファイルを同時に2回解析しない）
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def _load(self, key: str, loader) -> SharedCorpus:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry.corpus
+            loading = self._loading.setdefault(key, threading.Lock())
+        with loading:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is None:
+                try:
+                    corpus = loader()
+                    with self._lock:
+                        entry = self._entries.setdefault(key, _Entry(corpus))
+                finally:
+                    # 解析に失敗しても読み込み中のロックは残さない（待っていたセッションは自分で読み込み直す）
+                    with self._lock:
+                        self._loading.pop(key, None)
+        return entry.corpus
+
+    def retain(self, session_id: str, loaders: dict) -> dict:
+        """
+        セッションが参照するコーパスを loaders のキーの集合に入れ替え、key -> SharedCorpus を返す。
+        loaders: key -> 引数なしで SharedCorpus を返す関数（まだ登録されていないときだけ呼ぶ）。
+        """
+        corpora = {key: self._load(key, loader) for key, loader in loaders.items()}
+        now = time.monotonic()
+        with self._lock:
+            previous, _ = self._sessions.get(session_id, (set(), now))
+            keys = set(corpora)
+            for key in previous - keys:
+                self._unref(key, session_id, now)
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    # 読み込みの直後に他のセッションの追い出しで消えた場合は登録し直す
+                    entry = self._entries[key] = _Entry(corpora[key])
+                entry.sessions.add(session_id)
+            self._sessions[session_id] = (keys, now)
+            self._expire_sessions(now)
+            self._evict()
+        return corpora
+
+    def release_session(self, session_id: str):
+        now = time.monotonic()
+        with self._lock:
+            keys, _ = self._sessions.pop(session_id, (set(), now))
+            for key in keys:
+                self._unref(key, session_id, now)
+            self._evict()
+
+    def _unref(self, key: str, session_id: str, now: float):
+        entry = self._entries.get(key)
+        if entry is not None and session_id in entry.sessions:
+            entry.sessions.discard(session_id)
+            if not entry.sessions:
+                entry.released_at = now
+
+    def _expire_sessions(self, now: float):
+        for session_id, (keys, last_seen) in list(self._sessions.items()):
+            if now - last_seen > self.session_ttl:
+                del self._sessions[session_id]
+                for key in keys:
+                    self._unref(key, session_id, now)
+
+    def _evict(self):
+        size = sum(entry.corpus.size for entry in self._entries.values())
+        if size <= self.budget:
+            return
+        idle = sorted((entry.released_at, key) for key, entry in self._entries.items() if not entry.sessions)
+        for _, key in idle:
+            if size <= self.budget:
+                break
+            size -= self._entries.pop(key).corpus.size
+            self.evicted += 1
+
+    def stats(self) -> RegistryStats:
+        with self._lock:
+            return RegistryStats(
+                corpora=len(self._entries),
+                referenced=sum(1 for entry in self._entries.values() if entry.sessions),
+                sessions=len(self._sessions),
+                size=sum(entry.corpus.size for entry in self._entries.values()),
+                budget=self.budget,
+                evicted=self.evicted,
+            )
@@ -0,0 +1,278 @@
+import argparse
+import glob
+import hashlib
+import os
+import pickle
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from dx_mermaid import (
+    normalize_mermaid_code,
+    sanitize_mermaid_labels,
+    parse_mermaid_node_labels,
+    parse_mermaid_edges,
+    find_roots,
+)
+from dx_model import split_section_key
+from dx_corpus import load_path
+
+###############################################################################
+# プロジェクトごとの描画バンドルのディスクキャッシュ
+###############################################################################
+# プロジェクトを表示するたびに行っていた決定的な処理
+#   - Mermaid コードの正規化・`(`→`（` の置き換え・ノード/辺の解析
+#   - Mermaid 図の HTML 生成（mermaid-py が mermaid.ink に問い合わせる）
+#   - ROI算定の整形、Q&A の平坦化
+# を1つのバンドルにまとめ、.render_cache/{コードのバージョン}/{プロジェクトID}.pkl に保存する。
+# プロジェクトIDは内容由来（dx_keys.project_id）なので、内容が同じなら再起動後もそのまま使える。
+# このモジュールや dx_mermaid・mermaid-py が変わるとバージョンが変わり、古いバンドルは使われない。
+#
+# 図の HTML 生成に失敗した場合（オフラインなど）は html=None で保存し、次回の読み込み時に再試行する。
+#
+# prefetch() は次に表示されそうなプロジェクトのバンドルをバックグラウンドのスレッドで先に作っておく。
+# 作成中のプロジェクトを get() した場合は、二重に作らずにその完了を待つ。
+
+DEFAULT_CACHE_DIR = ".render_cache"
+DEFAULT_PREFETCH_WORKERS = 4
+_VERSION_SOURCES = ("dx_render_cache.py", "dx_mermaid.py")
+
+class TreeBundle(NamedTuple):
+    sanitized_code: str     # `(`→`（` 置き換え後（ウィジェットキーの元になるノードIDはこちらから解析する）
+    normalized_code: str    # 表示用（インデントを揃えたもの）
+    node_label_map: dict
+    adjacency: dict
+    roots: list
+    html: str               # Mermaid 図の HTML（生成できなかった場合は None）
+    html_error: str
+
+class QAEntry(NamedTuple):
+    depth_key: str
+    qa_idx: int
+    q_idx: int
+    parent: str
+    child: str
+    qtype: str
+    question: str
+    answer: str
+
+class RenderBundle(NamedTuple):
+    pid: str
+    version: str
+    roi_markdown: str       # ROI算定の箇条書き（原文が無ければ None）
+    trees: dict             # section_key -> depth_key -> TreeBundle
+    qa: dict                # section_key -> [QAEntry, ...]
+
+def code_version() -> str:
+    """
+    バンドルの中身を決めるコード（このモジュール・dx_mermaid・mermaid-py）のバージョン。
+    """
+    digest = hashlib.sha256()
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in _VERSION_SOURCES:
+        with open(os.path.join(base_dir, name), "rb") as f:
+            digest.update(f.read())
+    try:
+        from importlib.metadata import version
+        digest.update(version("mermaid-py").encode("utf-8"))
+    except Exception:
+        pass
+    return digest.hexdigest()[:12]
+
+CODE_VERSION = code_version()
+
+def mermaid_html(normalized_code: str, diagram_title: str) -> tuple:
+    """
+    Mermaid 図の HTML を作る。(html, エラーメッセージ) を返し、失敗時の html は None。
+    """
+    try:
+        import mermaid as md
+        from mermaid.graph import Graph
+        rendered = md.Mermaid(Graph(diagram_title, normalized_code))
+        return rendered._repr_html_(), ""
+    except Exception as e:
+        return None, str(e)
+
+def build_tree_bundle(graph: str, diagram_title: str, render_html: bool = True) -> TreeBundle:
+    sanitized = sanitize_mermaid_labels(graph or "")
+    normalized = normalize_mermaid_code(sanitized)
+    adjacency = parse_mermaid_edges(sanitized)
+    html, error = mermaid_html(normalized, diagram_title) if render_html else (None, "")
+    return TreeBundle(sanitized, normalized, parse_mermaid_node_labels(sanitized), adjacency, find_roots(adjacency), html, error)
+
+def build_bundle(project, pid: str, render_html: bool = True) -> RenderBundle:
+    trees = {}
+    for section_key, depth_trees in project.roi_trees.items():
+        mode = split_section_key(section_key)[1]
+        trees[section_key] = {
+            depth_key: build_tree_bundle(tree.graph, f"{mode}_{depth_key}", render_html)
+            for depth_key, tree in depth_trees.items()
+        }
+    qa = {}
+    for section_key, depths in project.qa.items():
+        entries = []
+        for depth_key, qa_items in depths.items():
+            for qa_idx, qa_item in enumerate(qa_items):
+                for q_idx, question in enumerate(qa_item.questions):
+                    entries.append(QAEntry(
+                        depth_key, qa_idx, q_idx, qa_item.parent or "", qa_item.child or "",
+                        question.qtype_raw or "", question.question or "", question.answer or "",
+                    ))
+        qa[section_key] = entries
+    roi_markdown = None
+    if project.roi_lines is not None:
+        roi_markdown = "\n".join(f"- {item}" for item in project.roi_lines)
+    return RenderBundle(pid, CODE_VERSION, roi_markdown, trees, qa)
+
+class RenderCache:
+    """
+    メモリ（プロセス内）→ ディスク → 生成 の順にバンドルを探す。複数スレッドから使ってよい。
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, version: str = CODE_VERSION, prefetch_workers: int = DEFAULT_PREFETCH_WORKERS):
+        self.cache_dir = cache_dir
+        self.version = version
+        self.prefetch_workers = prefetch_workers
+        self._memory = {}
+        self._pending = {}      # pid -> 先読み中の Future
+        self._executor = None
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(os.path.join(cache_dir, version), exist_ok=True)
+
+    def _path(self, pid: str) -> str:
+        return os.path.join(self.cache_dir, self.version, f"{pid}.pkl")
+
+    def _read(self, pid: str):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(pid), "rb") as f:
+                bundle = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None
+        return bundle if isinstance(bundle, RenderBundle) and bundle.version == self.version else None
+
+    def _write(self, bundle: RenderBundle):
+        if not self.cache_dir:
+            return
+        path = self._path(bundle.pid)
+        tmp_path = f"{path}.tmp{os.getpid()}_{threading.get_ident()}"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(bundle, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def get(self, project, pid: str, render_html: bool = True) -> RenderBundle:
+        with self._lock:
+            bundle = self._memory.get(pid)
+            pending = self._pending.get(pid)
+        if bundle is not None:
+            return bundle
+        if pending is not None:
+            try:
+                return pending.result()
+            except Exception:
+                pass    # 先読みで失敗したものはこのスレッドで作り直す（例外はここで改めて上がる）
+        return self._load(project, pid, render_html)
+
+    def _load(self, project, pid: str, render_html: bool) -> RenderBundle:
+        bundle = self._read(pid)
+        if bundle is None:
+            bundle = build_bundle(project, pid, render_html)
+            self._write(bundle)
+        elif render_html:
+            # ディスクから読んだバンドルは、前回作れなかった図だけプロセスごとに1回作り直す
+            retried = self._retry_missing_html(bundle)
+            if retried is not bundle:
+                bundle = retried
+                self._write(bundle)
+        with self._lock:
+            self._memory[pid] = bundle
+        return bundle
+
+    def prefetch(self, jobs, render_html: bool = True) -> int:
+        """
+        (project, pid) の列のバンドルをバックグラウンドで作り始める（メモリにあるもの・作成中のものは除く）。
+        並べた順に着手するので、次に表示される順に渡す。着手を予約した件数を返す。
+        """
+        submitted = 0
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.prefetch_workers, thread_name_prefix="render-prefetch")
+            for project, pid in jobs:
+                if pid in self._memory or pid in self._pending:
+                    continue
+                self._pending[pid] = self._executor.submit(self._prefetch_one, project, pid, render_html)
+                submitted += 1
+        return submitted
+
+    def _prefetch_one(self, project, pid: str, render_html: bool) -> RenderBundle:
+        try:
+            return self._load(project, pid, render_html)
+        finally:
+            with self._lock:
+                self._pending.pop(pid, None)
+
+    def _retry_missing_html(self, bundle: RenderBundle) -> RenderBundle:
+        """
+        前回 HTML を作れなかった図だけ作り直す（すべて揃っていれば bundle をそのまま返す）。
+        """
+        missing = [
+            (section_key, depth_key)
+            for section_key, trees in bundle.trees.items()
+            for depth_key, tree in trees.items() if tree.html is None
+        ]
+        if not missing:
+            return bundle
+        trees = {section_key: dict(depth_trees) for section_key, depth_trees in bundle.trees.items()}
+        changed = False
+        for section_key, depth_key in missing:
+            tree = trees[section_key][depth_key]
+            html, error = mermaid_html(tree.normalized_code, depth_key)
+            if html is not None:
+                changed = True
+            trees[section_key][depth_key] = tree._replace(html=html, html_error=error)
+        return bundle._replace(trees=trees) if changed else bundle
+
+    def prune_stale_versions(self) -> int:
+        """
+        現在のバージョン以外のディレクトリを消し、消した数を返す。
+        """
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return 0
+        removed = 0
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name != self.version and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        return removed
+
+def main():
+    parser = argparse.ArgumentParser(description="描画バンドルのキャッシュを事前に作る（サーバ起動前のウォームアップ）")
+    parser.add_argument("patterns", nargs="*", default=["json_data/*.json"])
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--workers", type=int, default=8, help="図の生成は mermaid.ink への通信待ちなのでスレッドで並列化する")
+    parser.add_argument("--no-html", action="store_true", help="図の HTML を作らない（オフライン用）")
+    parser.add_argument("--prune", action="store_true", help="古いバージョンのキャッシュを消す")
+    args = parser.parse_args()
+
+    cache = RenderCache(args.cache_dir)
+    if args.prune:
+        print(f"古いバージョンのキャッシュを {cache.prune_stale_versions()} 件削除しました")
+    paths = sorted({p for pattern in args.patterns for p in glob.glob(pattern)})
+    jobs = []
+    for path in paths:
+        for document in load_path(path):
+            jobs.extend(zip(document.projects, document.project_ids))
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        bundles = list(executor.map(lambda job: cache.get(job[0], job[1], not args.no_html), jobs))
+    n_missing = sum(1 for b in bundles for trees in b.trees.values() for t in trees.values() if t.html is None)
+    print(f"{len(paths)} ファイル, {len(bundles)} プロジェクト, {time.monotonic() - started:.1f} 秒"
+          f"（バージョン {cache.version}, 図の HTML 未生成 {n_missing} 件）")
+
+if __name__ == "__main__":
+    main()
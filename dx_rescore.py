@@ -0,0 +1,188 @@
+import argparse
+import glob
+import hashlib
+import json
+import math
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+from dx_export import decode_export
+
+###############################################################################
+# 保存済みの寄与度評価からの ROI ツリー重要度の一括再計算
+###############################################################################
+# render_hierarchical_sliders は子ノードごとの3段階評価（低い/普通/高い）を数値に変換し、
+# 兄弟の合計で割った比率を親の重要度に掛けて _ratio / _factor を保存している。
+# 変換表や正規化の方法を変えると保存済みの _ratio / _factor が古くなるため、
+# アノテーションファイルに残っている _rating_text / _rating_numeric から UI を開かずに再計算する。
+#
+# 結果は {out_dir}/{設定のバージョン}/{元のファイル名}.json に、元と同じ形で書き出す
+# （設定のバージョンは変換表・正規化方法のハッシュ。同じ設定なら同じ場所に上書きされる）。
+
+FORMAT = "dx-rescore/1"
+RATING_WEIGHTS = {"低い": 1, "普通": 2, "高い": 3}
+# _rating_text が無い古いファイル用: 保存されている数値 -> 評価の段階
+NUMERIC_LEVELS = {1: "低い", 2: "普通", 3: "高い"}
+NORMALIZATIONS = ("sum", "softmax")
+
+RATING_KEY_PATTERN = re.compile(
+    r"^(?P<base>.*_roiTrees_(?P<depth>[^_]+)_(?P<root>[^_]+))_(?P<node>.+)_child_(?P<child>.+)_rating_(?P<field>numeric|text)$"
+)
+
+class ScoringConfig(NamedTuple):
+    weights: dict = RATING_WEIGHTS
+    normalization: str = "sum"      # "sum": 重み / 兄弟の重みの合計、"softmax": exp(重み / temperature) で正規化
+    temperature: float = 1.0
+
+    @property
+    def version(self) -> str:
+        payload = json.dumps(self._asdict(), ensure_ascii=False, sort_keys=True)
+        return "v" + hashlib.sha256(payload.encode("utf-8")).hexdigest()[:10]
+
+def load_config(path: str = "", weights_json: str = "", normalization: str = "", temperature: float = None) -> ScoringConfig:
+    """
+    JSON ファイル（{"weights": {...}, "normalization": ..., "temperature": ...}）とコマンドライン指定から設定を作る。
+    """
+    fields = ScoringConfig()._asdict()
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            fields.update({k: v for k, v in json.load(f).items() if k in fields})
+    if weights_json:
+        fields["weights"] = json.loads(weights_json)
+    if normalization:
+        fields["normalization"] = normalization
+    if temperature is not None:
+        fields["temperature"] = temperature
+    if fields["normalization"] not in NORMALIZATIONS:
+        raise ValueError(f"normalization は {NORMALIZATIONS} のいずれかです: {fields['normalization']}")
+    missing = set(NUMERIC_LEVELS.values()) - set(fields["weights"])
+    if missing:
+        raise ValueError(f"weights に {sorted(missing)} がありません")
+    return ScoringConfig(**fields)
+
+def _normalize(weights: list, config: ScoringConfig) -> list:
+    if config.normalization == "softmax":
+        exps = [math.exp(w / config.temperature) for w in weights]
+        total = sum(exps)
+        return [e / total for e in exps]
+    total = sum(weights)
+    if total <= 0:
+        return [1.0 / len(weights)] * len(weights)
+    return [w / total for w in weights]
+
+def collect_trees(annotations: dict) -> dict:
+    """
+    評価キーからツリーごとの {親ノード: [(子ノード, 段階), ...]} を組み立てる（子の順序はキーの出現順）。
+    戻り値: base -> (root, children)
+    """
+    trees = {}
+    for key, value in annotations.items():
+        match = RATING_KEY_PATTERN.match(key)
+        if not match:
+            continue
+        base, root, node, child, field = match.group("base", "root", "node", "child", "field")
+        level = value if field == "text" else NUMERIC_LEVELS.get(value)
+        _, children = trees.setdefault(base, (root, {}))
+        slots = children.setdefault(node, {})
+        # _rating_text があればそちらを優先する（数値は変換表の変更で意味が変わるため）
+        if field == "text" or child not in slots:
+            slots[child] = level
+    return {base: (root, {node: list(slots.items()) for node, slots in children.items()}) for base, (root, children) in trees.items()}
+
+def rescore_annotations(annotations: dict, config: ScoringConfig) -> tuple:
+    """
+    _rating_numeric / _ratio / _factor を再計算した新しい dict と、(ツリー数, 変わったキー数) を返す。
+    """
+    result = dict(annotations)
+    trees = collect_trees(annotations)
+    for base, (root, children) in trees.items():
+        stack = [(root, 1.0)]
+        visited = set()
+        while stack:
+            node, factor = stack.pop()
+            if node in visited:
+                continue
+            visited.add(node)
+            result[f"{base}_{node}_factor"] = factor
+            rated = [(child, level) for child, level in children.get(node, []) if level in config.weights]
+            if not rated:
+                continue
+            ratios = _normalize([config.weights[level] for _, level in rated], config)
+            for (child, level), ratio in zip(rated, ratios):
+                result[f"{base}_{node}_child_{child}_rating_numeric"] = config.weights[level]
+                result[f"{base}_{node}_child_{child}_ratio"] = ratio
+                stack.append((child, factor * ratio))
+    changed = sum(1 for key, value in result.items() if annotations.get(key) != value)
+    return result, len(trees), changed
+
+def _annotation_container(document):
+    """
+    ファイル内のアノテーション dict を返す（dx-annotations/2 形式・1社分の形式は "annotations"、旧形式はファイル全体）。
+    """
+    if isinstance(document, dict) and isinstance(document.get("annotations"), dict):
+        return document["annotations"]
+    if isinstance(document, dict) and all(isinstance(k, str) for k in document) and not document.get("DXProjects"):
+        return document
+    return None
+
+def rescore_file(path: str, config: ScoringConfig, out_dir: str) -> dict:
+    """
+    1ファイル分を再計算して書き出す（プロセスプールのワーカーから呼ばれる）。
+    """
+    with open(path, "rb") as f:
+        document = decode_export(f.read())
+    annotations = _annotation_container(document)
+    if annotations is None:
+        return {"file": path, "out": "", "trees": 0, "changed": 0, "error": "アノテーションが見つかりません"}
+    rescored, n_trees, changed = rescore_annotations(annotations, config)
+    if document is annotations:
+        output = rescored
+    else:
+        output = dict(document)
+        output["annotations"] = rescored
+        output["rescore"] = {"format": FORMAT, "version": config.version, "config": config._asdict(), "source": os.path.basename(path)}
+    target_dir = os.path.join(out_dir, config.version)
+    os.makedirs(target_dir, exist_ok=True)
+    name = os.path.basename(path)
+    if name.endswith(".gz"):
+        name = name[:-3]
+    out_path = os.path.join(target_dir, name)
+    tmp_path = f"{out_path}.tmp{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(output, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, out_path)
+    return {"file": path, "out": out_path, "trees": n_trees, "changed": changed, "error": ""}
+
+def rescore_corpus(paths: list, config: ScoringConfig, out_dir: str, workers: int = None) -> list:
+    if workers == 1 or len(paths) <= 1:
+        return [rescore_file(p, config, out_dir) for p in paths]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(rescore_file, paths, [config] * len(paths), [out_dir] * len(paths)))
+
+def main():
+    parser = argparse.ArgumentParser(description="保存済みの寄与度評価から ROI ツリーの _ratio / _factor を一括で再計算する")
+    parser.add_argument("patterns", nargs="+", help="アノテーションファイル（annotations_all*.json / *_annotations.json / .json.gz）")
+    parser.add_argument("--config", default="", help="設定の JSON ファイル")
+    parser.add_argument("--weights", default="", help='変換表の JSON（例: \'{"低い": 1, "普通": 2, "高い": 4}\'）')
+    parser.add_argument("--normalization", choices=NORMALIZATIONS, default="")
+    parser.add_argument("--temperature", type=float, default=None)
+    parser.add_argument("--out", default="rescored")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    config = load_config(args.config, args.weights, args.normalization, args.temperature)
+    paths = sorted({p for pattern in args.patterns for p in glob.glob(pattern)})
+    started = time.monotonic()
+    results = rescore_corpus(paths, config, args.out, args.workers)
+    for r in results:
+        if r["error"]:
+            print(f"{r['file']}: {r['error']}")
+    ok = [r for r in results if not r["error"]]
+    print(f"{len(ok)}/{len(results)} ファイル, ツリー {sum(r['trees'] for r in ok)} 本, 更新 {sum(r['changed'] for r in ok)} キー, "
+          f"{time.monotonic() - started:.1f} 秒 -> {os.path.join(args.out, config.version)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import re
+from typing import NamedTuple
+
+from dx_export import export_sort_key
+from dx_keys import EXPORT_FORMAT, split_stable_key, split_widget_key
+from dx_model import parse_depth, split_section_key
+
+###############################################################################
+# 過去のエクスポートからのアノテーション復元
+###############################################################################
+# 次の形式をまとめて読み込み、現在のウィジェットキーに対応づける。
+#   1) annotations_all.json（dx-annotations/2 形式: 安定キー。差分エクスポートは sequence 順に適用）
+#   2) {company}_annotations.json（1社分: file_idx / proj_idx / project_id / annotations）
+#   3) 旧形式の annotations_all.json（"file{i}_proj{j}_..." キーのフラットな dict）
+#   4) data2_A社_annotated.json のような、各プロジェクトに "annotation" ブロックを持つ DXProjects ファイル
+# 2) で project_id が無いもの、および 3) は位置（file_idx / proj_idx）で対応づける。
+
+_TREE_SUFFIX = re.compile(r"^_([^_]+)_roiTrees_(depth\d+)_")
+_QA_SUFFIX = re.compile(r"^_([^_]+)_QAndA_(Depth\d+)_(\d+)_(\d+)_")
+
+class ResumeReport(NamedTuple):
+    applied: dict     # ウィジェットキー -> 値
+    unmapped: list    # (読み込み元, キー) のリスト
+    sources: dict     # 読み込み元 -> 適用したキー数
+    sequence: int     # 読み込んだ安定キー形式エクスポートの最大 sequence（無ければ -1）
+
+def upgrade_legacy_suffix(suffix: str) -> str:
+    """
+    モード無しの旧キー（"_roiTrees_..." / "_QAndA_..."）を正規化後のキー（"_assignment_..."）に合わせる。
+    """
+    for kind in ("roiTrees", "QAndA"):
+        if suffix.startswith(f"_{kind}_"):
+            return f"_assignment{suffix}"
+    return suffix
+
+def annotation_anchors(project) -> set:
+    """
+    プロジェクトに存在するアノテーション対象の接頭辞（キーの後半部分）の集合。
+    """
+    anchors = {"_roi_"}
+    for section_key, trees in project.roi_trees.items():
+        mode = split_section_key(section_key)[1]
+        for depth_key in trees:
+            anchors.add(f"_{mode}_roiTrees_{depth_key}_")
+    for section_key, depths in project.qa.items():
+        mode = split_section_key(section_key)[1]
+        for depth_key, items in depths.items():
+            for item_idx, item in enumerate(items):
+                for q_idx in range(len(item.questions)):
+                    anchors.add(f"_{mode}_QAndA_{depth_key}_{item_idx}_{q_idx}_")
+    return anchors
+
+def _anchor_of(suffix: str):
+    if suffix.startswith("_roi_"):
+        return "_roi_"
+    match = _QA_SUFFIX.match(suffix) or _TREE_SUFFIX.match(suffix)
+    return match.group(0) if match else None
+
+class _Resolver:
+    def __init__(self, index, projects_by_pid: dict):
+        self.index = index
+        self.projects_by_pid = projects_by_pid
+        self._anchors = {}
+        self._pids_by_content = {}
+        for pid, project in projects_by_pid.items():
+            self._pids_by_content.setdefault((project.company, project.purpose), []).append(pid)
+
+    def anchors(self, pid: str) -> set:
+        if pid not in self._anchors:
+            self._anchors[pid] = annotation_anchors(self.projects_by_pid[pid])
+        return self._anchors[pid]
+
+    def resolve(self, pid: str, suffix: str):
+        """
+        (プロジェクトID, キー後半) を現在のウィジェットキーにする。対応先が無ければ None。
+        """
+        prefix = self.index.prefix_for(pid)
+        if prefix is None or pid not in self.projects_by_pid:
+            return None
+        suffix = upgrade_legacy_suffix(suffix)
+        if _anchor_of(suffix) not in self.anchors(pid):
+            return None
+        return prefix + suffix
+
+    def pids_for_content(self, company, purpose) -> list:
+        return self._pids_by_content.get((company, purpose), [])
+
+def _annotation_block_to_suffixes(annotation: dict) -> dict:
+    """
+    annotated ファイルの "annotation" ブロックを、キー後半 -> 値 の dict に展開する。
+    """
+    result = {}
+    roi = annotation.get("ROI評価") or {}
+    if "良いor悪い" in roi:
+        result["_roi_good_or_bad"] = roi["良いor悪い"]
+    if "コメント" in roi:
+        result["_roi_comment"] = roi["コメント"]
+    for depth_key, evaluation in (annotation.get("roiTrees評価") or {}).items():
+        base = f"_assignment_roiTrees_depth{parse_depth(depth_key)}"
+        result[f"{base}_good_or_bad"] = evaluation.get("良いor悪い", "未評価")
+        result[f"{base}_comment"] = evaluation.get("コメント", "")
+    for depth_key, items in (annotation.get("QAndA評価") or {}).items():
+        for item_idx, question_evals in enumerate(items):
+            for q_idx, evaluation in enumerate(question_evals):
+                base = f"_assignment_QAndA_Depth{parse_depth(depth_key)}_{item_idx}_{q_idx}"
+                result[f"{base}_good_or_bad"] = evaluation.get("良いor悪い", "未評価")
+                result[f"{base}_comment"] = evaluation.get("コメント", "")
+    return result
+
+def _apply_widget_keyed(resolver: _Resolver, annotations: dict, source: str, applied: dict, unmapped: list, pid=None) -> int:
+    """
+    "file{i}_proj{j}_..." キーの dict を適用する。pid が分かっていれば位置ではなく pid で対応づける。
+    """
+    count = 0
+    for key, value in annotations.items():
+        parts = split_widget_key(key)
+        target = None
+        if parts is not None:
+            target_pid = pid or resolver.index.project_id_for(parts[0], parts[1])
+            if target_pid is not None:
+                target = resolver.resolve(target_pid, parts[2])
+        if target is None:
+            unmapped.append((source, key))
+        else:
+            applied[target] = value
+            count += 1
+    return count
+
+def load_exports(named_documents: list, index, projects_by_pid: dict) -> ResumeReport:
+    """
+    (読み込み元の名前, 読み込んだ JSON) のリストを1回の走査で現在のウィジェットキーに対応づける。
+    index は dx_keys.AnnotationKeyIndex、projects_by_pid はプロジェクトID -> Project。
+    """
+    resolver = _Resolver(index, projects_by_pid)
+    applied = {}
+    unmapped = []
+    sources = {}
+    sequence = -1
+
+    for source, data in sorted(named_documents, key=export_sort_key):
+        count = 0
+        if not isinstance(data, dict):
+            unmapped.append((source, "<JSONのルートがdictではありません>"))
+        elif data.get("format") == EXPORT_FORMAT:
+            sequence = max(sequence, data.get("sequence", 0))
+            for stable_key in data.get("removed", []):
+                target = resolver.resolve(*split_stable_key(stable_key))
+                if target is not None:
+                    applied.pop(target, None)
+            for stable_key, value in data.get("annotations", {}).items():
+                pid, suffix = split_stable_key(stable_key)
+                target = resolver.resolve(pid, suffix)
+                if target is None:
+                    unmapped.append((source, stable_key))
+                else:
+                    applied[target] = value
+                    count += 1
+        elif "DXProjects" in data:
+            for proj_idx, project in enumerate(data["DXProjects"]):
+                annotation = project.get("annotation") if isinstance(project, dict) else None
+                if not annotation:
+                    continue
+                table = project.get("table") or {}
+                pids = resolver.pids_for_content(table.get("企業名"), table.get("課題・目的"))
+                suffixes = _annotation_block_to_suffixes(annotation)
+                if not pids:
+                    unmapped.extend((source, f"DXProjects[{proj_idx}]{suffix}") for suffix in suffixes)
+                for pid in pids:
+                    for suffix, value in suffixes.items():
+                        target = resolver.resolve(pid, suffix)
+                        if target is None:
+                            unmapped.append((source, f"{pid}{suffix}"))
+                        else:
+                            applied[target] = value
+                            count += 1
+        elif isinstance(data.get("annotations"), dict):
+            pid = data.get("project_id")
+            if pid is not None and pid not in index:
+                unmapped.extend((source, key) for key in data["annotations"])
+            else:
+                count = _apply_widget_keyed(resolver, data["annotations"], source, applied, unmapped, pid=pid)
+        else:
+            count = _apply_widget_keyed(resolver, data, source, applied, unmapped)
+        sources[source] = count
+
+    return ResumeReport(applied, unmapped, sources, sequence)
+
+def projects_by_id(documents: list) -> dict:
+    """
+    IngestedFile のリストから プロジェクトID -> Project を作る。
+    """
+    return {
+        pid: project
+        for document in documents
+        for project, pid in zip(document.projects, document.project_ids)
+    }
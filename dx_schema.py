@@ -0,0 +1,211 @@
+import json
+from typing import NamedTuple
+
+from dx_keys import content_hash, project_id
+from dx_model import parse_depth, projects_from_json
+
+###############################################################################
+# 取り込み時の検証・正規化
+###############################################################################
+# これまでのファイル形式（app7〜app17 が扱ってきたもの）をすべて次の正規形にそろえる。
+#
+#   {"DXProjects": [
+#       {"table": {...},
+#        "roiTrees_{mode}[_{suffix}]": {"depthN": {"graph": str, "importance_factors": list}},
+#        "QAndA_{mode}[_{suffix}]":    {"DepthN": [{"parentNode", "childNode", "questions"}]},
+#        ...その他のキー（annotation など）はそのまま}
+#   ]}
+#
+# - モード無しの旧形式 "roiTrees" / "QAndA" は "assignment" として扱う
+# - roiTrees の値が Mermaid 文字列のみの場合は {"graph": ..., "importance_factors": []} に包む
+# - 深さキーは roiTrees 側を "depthN"、QAndA 側を "DepthN" にそろえる
+# - 表の「目的を達成するための定量要素（目的の分解）」は「重要な」付きのキー名にそろえる
+
+MODES = ("assignment", "suggest")
+LEGACY_MODE = "assignment"
+FACTORS_KEY = "目的を達成するための重要な定量要素（目的の分解）"
+_FACTORS_ALIASES = ("目的を達成するための定量要素（目的の分解）",)
+
+class SchemaIssue(NamedTuple):
+    level: str  # "error" / "warning" / "info"
+    path: str
+    message: str
+
+class IngestedFile(NamedTuple):
+    name: str
+    file_hash: str
+    projects: list
+    project_ids: list
+    issues: list
+
+def _canonical_section_key(key: str, kind: str) -> str:
+    if key == kind:
+        return f"{kind}_{LEGACY_MODE}"
+    return key
+
+def _normalize_table(table, path: str, issues: list) -> dict:
+    if not isinstance(table, dict):
+        issues.append(SchemaIssue("error", path, "'table' がありません（dictを期待）"))
+        return None
+    result = {}
+    for key, value in table.items():
+        if key in _FACTORS_ALIASES:
+            if FACTORS_KEY in table:
+                result[key] = value
+                continue
+            issues.append(SchemaIssue("warning", f"{path}.{key}", f"キー名を '{FACTORS_KEY}' に変換しました"))
+            key = FACTORS_KEY
+        if key in (FACTORS_KEY, "ROI算定") and isinstance(value, str):
+            issues.append(SchemaIssue("warning", f"{path}.{key}", "文字列をリストに変換しました"))
+            value = [value]
+        result[key] = value
+    if "企業名" not in result:
+        issues.append(SchemaIssue("warning", path, "'企業名' がありません"))
+    return result
+
+def _normalize_roi_trees(section, path: str, issues: list) -> dict:
+    result = {}
+    for depth_key, tree in section.items():
+        tree_path = f"{path}.{depth_key}"
+        depth = parse_depth(depth_key)
+        if not depth:
+            issues.append(SchemaIssue("error", tree_path, "深さを判別できないキーです。スキップします"))
+            continue
+        canonical_key = f"depth{depth}"
+        if isinstance(tree, str):
+            tree = {"graph": tree, "importance_factors": []}
+        elif not isinstance(tree, dict):
+            issues.append(SchemaIssue("error", tree_path, "ツリーの形式が想定と異なります（dictまたは文字列を期待）。スキップします"))
+            continue
+        else:
+            tree = dict(tree)
+            tree.setdefault("importance_factors", [])
+        if not isinstance(tree.get("graph"), str) or not tree["graph"].strip():
+            issues.append(SchemaIssue("error", tree_path, "'graph' がありません。スキップします"))
+            continue
+        if canonical_key in result:
+            issues.append(SchemaIssue("warning", tree_path, f"'{canonical_key}' が重複しています。後の値を使います"))
+        result[canonical_key] = tree
+    return result
+
+def _normalize_q_and_a(section, path: str, issues: list) -> dict:
+    result = {}
+    for depth_key, items in section.items():
+        depth_path = f"{path}.{depth_key}"
+        depth = parse_depth(depth_key)
+        if not depth:
+            issues.append(SchemaIssue("error", depth_path, "深さを判別できないキーです。スキップします"))
+            continue
+        if not isinstance(items, list):
+            issues.append(SchemaIssue("error", depth_path, "Q&Aの形式が想定と異なります（listを期待）。スキップします"))
+            continue
+        normalized_items = []
+        for item_idx, item in enumerate(items):
+            item_path = f"{depth_path}[{item_idx}]"
+            if not isinstance(item, dict):
+                issues.append(SchemaIssue("error", item_path, "Q&A項目がdictではありません。スキップします"))
+                continue
+            item = dict(item)
+            item.setdefault("parentNode", "")
+            item.setdefault("childNode", "")
+            questions = item.get("questions")
+            if not isinstance(questions, list):
+                issues.append(SchemaIssue("warning", item_path, "'questions' がありません"))
+                questions = []
+            item["questions"] = [
+                {"questionType": q.get("questionType", ""), "question": q.get("question", ""), "answer": q.get("answer", ""),
+                 **{k: v for k, v in q.items() if k not in ("questionType", "question", "answer")}}
+                for q in questions if isinstance(q, dict)
+            ]
+            normalized_items.append(item)
+        result[f"Depth{depth}"] = normalized_items
+    return result
+
+def normalize_project(project, path: str, issues: list) -> dict:
+    """
+    1プロジェクト分を正規形に変換する。使えない場合は None を返す。
+    """
+    if not isinstance(project, dict):
+        issues.append(SchemaIssue("error", path, "プロジェクトがdictではありません。スキップします"))
+        return None
+    table = _normalize_table(project.get("table"), f"{path}.table", issues)
+    if table is None:
+        return None
+
+    result = {"table": table}
+    for key, value in project.items():
+        if key == "table":
+            continue
+        for kind in ("roiTrees", "QAndA"):
+            if key == kind or key.startswith(f"{kind}_"):
+                canonical_key = _canonical_section_key(key, kind)
+                section_path = f"{path}.{key}"
+                if not isinstance(value, dict):
+                    issues.append(SchemaIssue("error", section_path, "形式が想定と異なります（dictを期待）。スキップします"))
+                    break
+                if canonical_key != key:
+                    issues.append(SchemaIssue("info", section_path, f"旧形式のキーを '{canonical_key}' として扱います"))
+                if canonical_key in result:
+                    issues.append(SchemaIssue("warning", section_path, f"'{canonical_key}' が重複しています。後の値を使います"))
+                if kind == "roiTrees":
+                    result[canonical_key] = _normalize_roi_trees(value, section_path, issues)
+                else:
+                    result[canonical_key] = _normalize_q_and_a(value, section_path, issues)
+                break
+        else:
+            result[key] = value
+
+    for kind in ("roiTrees", "QAndA"):
+        for mode in MODES:
+            if not any(k.startswith(f"{kind}_{mode}") for k in result):
+                issues.append(SchemaIssue("info", path, f"'{mode}' 系の {kind} キーがありません"))
+    return result
+
+def normalize_document(data, source: str = "") -> tuple:
+    """
+    読み込んだ JSON を正規形の {"DXProjects": [...]} に変換し、(正規化後の dict, SchemaIssue のリスト) を返す。
+    DXProjects の無いファイルでも、プロジェクトのリストや単一プロジェクトであれば受け付ける。
+    """
+    issues = []
+    if isinstance(data, dict) and "DXProjects" in data:
+        projects = data["DXProjects"]
+    elif isinstance(data, list):
+        issues.append(SchemaIssue("info", source, "ルートがリストのため DXProjects として扱います"))
+        projects = data
+    elif isinstance(data, dict) and "table" in data:
+        issues.append(SchemaIssue("info", source, "単一プロジェクトとして扱います"))
+        projects = [data]
+    else:
+        issues.append(SchemaIssue("error", source, "'DXProjects' キーが見つかりません"))
+        return {"DXProjects": []}, issues
+
+    if not isinstance(projects, list):
+        issues.append(SchemaIssue("error", f"{source}.DXProjects", "DXProjects がlistではありません"))
+        return {"DXProjects": []}, issues
+
+    normalized = []
+    for proj_idx, project in enumerate(projects):
+        result = normalize_project(project, f"{source}.DXProjects[{proj_idx}]", issues)
+        if result is not None:
+            normalized.append(result)
+    return {"DXProjects": normalized}, issues
+
+def load_document(raw: bytes, source: str = "") -> tuple:
+    """
+    JSON バイト列を検証・正規化して (Project のリスト, SchemaIssue のリスト) を返す。
+    """
+    try:
+        data = json.loads(raw.decode("utf-8") if isinstance(raw, bytes) else raw)
+    except Exception as e:
+        return [], [SchemaIssue("error", source, f"JSONの読み込み中にエラーが発生しました: {e}")]
+    normalized, issues = normalize_document(data, source)
+    return projects_from_json(normalized), issues
+
+def ingest_file(raw: bytes, name: str) -> IngestedFile:
+    """
+    1ファイル分を取り込み、内容ハッシュと各プロジェクトの安定IDを付けて返す。
+    """
+    file_hash = content_hash(raw)
+    projects, issues = load_document(raw, name)
+    project_ids = [project_id(file_hash, p.company or "", idx) for idx, p in enumerate(projects)]
+    return IngestedFile(name, file_hash, projects, project_ids, issues)
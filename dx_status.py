@@ -0,0 +1,118 @@
+from dx_model import parse_depth, split_section_key
+
+###############################################################################
+# 評価状況の集計（ダッシュボード用の差分更新カウンタ）
+###############################################################################
+# 評価キー（"..._good_or_bad"）ごとに集計セル（ファイル × プロジェクト × セクション × questionType）を
+# 取り込み時に1回だけ割り当てておき、値が書き換わるたびにそのセルの件数だけを増減する。
+# 1回の変更は O(1) で、ダッシュボードを開いてもアノテーション全体を数え直さない。
+
+UNRATED = "未評価"
+RATINGS = ("良い", "悪い", UNRATED)
+ROI_SECTION = "ROI算定"
+
+class StatusCell:
+    __slots__ = ("file_name", "company", "section", "qtype", "counts")
+
+    def __init__(self, file_name: str, company: str, section: str, qtype: str):
+        self.file_name = file_name
+        self.company = company
+        self.section = section
+        self.qtype = qtype
+        self.counts = dict.fromkeys(RATINGS, 0)
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+def section_label(section_key: str, depth_key: str) -> str:
+    """
+    "roiTrees_assignment_cost_only" + "depth4" -> "ツリー assignment D4" のような列名。
+    """
+    kind, mode, _ = split_section_key(section_key)
+    return f"{'ツリー' if kind == 'roiTrees' else 'Q&A'} {mode} D{parse_depth(depth_key)}"
+
+class StatusCounters:
+    def __init__(self):
+        self.cells = {}
+        self._cell_of = {}      # 評価キー -> StatusCell
+        self._value_of = {}     # 評価キー -> 集計済みの値（RATINGS のいずれか）
+
+    def _cell(self, file_name: str, company: str, section: str, qtype: str = "") -> StatusCell:
+        key = (file_name, company, section, qtype)
+        cell = self.cells.get(key)
+        if cell is None:
+            cell = self.cells[key] = StatusCell(file_name, company, section, qtype)
+        return cell
+
+    def register(self, rating_key: str, cell: StatusCell, value: str = UNRATED):
+        if rating_key in self._cell_of:
+            # 同じモードの cost_only / 通常 のツリーなど、同じキーを共有するものは1件として数える
+            return
+        value = value if value in RATINGS else UNRATED
+        self._cell_of[rating_key] = cell
+        self._value_of[rating_key] = value
+        cell.counts[value] += 1
+
+    def update(self, rating_key: str, value: str) -> bool:
+        """
+        評価キーの値が変わったときに呼ぶ。集計対象のキーなら True。
+        """
+        cell = self._cell_of.get(rating_key)
+        if cell is None:
+            return False
+        value = value if value in RATINGS else UNRATED
+        previous = self._value_of[rating_key]
+        if previous != value:
+            cell.counts[previous] -= 1
+            cell.counts[value] += 1
+            self._value_of[rating_key] = value
+        return True
+
+    def rows(self) -> list:
+        """
+        セルごとの件数を dict のリストにする（描画時だけ呼ぶ。セル数に比例）。
+        """
+        return [
+            {
+                "file": cell.file_name,
+                "company": cell.company,
+                "section": cell.section,
+                "questionType": cell.qtype,
+                "total": cell.total,
+                "good": cell.counts["良い"],
+                "bad": cell.counts["悪い"],
+                "unrated": cell.counts[UNRATED],
+            }
+            for cell in self.cells.values()
+        ]
+
+def build_counters(documents: list, annotations: dict) -> StatusCounters:
+    """
+    アップロード中の全プロジェクトの評価キーを登録し、現在のアノテーションから初期値を数える。
+    """
+    counters = StatusCounters()
+    for file_idx, document in enumerate(documents):
+        for proj_idx, project in enumerate(document.projects):
+            prefix = f"file{file_idx}_proj{proj_idx}"
+            company = project.company or f"Unknown_{proj_idx}"
+            key = f"{prefix}_roi_good_or_bad"
+            counters.register(key, counters._cell(document.name, company, ROI_SECTION), annotations.get(key, UNRATED))
+            for section_key, trees in project.roi_trees.items():
+                mode = split_section_key(section_key)[1]
+                for depth_key in trees:
+                    key = f"{prefix}_{mode}_roiTrees_{depth_key}_good_or_bad"
+                    cell = counters._cell(document.name, company, section_label(section_key, depth_key))
+                    counters.register(key, cell, annotations.get(key, UNRATED))
+            for section_key, depths in project.qa.items():
+                mode = split_section_key(section_key)[1]
+                for depth_key, qa_items in depths.items():
+                    for qa_idx, qa_item in enumerate(qa_items):
+                        for q_idx, question in enumerate(qa_item.questions):
+                            key = f"{prefix}_{mode}_QAndA_{depth_key}_{qa_idx}_{q_idx}_good_or_bad"
+                            cell = counters._cell(
+                                document.name, company, section_label(section_key, depth_key),
+                                question.qtype.name if question.qtype else (question.qtype_raw or "UNKNOWN"),
+                            )
+                            counters.register(key, cell, annotations.get(key, UNRATED))
+    return counters
@@ -0,0 +1,220 @@
+import argparse
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+from dx_mermaid import parse_mermaid_structure
+from dx_model import split_section_key
+from dx_schema import SchemaIssue, load_document
+
+###############################################################################
+# ROIツリーの構造チェック（prompt.txt の深さルールに対する自動検査）
+###############################################################################
+# prompt.txt の要件:
+#   - 深さ1 は利益（Gain）、深さ2 は コスト削減 / 売上増加 で固定（ここから枝を伸ばす）
+#   - depth3 / depth4 / depth5 の各バリエーションは、実際にその深さまで伸びていること
+# に加え、孤立ノード・ID の重複・循環・複数の親・importance_factors の合計を検査する。
+#
+# importance_factors は「子の合計 = 1（親に対する比率）」で書かれたファイルと
+# 「子の合計 = 親の値（絶対値）」で書かれたファイルがあるため、どちらかを満たせば可とする。
+
+GAIN_IDS = {"Gain", "利益"}
+DEPTH2_NODES = {"CostReduction": "コスト削減", "RevenueIncrease": "売上増加"}
+FACTOR_TOLERANCE = 0.02
+
+class TreeCheck(NamedTuple):
+    section: str
+    depth_key: str
+    expected_depth: int
+    max_depth: int
+    n_nodes: int
+    max_branching: int
+    issues: list  # SchemaIssue のリスト
+
+def _expected_depth2(section_key: str) -> set:
+    suffix = split_section_key(section_key)[2]
+    if "cost_only" in suffix:
+        return {"CostReduction"}
+    if "revenue_only" in suffix:
+        return {"RevenueIncrease"}
+    return set(DEPTH2_NODES)
+
+def check_tree(graph: str, importance_factors, section_key: str, depth_key: str, expected_depth: int, path: str = "") -> TreeCheck:
+    """
+    1つの ROI ツリー（Mermaid コード）を検査する。
+    """
+    issues = []
+    path = path or f"{section_key}.{depth_key}"
+
+    def flag(level: str, message: str):
+        issues.append(SchemaIssue(level, path, message))
+
+    definitions, edges = parse_mermaid_structure(graph or "")
+    labels = {}
+    for node_id, label in definitions:
+        if node_id in labels and labels[node_id] != label:
+            flag("error", f"ノードID '{node_id}' が異なるラベルで重複定義されています（'{labels[node_id]}' / '{label}'）")
+        labels.setdefault(node_id, label)
+
+    children = {}
+    parents = {}
+    seen_edges = set()
+    for parent, child in edges:
+        if (parent, child) in seen_edges:
+            flag("warning", f"辺 {parent} --> {child} が重複しています")
+            continue
+        seen_edges.add((parent, child))
+        children.setdefault(parent, []).append(child)
+        parents.setdefault(child, []).append(parent)
+    for child, ps in parents.items():
+        if len(ps) > 1:
+            flag("error", f"ノード '{child}' に複数の親があります（{', '.join(ps)}）")
+
+    nodes = list(dict.fromkeys([n for n, _ in definitions] + [n for e in edges for n in e]))
+    connected = {n for e in edges for n in e}
+    for node in nodes:
+        if node not in connected:
+            flag("error", f"ノード '{node}' はどの辺にも接続されていない孤立ノードです")
+
+    roots = [n for n in nodes if n in connected and n not in parents]
+    if not roots:
+        if edges:
+            flag("error", "ルートが見つかりません（循環しています）")
+    elif len(roots) > 1:
+        flag("error", f"ルートが複数あります（{', '.join(roots)}）")
+    root = roots[0] if roots else None
+    if root is not None and root not in GAIN_IDS and labels.get(root) != "Gain":
+        flag("error", f"ルートが Gain（利益）ではありません: '{root}'")
+
+    # 深さ・循環（ルートからの DFS）
+    depth_of = {}
+    max_depth = 0
+    for start in roots:
+        stack = [(start, 1, (start,))]
+        while stack:
+            node, depth, trail = stack.pop()
+            if node in depth_of:
+                continue
+            depth_of[node] = depth
+            max_depth = max(max_depth, depth)
+            for child in children.get(node, []):
+                if child in trail:
+                    flag("error", f"循環があります: {' --> '.join(trail + (child,))}")
+                    continue
+                stack.append((child, depth + 1, trail + (child,)))
+    for node in nodes:
+        if node in connected and node not in depth_of:
+            flag("error", f"ノード '{node}' はルートから到達できません（循環の一部）")
+
+    # 深さ2 の固定ノード
+    if root is not None:
+        depth2 = set(children.get(root, []))
+        for node_id in _expected_depth2(section_key):
+            if node_id not in depth2:
+                flag("error", f"深さ2のノード {node_id}[{DEPTH2_NODES[node_id]}] がありません")
+            elif labels.get(node_id) != DEPTH2_NODES[node_id]:
+                flag("warning", f"{node_id} のラベルが '{DEPTH2_NODES[node_id]}' ではありません: '{labels.get(node_id)}'")
+        for node_id in sorted(depth2 - set(DEPTH2_NODES)):
+            flag("error", f"深さ2に固定ノード以外のノード '{node_id}' があります")
+
+    if expected_depth and max_depth != expected_depth:
+        flag("error", f"実際の深さが {max_depth} です（{depth_key} では {expected_depth} を期待）")
+    if expected_depth:
+        shallow = [n for n, d in depth_of.items() if d < expected_depth and not children.get(n)]
+        if shallow:
+            flag("info", f"深さ {expected_depth} に届いていない葉ノード: {', '.join(shallow)}")
+
+    # importance_factors
+    factors = {}
+    for item in importance_factors or []:
+        node, value = (item["node"], item.get("importance_factor")) if isinstance(item, dict) else item
+        if node not in labels and node not in connected:
+            flag("error", f"importance_factors のノード '{node}' がツリーにありません")
+        factors[node] = value
+    for parent, kids in children.items():
+        values = [factors[k] for k in kids if k in factors]
+        if not values:
+            continue
+        if len(values) != len(kids):
+            flag("warning", f"'{parent}' の子の一部に importance_factor がありません")
+            continue
+        total = sum(values)
+        parent_value = factors.get(parent)
+        if abs(total - 1.0) > FACTOR_TOLERANCE and (parent_value is None or abs(total - parent_value) > FACTOR_TOLERANCE):
+            expected = "1" if parent_value is None else f"1 または 親の値 {parent_value}"
+            flag("error", f"'{parent}' の子の importance_factor の合計が {total:.2f} です（{expected} を期待）")
+
+    max_branching = max((len(v) for v in children.values()), default=0)
+    return TreeCheck(section_key, depth_key, expected_depth, max_depth, len(nodes), max_branching, issues)
+
+def check_project(project, path: str = "") -> list:
+    """
+    Project のすべての ROI ツリーを検査し、TreeCheck のリストを返す。
+    """
+    results = []
+    for section_key, trees in project.roi_trees.items():
+        for depth_key, tree in trees.items():
+            factors = tree.importance_factors if isinstance(tree.importance_factors, (list, tuple)) else None
+            results.append(check_tree(
+                tree.graph, factors, section_key, depth_key, tree.depth,
+                path=f"{path}.{section_key}.{depth_key}" if path else "",
+            ))
+    return results
+
+def check_file(file_path: str) -> dict:
+    """
+    1ファイル分を検査する（プロセスプールのワーカーから呼ばれる）。
+    """
+    with open(file_path, "rb") as f:
+        projects, schema_issues = load_document(f.read(), file_path)
+    report = {"file": file_path, "schema_issues": [issue._asdict() for issue in schema_issues], "projects": []}
+    for proj_idx, project in enumerate(projects):
+        checks = check_project(project, f"{file_path}.DXProjects[{proj_idx}]")
+        report["projects"].append({
+            "proj_idx": proj_idx,
+            "company_name": project.company,
+            "trees": [
+                {**check._asdict(), "issues": [issue._asdict() for issue in check.issues]}
+                for check in checks
+            ],
+        })
+    return report
+
+def check_corpus(paths: list, workers: int = None) -> list:
+    """
+    ファイル群をプロセスプールで並列に検査する。
+    """
+    if workers == 1 or len(paths) <= 1:
+        return [check_file(p) for p in paths]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(check_file, paths, chunksize=max(1, len(paths) // ((workers or os.cpu_count() or 1) * 4))))
+
+def main():
+    parser = argparse.ArgumentParser(description="ROIツリーの構造をコーパス全体で検査する")
+    parser.add_argument("patterns", nargs="*", default=["json_data/*.json"])
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out", default="", help="検査結果を書き出す JSON ファイル")
+    args = parser.parse_args()
+
+    paths = sorted({p for pattern in args.patterns for p in glob.glob(pattern)})
+    reports = check_corpus(paths, args.workers)
+    n_trees = n_flagged = 0
+    for report in reports:
+        for project in report["projects"]:
+            for tree in project["trees"]:
+                n_trees += 1
+                errors = [i for i in tree["issues"] if i["level"] == "error"]
+                if errors:
+                    n_flagged += 1
+                    print(f"{report['file']} [{project['company_name']}] {tree['section']}.{tree['depth_key']}")
+                    for issue in errors:
+                        print(f"    - {issue['message']}")
+    print(f"{len(paths)} ファイル, {n_trees} ツリー中 {n_flagged} ツリーに問題があります")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+import argparse
+import glob
+import json
+import math
+import os
+import time
+import unicodedata
+from functools import lru_cache
+from typing import NamedTuple
+
+from dx_corpus import load_path
+from dx_mermaid import find_roots, normalize_mermaid_code, parse_mermaid_structure, sanitize_mermaid_labels
+from dx_model import split_section_key
+
+###############################################################################
+# ROI ツリー同士の木の編集距離（assignment と suggest・深さバリエーション同士の比較）
+###############################################################################
+# Mermaid の graph コードから作った順序付き木（parse_mermaid_structure で日本語のノードIDも拾う）に Zhang–Shasha のアルゴリズムを使う。
+#   - 削除・挿入のコストは 1、置き換えのコストは 1 - （ラベルの正規化した文字 bigram の Dice 係数）
+#   - 根が複数ある木は、ラベルの無い仮の根の下にまとめてから比べる（仮の根は結果に出さない）
+#   - 距離に加えて、どのノードがどのノードに対応したか（一致・置き換え・削除・挿入）の対応付けを返す
+#     （左右に並べて色分けして表示するのに使う）
+#
+# 計算量は O(n1 * n2 * min(深さ1, 葉の数1) * min(深さ2, 葉の数2))。ROI ツリーは数ノード〜数十ノードなので
+# 1組あたり 1 ミリ秒前後。コーパス全体の比較では、同じ graph の組を使い回し（lru_cache）、
+# CLI ではファイル単位でプロセスプールに分ける。
+
+MATCH, RENAME, DELETE, INSERT = "match", "rename", "delete", "insert"
+MATCH_SIMILARITY = 0.999       # これ以上似ていれば「一致」として扱う
+
+class OrderedTree(NamedTuple):
+    ids: tuple              # 後順（postorder）のノードID（1 始まりにするため先頭は None、最後が根）
+    labels: tuple           # 比較用に正規化したラベル
+    grams: tuple            # 正規化したラベルの文字 bigram の集合
+    display: tuple          # 表示用のラベル
+    leftmost: tuple         # 各ノードの最も左の葉の番号
+    keyroots: tuple
+
+    @property
+    def size(self) -> int:
+        """仮の根を除いたノード数。"""
+        return len(self.ids) - 2
+
+class AlignedNode(NamedTuple):
+    op: str                 # MATCH / RENAME / DELETE / INSERT
+    left_id: str            # INSERT のときは None
+    right_id: str           # DELETE のときは None
+    left_label: str
+    right_label: str
+    cost: float
+
+class TreeDiff(NamedTuple):
+    distance: float
+    normalized: float       # distance / max(ノード数)（0 なら同じ木、1 に近いほど別物）
+    alignment: tuple        # AlignedNode のタプル（左の木の後順に削除・対応、そのあとに右の木の後順に挿入）
+
+class TreePair(NamedTuple):
+    file_idx: int
+    proj_idx: int
+    company: str
+    kind: str               # "mode"（assignment と suggest）/ "depth"（同じセクションの深さ違い）
+    left_section: str
+    left_depth: str
+    right_section: str
+    right_depth: str
+
+class RankedPair(NamedTuple):
+    pair: TreePair
+    distance: float
+    normalized: float
+    left_size: int
+    right_size: int
+
+def normalize_label(label: str) -> str:
+    return "".join(unicodedata.normalize("NFKC", label or "").lower().split())
+
+def _grams(text: str) -> frozenset:
+    if len(text) < 2:
+        return frozenset((text,)) if text else frozenset()
+    return frozenset(text[i:i + 2] for i in range(len(text) - 1))
+
+def label_similarity(a: str, b: str, ga: frozenset = None, gb: frozenset = None) -> float:
+    """
+    正規化済みラベルの文字 bigram の Dice 係数（0〜1）。ga / gb は bigram の集合（計算済みなら渡す）。
+    """
+    if a == b:
+        return 1.0
+    ga = _grams(a) if ga is None else ga
+    gb = _grams(b) if gb is None else gb
+    if not ga or not gb:
+        return 0.0
+    return 2.0 * len(ga & gb) / (len(ga) + len(gb))
+
+@lru_cache(maxsize=4096)
+def ordered_tree(graph: str) -> OrderedTree:
+    """
+    Mermaid の graph コードを後順の配列にする（同じコードは使い回す）。
+    """
+    definitions, edges = parse_mermaid_structure(graph or "")
+    node_labels = {}
+    for node_id, label in definitions:
+        node_labels.setdefault(node_id, label)
+    adjacency = {}
+    for parent, child in edges:
+        children = adjacency.setdefault(parent, [])
+        if child not in children:
+            children.append(child)
+        adjacency.setdefault(child, [])
+    roots = find_roots(adjacency)
+    ids, labels, display, leftmost = [None], [None], [None], [None]
+
+    # 仮の根（None）の下に根を並べ、再帰を使わずに後順で辿る（2回目以降に出てきたノードは辿らない）
+    stack = [(None, False)]
+    seen = set()
+    first_leaf = []
+    while stack:
+        node_id, expanded = stack.pop()
+        if not expanded:
+            children = roots if node_id is None else [c for c in adjacency[node_id] if c not in seen]
+            seen.update(children)
+            stack.append((node_id, True))
+            first_leaf.append(len(ids))
+            stack.extend((child, False) for child in reversed(children))
+            continue
+        label = "" if node_id is None else node_labels.get(node_id, node_id)
+        ids.append(node_id)
+        labels.append(normalize_label(label))
+        display.append(label)
+        leftmost.append(first_leaf.pop())
+    # 同じ最も左の葉を持つノードのうち最も後ろのものが keyroot
+    last_with_leftmost = {}
+    for i in range(1, len(ids)):
+        last_with_leftmost[leftmost[i]] = i
+    return OrderedTree(
+        tuple(ids), tuple(labels), tuple(_grams(label) if label is not None else None for label in labels),
+        tuple(display), tuple(leftmost), tuple(sorted(last_with_leftmost.values())),
+    )
+
+def _forest_distance(left: OrderedTree, right: OrderedTree, i: int, j: int, treedist: list, rename: list) -> list:
+    """
+    部分木 i（左）と j（右）の森の距離の表を埋める（表の [x - a + 1][y - b + 1] が森 a..x と b..y の距離）。
+    """
+    l1, l2 = left.leftmost, right.leftmost
+    a, b = l1[i], l2[j]
+    rows, cols = i - a + 2, j - b + 2
+    fd = [[0.0] * cols for _ in range(rows)]
+    for x in range(1, rows):
+        fd[x][0] = fd[x - 1][0] + 1.0
+    for y in range(1, cols):
+        fd[0][y] = fd[0][y - 1] + 1.0
+    for x in range(a, i + 1):
+        fx = x - a + 1
+        row, prev = fd[fx], fd[fx - 1]
+        rename_x, treedist_x = rename[x], treedist[x]
+        for y in range(b, j + 1):
+            fy = y - b + 1
+            best = min(prev[fy] + 1.0, row[fy - 1] + 1.0)
+            if l1[x] == a and l2[y] == b:
+                value = min(best, prev[fy - 1] + rename_x[y])
+                treedist_x[y] = value
+            else:
+                value = min(best, fd[l1[x] - a][l2[y] - b] + treedist_x[y])
+            row[fy] = value
+    return fd
+
+def tree_diff(left_graph: str, right_graph: str, align: bool = True) -> TreeDiff:
+    """
+    2つの Mermaid の graph コードの木の編集距離と、ノードの対応付け（align=False なら距離だけ求め、対応付けは空）。
+    """
+    left, right = ordered_tree(left_graph or ""), ordered_tree(right_graph or "")
+    n, m = len(left.ids) - 1, len(right.ids) - 1
+    rename = [None] + [
+        [0.0] + [
+            1.0 - label_similarity(left.labels[x], right.labels[y], left.grams[x], right.grams[y])
+            for y in range(1, m + 1)
+        ]
+        for x in range(1, n + 1)
+    ]
+    treedist = [[0.0] * (m + 1) for _ in range(n + 1)]
+    for i in left.keyroots:
+        for j in right.keyroots:
+            _forest_distance(left, right, i, j, treedist, rename)
+
+    distance = treedist[n][m]
+    normalized = distance / max(left.size, right.size, 1)
+    if not align:
+        return TreeDiff(distance, normalized, ())
+
+    # 対応付けの復元（森の表を作り直しながら、削除・挿入・対応を後ろから辿る）
+    aligned = []
+    stack = [(n, m)]
+    while stack:
+        i, j = stack.pop()
+        fd = _forest_distance(left, right, i, j, treedist, rename)
+        a, b = left.leftmost[i], right.leftmost[j]
+        x, y = i, j
+        while x >= a or y >= b:
+            current = fd[x - a + 1][y - b + 1]
+            if x >= a and math.isclose(current, fd[x - a][y - b + 1] + 1.0, abs_tol=1e-9):
+                aligned.append((x, None))
+                x -= 1
+            elif y >= b and math.isclose(current, fd[x - a + 1][y - b] + 1.0, abs_tol=1e-9):
+                aligned.append((None, y))
+                y -= 1
+            elif left.leftmost[x] == a and right.leftmost[y] == b:
+                aligned.append((x, y))
+                x, y = x - 1, y - 1
+            else:
+                stack.append((x, y))
+                x, y = left.leftmost[x] - 1, right.leftmost[y] - 1
+
+    # 左の木の後順（削除・対応）のあとに、右の木の後順で挿入を並べる
+    aligned.sort(key=lambda pair: (pair[0] is None, pair[0] or 0, pair[1] or 0))
+    alignment = []
+    for x, y in aligned:
+        # 仮の根は結果に出さない（仮の根と対応した実在のノードは削除・挿入として扱う）
+        x, y = (None if x == n else x), (None if y == m else y)
+        if x is None and y is None:
+            continue
+        if y is None:
+            alignment.append(AlignedNode(DELETE, left.ids[x], None, left.display[x], None, 1.0))
+        elif x is None:
+            alignment.append(AlignedNode(INSERT, None, right.ids[y], None, right.display[y], 1.0))
+        else:
+            cost = rename[x][y]
+            op = MATCH if 1.0 - cost >= MATCH_SIMILARITY else RENAME
+            alignment.append(AlignedNode(op, left.ids[x], right.ids[y], left.display[x], right.display[y], cost))
+    return TreeDiff(distance, normalized, tuple(alignment))
+
+###############################################################################
+# 比較する組とコーパス全体の順位付け
+###############################################################################
+def tree_pairs(project, file_idx: int = 0, proj_idx: int = 0) -> list:
+    """
+    プロジェクト内で比べる木の組。
+    - 同じ深さの assignment と suggest（セクション名のモード以外の部分が同じもの同士）
+    - 同じセクション内で隣り合う深さ（depth3 と depth4、depth4 と depth5）
+    """
+    company = project.company or f"Unknown_{proj_idx}"
+    pairs = []
+    by_variant = {}
+    for section_key in project.roi_trees:
+        kind, mode, suffix = split_section_key(section_key)
+        by_variant.setdefault(suffix, {})[mode] = section_key
+    for modes in by_variant.values():
+        left_key, right_key = modes.get("assignment"), modes.get("suggest")
+        if left_key is None or right_key is None:
+            continue
+        for depth_key in project.roi_trees[left_key]:
+            if depth_key in project.roi_trees[right_key]:
+                pairs.append(TreePair(file_idx, proj_idx, company, "mode", left_key, depth_key, right_key, depth_key))
+    for section_key, trees in project.roi_trees.items():
+        depth_keys = sorted(trees, key=lambda depth_key: trees[depth_key].depth)
+        for shallow, deep in zip(depth_keys, depth_keys[1:]):
+            pairs.append(TreePair(file_idx, proj_idx, company, "depth", section_key, shallow, section_key, deep))
+    return pairs
+
+def pair_graphs(project, pair: TreePair) -> tuple:
+    return project.roi_trees[pair.left_section][pair.left_depth].graph, project.roi_trees[pair.right_section][pair.right_depth].graph
+
+def rank_pairs(documents: list, kind: str = None) -> list:
+    """
+    全プロジェクトの木の組を、正規化した距離の大きい順（食い違いの大きい順）に並べる。
+    """
+    ranked = []
+    for file_idx, document in enumerate(documents):
+        for proj_idx, project in enumerate(document.projects):
+            for pair in tree_pairs(project, file_idx, proj_idx):
+                if kind is not None and pair.kind != kind:
+                    continue
+                left_graph, right_graph = pair_graphs(project, pair)
+                diff = tree_diff(left_graph, right_graph, align=False)
+                ranked.append(RankedPair(
+                    pair, diff.distance, diff.normalized,
+                    ordered_tree(left_graph or "").size, ordered_tree(right_graph or "").size,
+                ))
+    ranked.sort(key=lambda r: (-r.normalized, -r.distance))
+    return ranked
+
+###############################################################################
+# 色分け表示用の Mermaid コード
+###############################################################################
+_STYLES = {
+    DELETE: "fill:#fdd,stroke:#c00",
+    INSERT: "fill:#dfd,stroke:#080",
+    RENAME: "fill:#ffe9b3,stroke:#c80",
+}
+
+def highlighted_code(graph: str, alignment: tuple, side: str) -> str:
+    """
+    対応付けに従って、削除（左のみ）・挿入（右のみ）・置き換えのノードに色を付けた Mermaid コード。
+    side: "left" / "right"
+    """
+    code = normalize_mermaid_code(sanitize_mermaid_labels(graph or ""))
+    classes = {}
+    for node in alignment:
+        node_id = node.left_id if side == "left" else node.right_id
+        if node_id is not None and node.op in _STYLES:
+            classes.setdefault(node.op, []).append(node_id)
+    lines = [code]
+    for op, node_ids in classes.items():
+        lines.append(f"    classDef {op} {_STYLES[op]}")
+        lines.append(f"    class {','.join(node_ids)} {op}")
+    return "\n".join(lines)
+
+###############################################################################
+# CLI
+###############################################################################
+def rank_file(path: str) -> list:
+    """
+    1ファイル分の組を比べる（プロセスプールのワーカーから呼ばれる）。
+    """
+    name = os.path.basename(path)
+    rows = []
+    for ranked in rank_pairs(load_path(path)):
+        row = ranked._asdict()
+        row["pair"] = ranked.pair._replace(company=f"{name} / {ranked.pair.company}")._asdict()
+        rows.append(row)
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="ROIツリー同士の木の編集距離を計算し、食い違いの大きい組から表示する")
+    parser.add_argument("patterns", nargs="*", default=["json_data/*.json"])
+    parser.add_argument("--kind", choices=["mode", "depth"], help="mode: assignment と suggest / depth: 深さ違い")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out", default="", help="全組の結果を書き出す JSON ファイル")
+    args = parser.parse_args()
+
+    paths = sorted({p for pattern in args.patterns for p in glob.glob(pattern)})
+    started = time.monotonic()
+    if args.workers == 1 or len(paths) <= 1:
+        results = [rank_file(p) for p in paths]
+    else:
+        # multiprocessing の読み込みは app17 の起動時間に効くので、CLI で並列化するときだけ読み込む
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            results = list(executor.map(rank_file, paths))
+    ranked = [r for rows in results for r in rows if args.kind is None or r["pair"]["kind"] == args.kind]
+    ranked.sort(key=lambda r: (-r["normalized"], -r["distance"]))
+    print(f"{len(paths)} ファイル, {len(ranked)} 組を比較（{time.monotonic() - started:.2f} 秒）")
+    for r in ranked[:args.top]:
+        pair = r["pair"]
+        print(f"{r['normalized']:.2f} ({r['distance']:.1f})  {pair['company']}  "
+              f"{pair['left_section']}.{pair['left_depth']} ↔ {pair['right_section']}.{pair['right_depth']}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(ranked, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()